@@ -1,10 +1,12 @@
-import time
-from typing import List, Dict
+import asyncio
+from typing import List
 
 from discord.ext import commands
 from discord.ext.commands import command
 
 import util
+from emoji_scheduler import EmojiScheduler
+from metrics import metrics
 
 # Fungucide#7029 -> 227541695225397250
 admins = [227541695225397250]
@@ -16,6 +18,17 @@ class AdminCog(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        self.scheduler = EmojiScheduler(bot)
+        self._resumed = False
+        metrics.gauge('emoji_jobs', lambda: len(self.scheduler.tasks))
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # on_ready fires again after reconnects, jobs only need resuming once
+        if self._resumed:
+            return
+        self._resumed = True
+        await self.scheduler.resume()
 
     async def cog_check(self, ctx):
         return ctx.author.id in admins and ctx.guild.id in control_server
@@ -26,65 +39,56 @@ class AdminCog(commands.Cog):
 
     @command(name='makeemojitable')
     async def make_emoji_table(self, ctx):
-        util.db.make_emoji_table()
+        await util.adb.make_emoji_table()
         await ctx.send('Created emoji table')
 
     @command(name='getemojis')
     async def get_emojis(self, ctx, *args: List[str]):
-        added = []
-        added.extend(util.get_character_emojis(True))
+        loop = asyncio.get_event_loop()
+        entries = await loop.run_in_executor(None, util.get_character_emoji_entries)
+        added = await util.adb.add_emojis(entries, True)
         await ctx.send(f'Obtained {len(added)} emojis:\n' + ', '.join(added))
 
-    @command(name='addemojis')
+    @command(name='addemojis', help='Uploads emojis that have not been uploaded yet in the background. '
+                                    'Usage: !addemojis [-reload] [-category <categories> | <names>]')
     async def add_emojis(self, ctx, *args):
         reload = args and len(args) >= 1 and args[0] in ['-reload', '-r']
         if reload:
             args = args[1:]
         if not args:
             args = ['-category', 'character']
-        added = 0
-        await ctx.send("Starting Upload")
         if args[0] in ['-category', '-c']:
-            args = args[1:]
-            await self.add_emojis_category(ctx, args, reload)
+            categories, names = list(args[1:]), []
         else:
-            for item in args:
-                emoji_info = util.db.get_emoji(item)
-                await self._add_emoji(ctx, emoji_info, emoji_info['category'], reload)
-                added += 1
-
-        await ctx.send(f'Created {added} emojis.')
+            categories, names = [], list(args)
+        await self.scheduler.submit(ctx, 'create', categories, names, bool(reload))
 
-    async def _add_emoji(self, ctx, entry: Dict[str, str], category: str, reload: bool):
-        time.sleep(10)
-        if reload:
-            file_name = util.download_images(entry['url'], entry['name'], category)
-        else:
-            file_name = f'{category}/{entry["name"]}.png'
-        image = open(file_name, 'rb')
-        emoji = await ctx.guild.create_custom_emoji(image=image.read(),
-                                                    name=entry['name'].replace(' ', '').replace('-', ''))
-        util.db.set_emoji_discord_id(entry['name'], f'<:{emoji.name}:{emoji.id}>')
-        await ctx.send(f'{entry["name"]}: <:{emoji.name}:{emoji.id}>')
-
-    async def add_emojis_category(self, ctx, categories: List[str], reload: bool):
-        added = 0
-        for category in categories:
-            entries = util.db.get_category_emoji(category)
-            for entry in entries:
-                self._add_emoji(ctx, entry, category, reload)
-                added += 1
-        return added
-
-    @command(name='clearemojis')
+    @command(name='clearemojis', help='Deletes every emoji in this server in the background')
     async def clear_emoji(self, ctx):
-        emojis = await ctx.guild.fetch_emojis()
-        count = 0;
-        for emoji in emojis:
-            time.sleep(10)
-            await emoji.delete()
-            count += 1
-        await ctx.send(f'Deleted {count} emojis.')
+        await self.scheduler.submit(ctx, 'delete', [], [], False)
+
+    @command(name='emojijobs')
+    async def emoji_jobs(self, ctx):
+        if not self.scheduler.statuses:
+            await ctx.send('No emoji jobs running.')
+            return
+        await ctx.send('\n'.join(f'Emoji job {job_id}: {status.text or "queued"}'
+                                 for job_id, status in self.scheduler.statuses.items()))
+
+    @command(name='perf', help='Shows command and upstream latencies, error counts, queue depths and cache hit rates')
+    async def perf(self, ctx):
+        lines = metrics.summary()
+        if not lines:
+            await ctx.send('No metrics recorded yet.')
+            return
+        # Stay under Discord's 2000 character message limit
+        message = ''
+        for line in lines:
+            if len(message) + len(line) + 1 > 1900:
+                await ctx.send(f'```\n{message}```')
+                message = ''
+            message += line + '\n'
+        await ctx.send(f'```\n{message}```')
 
     @command(name='testaddemoji')
     async def test_add_emoji(self, ctx):
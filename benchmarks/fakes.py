@@ -0,0 +1,247 @@
+"""
+Local stand-ins for Discord, genshinstats and api.genshin.dev, each with configurable latency and errors
+"""
+
+import asyncio
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Dict
+
+import genshinstats as gs
+
+from benchmarks import fixtures
+
+
+def delay(latency: float, rng: random.Random) -> float:
+    """
+    returns: latency seconds give or take half, so requests do not all finish in lockstep
+    """
+    return latency * rng.uniform(0.5, 1.5)
+
+
+# HoYoLAB names genshin.dev shortens in its ids
+GENSHIN_DEV_IDS = {
+    'Kaedehara Kazuha': 'kazuha',
+    'Kamisato Ayaka': 'ayaka',
+    'Kujou Sara': 'sara',
+    'Raiden Shogun': 'raiden',
+    'Sangonomiya Kokomi': 'kokomi',
+    'Traveler': 'traveler-anemo',
+}
+
+
+def genshin_dev_id(name: str) -> str:
+    """
+    returns: the id genshin.dev gives the character HoYoLAB calls name
+    """
+    return GENSHIN_DEV_IDS.get(name, name.lower().replace(' ', '-'))
+
+
+class FakeGenshinstats:
+    """
+    Has the genshinstats functions the bot uses, answered from the fixtures after sleeping for latency seconds.
+    error_rate of calls raise TooManyRequests, the error HoYoLAB gives when an account is overused.
+    """
+
+    errors = gs.errors
+
+    def __init__(self, latency: float, error_rate: float, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._user_stats = fixtures.user_stats()
+        self._abyss = fixtures.spiral_abyss()
+
+    def _call(self, endpoint: str):
+        # Called from the bot's worker threads
+        with self._lock:
+            self.calls[endpoint] += 1
+            wait = delay(self.latency, self._rng)
+            fail = self._rng.random() < self.error_rate
+        time.sleep(wait)
+        if fail:
+            raise gs.errors.TooManyRequests(f'Injected error on {endpoint}')
+
+    def get_record_card(self, uid: int, cookie=None):
+        self._call('record_card')
+        return {**fixtures.record_card(), 'game_role_id': str(700000000 + uid), 'nickname': f'Player{uid}'}
+
+    def get_user_stats(self, uid, cookie=None):
+        self._call('user_stats')
+        return self._user_stats
+
+    def get_characters(self, uid, character_ids=None, lang='en-us', cookie=None):
+        self._call('characters')
+        return self._user_stats['characters']
+
+    def get_spiral_abyss(self, uid, previous=False, cookie=None):
+        self._call('spiral_abyss')
+        return self._abyss
+
+    def search(self, keyword: str, size: int = 20):
+        self._call('search')
+        return [{
+            'uid': str(uid),
+            'nickname': f'{keyword}{uid}',
+            'introduce': '',
+            'avatar_url': fixtures.ICON,
+        } for uid in range(1, 4)]
+
+
+def genshin_dev_payloads() -> Dict[str, any]:
+    """
+    returns: endpoint -> response of every genshin.dev endpoint the bot requests, for the fixture characters
+    """
+    characters = [genshin_dev_id(name) for name in fixtures.CHARACTERS]
+    materials = fixtures.talent_materials()
+    return {
+        '/characters': characters,
+        '/materials/talent-book': {
+            'freedom': {'characters': characters, 'items': materials['talent-book']},
+        },
+        '/materials/talent-boss': {
+            'dvalins-plume': {'name': materials['boss-material'][0]['name'], 'characters': characters},
+        },
+        '/materials/common-ascension': {
+            'slime': {'characters': characters, 'items': materials['common-ascension-material']},
+        },
+    }
+
+
+class FakeGenshinDev:
+    """
+    HTTP server on localhost answering like api.genshin.dev, error_rate of requests get a 500
+    """
+
+    def __init__(self, latency: float, error_rate: float, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._payloads = {endpoint: json.dumps(data).encode() for endpoint, data in genshin_dev_payloads().items()}
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self._server.server_port}'
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                with fake._lock:
+                    fake.calls[self.path] += 1
+                    wait = delay(fake.latency, fake._rng)
+                    fail = fake._rng.random() < fake.error_rate
+                time.sleep(wait)
+                body = fake._payloads.get(self.path)
+                if fail or body is None:
+                    self.send_response(500 if fail else 404)
+                    self.end_headers()
+                    return
+                etag = f'"{hash(body)}"'
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeMessage:
+
+    _ids = itertools.count(1)
+
+    def __init__(self, discord: 'FakeDiscord'):
+        self.discord = discord
+        self.id = next(self._ids)
+
+    async def edit(self, **kwargs):
+        await self.discord.call('edit')
+
+    async def add_reaction(self, emoji):
+        await self.discord.call('reaction')
+
+    async def remove_reaction(self, emoji, member):
+        await self.discord.call('reaction')
+
+    async def clear_reactions(self):
+        await self.discord.call('reaction')
+
+    async def delete(self, delay=None):
+        await self.discord.call('delete')
+
+
+class FakeDiscord:
+    """
+    Counts and delays every Discord API call the commands make
+    """
+
+    def __init__(self, latency: float, seed: int = 0):
+        self.latency = latency
+        self.calls = Counter()
+        self._rng = random.Random(seed)
+        self.http = SimpleNamespace(request=self._request)
+
+    async def call(self, kind: str):
+        self.calls[kind] += 1
+        await asyncio.sleep(delay(self.latency, self._rng))
+
+    async def _request(self, route, **kwargs):
+        await self.call('send')
+        return {'id': next(FakeMessage._ids)}
+
+    async def wait_for(self, event, check=None, timeout=None):
+        # Nobody reacts to paginators
+        raise asyncio.TimeoutError
+
+    def get_guild(self, guild_id):
+        return None
+
+    def get_channel(self, channel_id):
+        return None
+
+
+class FakeContext:
+    """
+    The parts of commands.Context the cogs use
+    """
+
+    def __init__(self, discord: FakeDiscord, user_id: int, guild_id: int = 1, channel_id: int = 1):
+        self.bot = discord
+        self.author = SimpleNamespace(id=user_id, display_name=f'User{user_id}', bot=False)
+        # No members are cached, as without the members intent
+        self.guild = SimpleNamespace(id=guild_id, name=f'Guild{guild_id}', members=[])
+        self.me = SimpleNamespace(id=0, display_name='Bot', bot=True)
+        self.channel = SimpleNamespace(id=channel_id,
+                                       permissions_for=lambda member: SimpleNamespace(manage_messages=True))
+        self.message = FakeMessage(discord)
+
+    async def send(self, content=None, **kwargs):
+        await self.bot.call('send')
+        return FakeMessage(self.bot)
@@ -0,0 +1,135 @@
+"""
+Payloads shaped like genshinstats and genshin.dev responses for the largest accounts: every character
+with a full artifact set and all 12 abyss floors cleared. They are built deterministically so runs compare.
+"""
+
+import random
+from typing import Dict, List
+
+CHARACTERS = [
+    'Albedo', 'Aloy', 'Amber', 'Barbara', 'Beidou', 'Bennett', 'Chongyun', 'Diluc', 'Diona', 'Eula', 'Fischl',
+    'Ganyu', 'Hu Tao', 'Jean', 'Kaedehara Kazuha', 'Kaeya', 'Kamisato Ayaka', 'Keqing', 'Klee', 'Kujou Sara',
+    'Lisa', 'Mona', 'Ningguang', 'Noelle', 'Qiqi', 'Raiden Shogun', 'Razor', 'Rosaria', 'Sangonomiya Kokomi',
+    'Sayu', 'Sucrose', 'Tartaglia', 'Thoma', 'Traveler', 'Venti', 'Xiangling', 'Xiao', 'Xingqiu', 'Xinyan',
+    'Yanfei', 'Yoimiya', 'Zhongli', 'Gorou', 'Arataki Itto', 'Yun Jin', 'Shenhe',
+]
+ELEMENTS = ['Anemo', 'Cryo', 'Electro', 'Geo', 'Hydro', 'Pyro']
+ARTIFACT_POSITIONS = ['Flower of Life', 'Plume of Death', 'Sands of Eon', 'Goblet of Eonothem', 'Circlet of Logos']
+ARTIFACT_SETS = ['Gladiator\'s Finale', 'Wanderer\'s Troupe', 'Noblesse Oblige', 'Emblem of Severed Fate',
+                 'Crimson Witch of Flames', 'Blizzard Strayer']
+ICON = 'https://upload-os-bbs.mihoyo.com/game_record/genshin/character_icon/UI_AvatarIcon_Side.png'
+SEED = 20211018
+
+
+def artifact(rng: random.Random, position: int) -> Dict[str, any]:
+    set_name = rng.choice(ARTIFACT_SETS)
+    return {
+        'id': rng.randrange(10 ** 5),
+        'name': f'{set_name} {ARTIFACT_POSITIONS[position].split()[0]}',
+        'pos_name': ARTIFACT_POSITIONS[position].lower(),
+        'pos': position + 1,
+        'rarity': 5,
+        'level': 20,
+        'icon': ICON,
+        'set': {
+            'id': ARTIFACT_SETS.index(set_name),
+            'name': set_name,
+            'effects': [
+                {'pieces': 2, 'effect': f'{set_name} two piece bonus, increases a stat by 18%.'},
+                {'pieces': 4, 'effect': f'{set_name} four piece bonus, a much longer description of what '
+                                        f'happens when four pieces are equipped, at most once every 10s.'},
+            ],
+        },
+    }
+
+
+def character(rng: random.Random, i: int, name: str) -> Dict[str, any]:
+    return {
+        'id': 10000002 + i,
+        'name': name,
+        'alt_name': None,
+        'rarity': rng.choice([4, 5]),
+        'element': rng.choice(ELEMENTS),
+        'level': rng.choice([1, 20, 40, 50, 60, 70, 80, 90]),
+        'friendship': rng.randint(1, 10),
+        'constellation': rng.randint(0, 6),
+        'icon': ICON,
+        'image': ICON,
+        'weapon': {
+            'id': rng.randrange(10 ** 5),
+            'name': f'Weapon {i}',
+            'rarity': rng.choice([3, 4, 5]),
+            'type': 'Sword',
+            'level': 90,
+            'ascension': 6,
+            'refinement': rng.randint(1, 5),
+            'icon': ICON,
+        },
+        'artifacts': [artifact(rng, position) for position in range(len(ARTIFACT_POSITIONS))],
+    }
+
+
+def record_card() -> Dict[str, any]:
+    return {
+        'game_role_id': '700000001',
+        'nickname': 'Benchmark',
+        'level': 60,
+        'region_name': 'America Server',
+    }
+
+
+def characters() -> List[Dict[str, any]]:
+    rng = random.Random(SEED)
+    return [character(rng, i, name) for i, name in enumerate(CHARACTERS)]
+
+
+def user_stats() -> Dict[str, any]:
+    return {
+        'stats': {'achievements': 600, 'active_days': 400, 'characters': len(CHARACTERS), 'spiral_abyss': '12-3'},
+        'characters': characters(),
+        'explorations': [{'name': f'Region {i}', 'explored': 100.0} for i in range(6)],
+    }
+
+
+def spiral_abyss() -> Dict[str, any]:
+    rng = random.Random(SEED)
+    return {
+        'season': 40,
+        'season_start_time': '2021-10-01',
+        'season_end_time': '2021-10-16',
+        'stats': {'total_battles': 30, 'total_wins': 24, 'max_floor': '12-3', 'total_stars': 36},
+        'character_ranks': {
+            rank: [{'name': name, 'value': rng.randint(1, 100)} for name in rng.sample(CHARACTERS, 4)]
+            for rank in ['most_played', 'most_kills', 'strongest_strike', 'most_damage_taken',
+                         'most_bursts_used', 'most_skills_used']
+        },
+        'floors': [{
+            'floor': floor,
+            'stars': 9,
+            'max_stars': 9,
+            'chambers': [{
+                'chamber': chamber,
+                'stars': 3,
+                'max_stars': 3,
+                'battles': [{
+                    'half': half,
+                    'characters': [{'name': name} for name in rng.sample(CHARACTERS, 4)],
+                } for half in (1, 2)],
+            } for chamber in (1, 2, 3)],
+        } for floor in range(1, 13)],
+    }
+
+
+def talent_materials() -> Dict[str, List[Dict[str, any]]]:
+    """
+    returns: one character's entry of GenshinDevData.talent_materials
+    """
+    return {
+        'talent-book': [{'name': f'{prefix} Freedom', 'rarity': rarity}
+                        for prefix, rarity in [('Teachings of', 2), ('Guide to', 3), ('Philosophies of', 4)]],
+        'boss-material': [{'name': 'Dvalin\'s Plume', 'rarity': 5}],
+        'common-ascension-material': [{'name': name, 'rarity': rarity}
+                                      for name, rarity in [('Slime Condensate', 1), ('Slime Secretions', 2),
+                                                           ('Slime Concentrate', 3)]],
+        'crown': [{'name': 'Crown of Insight', 'rarity': 5}],
+    }
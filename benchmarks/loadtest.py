@@ -0,0 +1,190 @@
+"""
+End-to-end load test: concurrent users run a mix of GenshinCog and AdminCog commands against fake Discord,
+genshinstats and genshin.dev backends, then throughput, tail latency and upstream amplification are reported.
+
+Usage, from the repository root:
+    python -m benchmarks.loadtest --users 100 --duration 30 --upstream-latency 0.3 --upstream-error-rate 0.01
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Tuple
+
+from benchmarks.fakes import FakeContext, FakeDiscord, FakeGenshinDev, FakeGenshinstats, genshin_dev_id
+from benchmarks import fixtures
+
+# (weight, name, function of (rng, player uid) returning the command's arguments), roughly what servers run
+COMMAND_MIX: List[Tuple[int, str, Callable[[random.Random, int], List[str]]]] = [
+    (30, 'stats', lambda rng, uid: [str(uid)]),
+    (10, 'stats', lambda rng, uid: ['-me']),
+    (20, 'characters', lambda rng, uid: [str(uid)]),
+    (10, 'characters', lambda rng, uid: [str(uid), rng.choice(fixtures.CHARACTERS).split()[-1]]),
+    (15, 'abyss', lambda rng, uid: [str(uid)]),
+    (5, 'search', lambda rng, uid: [f'Player{uid}']),
+    (10, 'talents', lambda rng, uid: [genshin_dev_id(rng.choice(fixtures.CHARACTERS))]),
+    (3, 'talents', lambda rng, uid: [genshin_dev_id(name) for name in rng.sample(fixtures.CHARACTERS, 3)] + ['6']),
+    (2, 'link', lambda rng, uid: [str(uid)]),
+    (1, 'unlink', lambda rng, uid: []),
+    (1, 'perf', lambda rng, uid: []),
+    (1, 'leaderboard', lambda rng, uid: [rng.choice(['abyss', 'achievements', 'days', 'characters'])]),
+    (1, 'compare', lambda rng, uid: [str(uid), str(rng.randint(1, 50)), '-me']),
+]
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def setup(args):
+    """
+    Points the bot at the fakes and loads the cogs, the modules read their configuration at import
+    returns: (name -> (cog, command), fake genshinstats, fake genshin.dev, fake discord, the GenshinCog)
+    """
+    workdir = tempfile.mkdtemp(prefix='loadtest')
+    os.environ['DATABASE_FILE'] = os.path.join(workdir, 'loadtest.db')
+    os.environ['GENSHIN_DEV_MIRROR'] = os.path.join(workdir, 'genshin_dev_mirror.json')
+    os.environ['GENSHIN_COOKIES'] = ','.join(f'{uid}:token{uid}' for uid in range(1, args.accounts + 1))
+
+    genshin_dev = FakeGenshinDev(args.genshin_dev_latency, args.genshin_dev_error_rate, args.seed)
+    genshin_dev.start()
+    os.environ['GENSHIN_DEV_ENDPOINT'] = genshin_dev.url
+
+    import admin_cog
+    import cookie_pool
+    import genshin_cog
+    import genshin_data
+    from genshin_dev_data import GenshinDevData
+
+    genshinstats = FakeGenshinstats(args.upstream_latency, args.upstream_error_rate, args.seed)
+    genshin_data.gs = cookie_pool.gs = genshinstats
+    GenshinDevData.GENSHIN_DEV_URL = genshin_dev.url
+
+    discord = FakeDiscord(args.discord_latency, args.seed)
+    genshin = genshin_cog.GenshinCog(discord)
+    admin = admin_cog.AdminCog(discord)
+    command_map = {}
+    for cog in (genshin, admin):
+        for command in cog.get_commands():
+            command_map[command.name] = (cog, command)
+    return command_map, genshinstats, genshin_dev, discord, genshin
+
+
+async def invoke(cog, command, ctx, args: List[str]) -> bool:
+    """
+    Runs a command the way the bot does, through the cog's hooks, errors go to the cog's error handler
+    returns: whether the command succeeded
+    """
+    from discord.ext import commands
+    ctx.command = command
+    ctx.args = [cog, ctx, *args]
+    try:
+        await cog.cog_before_invoke(ctx)
+    except commands.CommandError:
+        return False
+    try:
+        await command.callback(cog, ctx, *args)
+    except Exception as e:
+        await cog.cog_command_error(ctx, commands.CommandInvokeError(e))
+        return False
+    finally:
+        await cog.cog_after_invoke(ctx)
+    return True
+
+
+async def user(user_id: int, args, command_map, deadline: float, results: Dict[str, List], errors: Dict[str, int],
+               guild_results: Dict[str, List], discord: FakeDiscord):
+    rng = random.Random(args.seed * 100003 + user_id)
+    # Users are spread over guilds the same way, guild 1 being the busiest
+    guild_id = rng.choices(range(1, args.guilds + 1), [1 / (i + 1) for i in range(args.guilds)])[0]
+    guild_latencies = guild_results['guild 1' if guild_id == 1 else 'other guilds']
+    weights = [weight for weight, _, _ in COMMAND_MIX]
+    # A few popular players get most of the lookups
+    player_weights = [1 / (i + 1) for i in range(args.players)]
+    while time.monotonic() < deadline:
+        _, name, make_args = rng.choices(COMMAND_MIX, weights)[0]
+        uid = rng.choices(range(1, args.players + 1), player_weights)[0]
+        cog, command = command_map[name]
+        ctx = FakeContext(discord, user_id, guild_id)
+        start = time.perf_counter()
+        if not await invoke(cog, command, ctx, make_args(rng, uid)):
+            errors[name] += 1
+        results[name].append(time.perf_counter() - start)
+        guild_latencies.append(results[name][-1])
+        if args.think_time:
+            await asyncio.sleep(rng.expovariate(1 / args.think_time))
+
+
+async def run(args):
+    command_map, genshinstats, genshin_dev, discord, genshin = setup(args)
+    # Let the background credential check finish so its calls are not counted
+    await genshin.check_accounts.get_task()
+    genshinstats.calls.clear()
+
+    results = defaultdict(list)
+    errors = defaultdict(int)
+    # Latencies of the busiest guild's commands and everyone else's, to see the scheduler keep them apart
+    guild_results = defaultdict(list)
+    start = time.monotonic()
+    await asyncio.gather(*[user(user_id, args, command_map, start + args.duration, results, errors, guild_results,
+                                discord)
+                           for user_id in range(args.users)])
+    elapsed = time.monotonic() - start
+    genshin.cog_unload()
+    genshin_dev.stop()
+    report(elapsed, results, errors, guild_results, genshinstats, genshin_dev, discord)
+
+
+def report(elapsed: float, results: Dict[str, List[float]], errors: Dict[str, int],
+           guild_results: Dict[str, List[float]], genshinstats: FakeGenshinstats, genshin_dev: FakeGenshinDev,
+           discord: FakeDiscord):
+    total = sum(len(latencies) for latencies in results.values())
+    all_latencies = [latency for latencies in results.values() for latency in latencies]
+    print(f'{total} commands in {elapsed:.1f}s: {total / elapsed:.1f} commands/sec')
+    print(f'{"command":<12} {"count":>7} {"errors":>7} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+    for name, latencies in sorted(results.items()) + [('all', all_latencies)] + sorted(guild_results.items()):
+        error_count = errors[name] if name in results else sum(errors.values()) if name == 'all' else '-'
+        print(f'{name:<12} {len(latencies):>7} {error_count:>7} '
+              f'{percentile(latencies, 0.5) * 1000:>8.0f} {percentile(latencies, 0.95) * 1000:>8.0f} '
+              f'{percentile(latencies, 0.99) * 1000:>8.0f} {max(latencies, default=0) * 1000:>8.0f}')
+
+    upstream = sum(genshinstats.calls.values())
+    print(f'HoYoLAB calls: {upstream} ({upstream / max(total, 1):.2f} per command) '
+          + ', '.join(f'{endpoint}={count}' for endpoint, count in sorted(genshinstats.calls.items())))
+    print(f'genshin.dev calls: {sum(genshin_dev.calls.values())} '
+          + ', '.join(f'{endpoint}={count}' for endpoint, count in sorted(genshin_dev.calls.items())))
+    print(f'Discord calls: {sum(discord.calls.values())} ({sum(discord.calls.values()) / max(total, 1):.2f} per command) '
+          + ', '.join(f'{kind}={count}' for kind, count in sorted(discord.calls.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50, help='concurrent users')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run for')
+    parser.add_argument('--players', type=int, default=500, help='distinct players looked up')
+    parser.add_argument('--guilds', type=int, default=20, help='guilds the users are in')
+    parser.add_argument('--think-time', type=float, default=0.5, help='mean seconds between a user\'s commands')
+    parser.add_argument('--accounts', type=int, default=3, help='HoYoLAB accounts in the cookie pool')
+    parser.add_argument('--upstream-latency', type=float, default=0.3, help='seconds per HoYoLAB call')
+    parser.add_argument('--upstream-error-rate', type=float, default=0.01)
+    parser.add_argument('--genshin-dev-latency', type=float, default=0.1, help='seconds per genshin.dev call')
+    parser.add_argument('--genshin-dev-error-rate', type=float, default=0.0)
+    parser.add_argument('--discord-latency', type=float, default=0.05, help='seconds per Discord API call')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # The cogs' background tasks bind to the event loop that is current when they are imported, as with the bot
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+Offline benchmarks of the functions that run on every command, fed max-size fixtures.
+genshinstats is replaced by the fixtures and the database lives in memory, so nothing touches the network.
+
+Usage, from the repository root:
+    python -m benchmarks.run --save     records benchmarks/baseline.json on this machine
+    python -m benchmarks.run            compares against it, exits with 1 on a regression
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import timeit
+import tracemalloc
+import types
+from typing import Callable, Dict, List, Tuple
+
+# Must be set before util is imported, it reads its configuration at import
+os.environ['DATABASE_FILE'] = ':memory:'
+os.environ.setdefault('GENSHIN_DEV_ENDPOINT', 'https://api.genshin.dev')
+os.environ.setdefault('GENSHIN_UID', '0')
+os.environ.setdefault('GENSHIN_TOKEN', '')
+
+import genshin_cog
+import genshin_data
+import models
+import util
+from benchmarks import fixtures
+from benchmarks.fakes import genshin_dev_id
+from character_index import CharacterIndex
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+# Fraction ops/sec may drop, or peak memory may grow, relative to the baseline before it counts as a regression
+TOLERANCE = 0.25
+# Peak memory differences below this many bytes are noise from the interpreter
+MEMORY_SLACK = 4096
+
+
+def run_sync(coroutine):
+    """
+    Runs a coroutine that finishes without suspending, e.g. one answered from the cache,
+    without the overhead of an event loop
+    """
+    try:
+        coroutine.send(None)
+    except StopIteration as e:
+        return e.value
+    raise Exception('Coroutine suspended, it needs an event loop')
+
+
+def setup() -> List[Tuple[str, Callable[[], any]]]:
+    """
+    Stubs upstream services with the fixtures
+    returns: (name, function) of every benchmark
+    """
+    record_card = fixtures.record_card()
+    user_stats = fixtures.user_stats()
+    abyss = fixtures.spiral_abyss()
+    characters = user_stats['characters']
+
+    genshin_data.gs = types.SimpleNamespace(
+        get_record_card=lambda uid, cookie=None: record_card,
+        get_user_stats=lambda uid, cookie=None: user_stats,
+        get_characters=lambda uid, character_ids=None, lang='en-us', cookie=None: characters,
+        get_spiral_abyss=lambda uid, previous=False, cookie=None: abyss,
+        search=lambda keyword, size=20: [],
+    )
+    data = genshin_data.GenshinData([(0, '')])
+    uid = record_card['game_role_id']
+    data.cache.set(('user_stats', uid), (models.Profile.parse(user_stats), time.time()), 3600)
+    info = run_sync(data.get_info(0, record_card=record_card))
+
+    # Every character has an uploaded emoji, as on a live server
+    util.db.make_emoji_table()
+    util.db.add_emojis([(name.lower(), 'character', fixtures.ICON) for name in fixtures.CHARACTERS])
+    for i, name in enumerate(fixtures.CHARACTERS):
+        util.db.set_emoji_discord_id(name.lower(), f'<:{name.replace(" ", "")}:{10 ** 17 + i}>')
+
+    ctx = types.SimpleNamespace(author=types.SimpleNamespace(display_name='Benchmark'))
+    materials = fixtures.talent_materials()
+    artifacts = models.parse_characters(characters)[0].artifacts
+    abyss_season = models.AbyssSeason.parse(abyss)
+    index = CharacterIndex(genshin_dev_id(name) for name in fixtures.CHARACTERS)
+
+    def calculate_all_materials():
+        for amts in util.TALENT_LEVEL_AMOUNTS.values():
+            util.calculate_required_materials(1, util.MAX_TALENT_LEVEL - 1, amts)
+
+    def required_all_materials():
+        for material_type in util.TALENT_LEVEL_AMOUNTS:
+            util.required_talent_materials(material_type, 1, util.MAX_TALENT_LEVEL)
+
+    return [
+        ('parse_user_stats', lambda: models.Profile.parse(user_stats)),
+        ('parse_spiral_abyss', lambda: models.AbyssSeason.parse(abyss)),
+        ('get_info', lambda: run_sync(data.get_info(0, record_card=record_card))),
+        ('create_characters_embed', lambda: genshin_cog.create_characters_embed(ctx, info)),
+        ('create_artifacts_embeds', lambda: genshin_cog.create_artifacts_embeds(ctx, artifacts, {}, {})),
+        ('create_spiral_abyss_embed', lambda: genshin_cog.create_spiral_abyss_embed(ctx, abyss_season, 'Benchmark')),
+        ('create_talents_embed', lambda: genshin_cog.create_talents_embed(ctx, 'venti', materials)),
+        ('resolve_exact_names', lambda: index.resolve(['hu', 'tao', 'kamisato', 'ayaka', 'xiao'])),
+        ('resolve_misspelled_names', lambda: index.resolve(['hu', 'tai', 'kamisato', 'ayka', 'xaio'])),
+        ('calculate_required_materials', calculate_all_materials),
+        ('required_talent_materials', required_all_materials),
+    ]
+
+
+def measure(func: Callable[[], any], repeat: int) -> Dict[str, float]:
+    """
+    returns: the best ops/sec over repeat runs, and the peak and retained bytes allocated by one call
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat, number))
+
+    tracemalloc.start()
+    try:
+        func()
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        func()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'ops_per_sec': number / best,
+        'peak_bytes': peak - before,
+        'retained_bytes': current - before,
+    }
+
+
+def compare(name: str, result: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    """
+    returns: a description of every way result regressed from baseline
+    """
+    regressions = []
+    if result['ops_per_sec'] < baseline['ops_per_sec'] * (1 - tolerance):
+        regressions.append(f'{name}: {result["ops_per_sec"]:,.0f} ops/sec, '
+                           f'baseline {baseline["ops_per_sec"]:,.0f}')
+    if result['peak_bytes'] > baseline['peak_bytes'] * (1 + tolerance) + MEMORY_SLACK:
+        regressions.append(f'{name}: {result["peak_bytes"]:,} peak bytes, baseline {baseline["peak_bytes"]:,}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline file to compare with or save to')
+    parser.add_argument('--save', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--filter', default='', help='only run benchmarks whose name contains this')
+    args = parser.parse_args()
+
+    baseline = {}
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+    print(f'{"benchmark":<30} {"ops/sec":>12} {"peak KiB":>10} {"kept KiB":>10} {"vs baseline":>12}')
+    for name, func in setup():
+        if args.filter not in name:
+            continue
+        result = results[name] = measure(func, args.repeat)
+        change = ''
+        if name in baseline:
+            change = f'{result["ops_per_sec"] / baseline[name]["ops_per_sec"] - 1:+.1%}'
+            regressions += compare(name, result, baseline[name], args.tolerance)
+        print(f'{name:<30} {result["ops_per_sec"]:>12,.0f} {result["peak_bytes"] / 1024:>10.1f} '
+              f'{result["retained_bytes"] / 1024:>10.1f} {change:>12}')
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=4)
+        print(f'Saved baseline to {args.baseline}')
+    if regressions:
+        print('Regressions:\n' + '\n'.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
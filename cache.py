@@ -0,0 +1,228 @@
+import bisect
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+
+def approximate_size(value: Any) -> int:
+    try:
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return 0
+
+
+class TTLCache:
+    """
+    Bounded in-process cache. Every entry expires after its own ttl and the least recently used
+    entries are evicted once either max_entries or max_bytes (approximate) is exceeded.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (expiry time, approximate size, value)
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires, _, value = entry
+        if expires <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Like get, but does not count towards the stats or the recency of the entry
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return default
+        return entry[2]
+
+    def set(self, key: Hashable, value: Any, ttl: float):
+        size = approximate_size(value)
+        if key in self._entries:
+            self._remove(key)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (time.monotonic() + ttl, size, value)
+        self.size += size
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        if key in self._entries:
+            self._remove(key)
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def _remove(self, key: Hashable):
+        _, size, _ = self._entries.pop(key)
+        self.size -= size
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class PrefixIndex:
+    """
+    Bounded index of lowercase names to values that can be searched by prefix.
+    Once full, the names added first are dropped first.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        # name -> value, in insertion order
+        self._values = {}
+        self._names = []
+
+    def __len__(self):
+        return len(self._values)
+
+    def add(self, name: str, value: Any):
+        name = name.lower()
+        if name in self._values:
+            del self._values[name]
+        else:
+            bisect.insort(self._names, name)
+        self._values[name] = value
+        while len(self._values) > self.max_entries:
+            oldest = next(iter(self._values))
+            del self._values[oldest]
+            del self._names[bisect.bisect_left(self._names, oldest)]
+
+    def __contains__(self, name: str):
+        return name.lower() in self._values
+
+    def search(self, prefix: str, limit: int) -> List[Any]:
+        """
+        returns: values of up to limit names starting with prefix, an exact match first
+        """
+        prefix = prefix.lower()
+        results = []
+        if prefix in self._values:
+            results.append(self._values[prefix])
+        i = bisect.bisect_left(self._names, prefix)
+        while len(results) < limit and i < len(self._names) and self._names[i].startswith(prefix):
+            if self._names[i] != prefix:
+                results.append(self._values[self._names[i]])
+            i += 1
+        return results
+
+
+class SharedCache:
+    """
+    Cache in an SQLite file that every process of the bot shares, so a response fetched by one shard's process
+    is reused by the others. Keys are stored by their repr and values pickled. Blocking, meant to be run off
+    the event loop; every thread gets its own connection.
+    """
+
+    # Expired entries are deleted once every this many sets
+    PURGE_INTERVAL = 1000
+    # Seconds between recounting the entries and bytes stats() reports, the count runs with the next get or set
+    # so reading stats on the event loop never touches the file
+    COUNT_INTERVAL = 60
+
+    def __init__(self, file: str):
+        self.file = file
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._sets = 0
+        self._local = threading.local()
+        db = self._connection()
+        db.execute("""
+        CREATE TABLE IF NOT EXISTS response_cache(
+            key text PRIMARY KEY,
+            value blob NOT NULL,
+            expires real NOT NULL
+        )
+        """)
+        db.commit()
+        self.entries = 0
+        self.bytes = 0
+        self._counted_at = 0
+        self._count(db)
+
+    def _count(self, db: sqlite3.Connection):
+        self.entries = db.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+        self.bytes = db.execute("PRAGMA page_count").fetchone()[0] * db.execute("PRAGMA page_size").fetchone()[0]
+        self._counted_at = time.monotonic()
+
+    def _count_if_due(self, db: sqlite3.Connection):
+        if time.monotonic() - self._counted_at >= self.COUNT_INTERVAL:
+            self._count(db)
+
+    def _connection(self) -> sqlite3.Connection:
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            # Other processes may be writing, wait for their locks instead of failing
+            db = sqlite3.connect(self.file, timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def get(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        """
+        returns: (value, seconds until it expires), None if there is no live entry
+        """
+        db = self._connection()
+        self._count_if_due(db)
+        row = db.execute("SELECT value, expires FROM response_cache WHERE key=?", [repr(key)]).fetchone()
+        now = time.time()
+        if row is None or row[1] <= now:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(row[0]), row[1] - now
+
+    def set(self, key: Hashable, value: Any, ttl: float):
+        db = self._connection()
+        with db:
+            db.execute("""
+            INSERT INTO response_cache(key,value,expires) VALUES(?,?,?)
+            ON CONFLICT(key) DO UPDATE SET value=excluded.value, expires=excluded.expires
+            """, [repr(key), pickle.dumps(value, pickle.HIGHEST_PROTOCOL), time.time() + ttl])
+            self._sets += 1
+            if self._sets % self.PURGE_INTERVAL == 0:
+                self.evictions += db.execute("DELETE FROM response_cache WHERE expires<=?", [time.time()]).rowcount
+        self._count_if_due(db)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        returns: counts kept in memory, entries and bytes as of the last count, see COUNT_INTERVAL
+        """
+        return {
+            'entries': self.entries,
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,178 @@
+"""
+Resolves the character names users type to genshin.dev character ids without asking HoYoLAB,
+by exact alias lookup and, failing that, fuzzy matching on trigrams and edit distance
+"""
+
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Set, Tuple
+
+# genshin.dev id -> names players use that are not part of the id. genshin.dev shortens some names, so
+# HoYoLAB's full name is listed for those, e.g. "Kamisato Ayaka" is "ayaka".
+ALIASES = {
+    'ayaka': ['kamisato ayaka'],
+    'ayato': ['kamisato ayato'],
+    'kazuha': ['kaedehara kazuha'],
+    'kokomi': ['sangonomiya kokomi'],
+    'sara': ['kujou sara'],
+    'raiden': ['raiden shogun', 'ei', 'baal'],
+    'tartaglia': ['childe'],
+    'traveler-anemo': ['traveler', 'aether', 'lumine'],
+    'traveler-geo': ['traveler', 'aether', 'lumine'],
+    'traveler-electro': ['traveler', 'aether', 'lumine'],
+    'traveler-dendro': ['traveler', 'aether', 'lumine'],
+}
+
+
+def normalize(name: str) -> str:
+    """
+    returns: name lowercased with everything but letters and digits removed, e.g. "Hu Tao" -> "hutao"
+    """
+    return re.sub(r'[^0-9a-z]', '', name.lower())
+
+
+def display_name(character: str) -> str:
+    """
+    returns: the genshin.dev id character as a name, e.g. "hu-tao" -> "Hu Tao"
+    """
+    return character.replace('-', ' ').title()
+
+
+def trigrams(key: str) -> Set[str]:
+    # Padded so the start of a name counts for more and names shorter than three letters have trigrams
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    returns: the number of letters inserted, removed, replaced or swapped with their neighbour to turn a into b,
+    or limit + 1 if it is more than limit
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i]
+        for j in range(1, len(b) + 1):
+            distance = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                distance = min(distance, before[j - 2] + 1)
+            current.append(distance)
+        if min(current) > limit and min(previous) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+class CharacterIndex:
+    """
+    Normalized aliases of every character: its id, names from ALIASES and the words of both.
+    An alias can belong to several characters, e.g. "kamisato" or "traveler".
+    """
+
+    # Most words of a message a single name can span, e.g. "kaedehara kazuha"
+    MAX_WORDS = 3
+    # Aliases sharing the most trigrams with a name that are compared by edit distance
+    FUZZY_CANDIDATES = 10
+
+    def __init__(self, characters: Iterable[str]):
+        """
+        characters: genshin.dev ids of every character
+        """
+        # normalized alias -> ids
+        self.aliases: Dict[str, Tuple[str, ...]] = {}
+        # trigram -> normalized aliases that have it
+        self.trigrams: Dict[str, Set[str]] = {}
+        self.characters = sorted(set(characters))
+        for character in self.characters:
+            for name in [character] + ALIASES.get(character, []):
+                self.add(name, character)
+                for word in re.split(r'[-\s]', name):
+                    self.add(word, character)
+
+    def __len__(self):
+        return len(self.characters)
+
+    def add(self, alias: str, character: str):
+        key = normalize(alias)
+        if not key:
+            return
+        characters = self.aliases.get(key, ())
+        if character in characters:
+            return
+        if not characters:
+            for trigram in trigrams(key):
+                self.trigrams.setdefault(trigram, set()).add(key)
+        self.aliases[key] = characters + (character,)
+
+    @staticmethod
+    def max_distance(key: str) -> int:
+        """
+        returns: the most typos a name of key's length may have and still match
+        """
+        return 1 if len(key) <= 4 else 2 if len(key) <= 8 else 3
+
+    def exact(self, name: str) -> Tuple[str, ...]:
+        """
+        returns: ids of the characters with name as an alias
+        """
+        return self.aliases.get(normalize(name), ())
+
+    def fuzzy(self, name: str) -> Tuple[str, ...]:
+        """
+        returns: ids of the characters with the aliases closest to name, if any are within max_distance typos
+        """
+        key = normalize(name)
+        if not key:
+            return ()
+        shared = Counter()
+        for trigram in trigrams(key):
+            shared.update(self.trigrams.get(trigram, ()))
+        limit = self.max_distance(key)
+        best = limit + 1
+        matches = []
+        for alias, _ in shared.most_common(self.FUZZY_CANDIDATES):
+            distance = edit_distance(key, alias, limit)
+            if distance < best:
+                best, matches = distance, [alias]
+            elif distance == best and distance <= limit:
+                matches.append(alias)
+        return tuple(dict.fromkeys(character for alias in matches for character in self.aliases[alias]))
+
+    def lookup(self, name: str) -> Tuple[str, ...]:
+        """
+        returns: ids of the characters name most likely means, exact aliases first, empty if none are close
+        """
+        return self.exact(name) or self.fuzzy(name)
+
+    def resolve(self, words: List[str]) -> List[Tuple[str, Tuple[str, ...]]]:
+        """
+        Splits words into character names, a name may span several words like "hu tao" or "kamisato ayaka"
+        returns: (name as typed, ids of the characters it may be) of every name in words, in order
+        """
+        names = []
+        i = 0
+        while i < len(words):
+            spans = range(min(self.MAX_WORDS, len(words) - i), 0, -1)
+            span, characters = self._match(words, i, spans, self.exact)
+            if len(characters) != 1:
+                # A typo in a name spanning words is only looked for once no single character matches exactly
+                span, characters = self._match(words, i, spans[:-1], self.fuzzy)
+            if len(characters) != 1:
+                span, characters = 1, self.lookup(words[i])
+            names.append((' '.join(words[i:i + span]), characters))
+            i += span
+        return names
+
+    @staticmethod
+    def _match(words: List[str], i: int, spans: Iterable[int], match) -> Tuple[int, Tuple[str, ...]]:
+        """
+        returns: the longest span of words from i that match gives exactly one character for, and that character
+        """
+        for span in spans:
+            characters = match(''.join(words[i:i + span]))
+            if len(characters) == 1:
+                return span, characters
+        return 0, ()
@@ -0,0 +1,110 @@
+import time
+from typing import Dict, List, Tuple
+
+import genshinstats as gs
+
+from rate_limit import TokenBucket
+
+
+def parse_cookies(value: str) -> List[Tuple[int, str]]:
+    """
+    value: comma separated ltuid:ltoken pairs
+    returns: a list of (ltuid, ltoken) tuples
+    """
+    accounts = []
+    for pair in value.split(','):
+        pair = pair.strip()
+        if not pair:
+            continue
+        uid, token = pair.split(':', 1)
+        accounts.append((int(uid), token.strip()))
+    return accounts
+
+
+class Account:
+
+    def __init__(self, uid: int, token: str, rate_limits: Dict[str, Tuple[float, int]]):
+        self.uid = uid
+        self.cookie = {'ltuid': uid, 'ltoken': token}
+        self.limiters = {kind: TokenBucket(rate, burst) for kind, (rate, burst) in rate_limits.items()}
+        self.in_flight = 0
+        self.failures = 0
+        self.cooldown_until = 0
+        # None until the first health check finishes
+        self.healthy = None
+
+    def cooling_down(self, now: float) -> bool:
+        return self.cooldown_until > now
+
+
+class CookiePool:
+    """
+    Spreads HoYoLAB requests over several accounts, each with its own rate limits.
+    Accounts that fail are put on an exponentially growing cooldown and skipped until it ends.
+    """
+
+    # Seconds the first failure puts an account on cooldown for, doubled on every consecutive failure
+    COOLDOWN = 60
+    MAX_COOLDOWN = 60 * 60
+    # Errors caused by the requested user rather than the account making the request
+    USER_ERRORS = (gs.errors.DataNotPublic, gs.errors.AccountNotFound)
+    # Hoyolab uid used to check that an account can log in
+    HEALTH_CHECK_UID = 46178811
+
+    def __init__(self, accounts: List[Tuple[int, str]], rate_limits: Dict[str, Tuple[float, int]]):
+        if not accounts:
+            raise Exception("Expected at least one HoYoLAB account")
+        self.accounts = [Account(uid, token, rate_limits) for uid, token in accounts]
+
+    def acquire(self) -> Account:
+        """
+        returns: the least loaded account that is not cooling down, or the one whose cooldown ends first
+        """
+        now = time.monotonic()
+        available = [account for account in self.accounts if not account.cooling_down(now)]
+        if available:
+            account = min(available, key=lambda a: (a.in_flight, a.failures))
+        else:
+            account = min(self.accounts, key=lambda a: a.cooldown_until)
+        account.in_flight += 1
+        return account
+
+    def cancel(self, account: Account):
+        account.in_flight -= 1
+
+    def release(self, account: Account, error: Exception = None):
+        account.in_flight -= 1
+        if error is None or isinstance(error, self.USER_ERRORS):
+            account.failures = 0
+            account.healthy = True
+            return
+        self._fail(account, error)
+
+    def _fail(self, account: Account, error: Exception):
+        account.failures += 1
+        cooldown = min(self.COOLDOWN * 2 ** (account.failures - 1), self.MAX_COOLDOWN)
+        account.cooldown_until = time.monotonic() + cooldown
+        print(f'HoYoLAB account {account.uid} cooling down for {cooldown}s: {error}')
+
+    def check_health(self, account: Account) -> bool:
+        """
+        Blocking login check for one account, meant to be run off the event loop
+        """
+        try:
+            gs.get_record_card(self.HEALTH_CHECK_UID, cookie=account.cookie)
+        except Exception as e:
+            account.healthy = False
+            self._fail(account, e)
+            return False
+        account.healthy = True
+        return True
+
+    def stats(self) -> List[Dict[str, any]]:
+        now = time.monotonic()
+        return [{
+            'uid': account.uid,
+            'healthy': account.healthy,
+            'in_flight': account.in_flight,
+            'failures': account.failures,
+            'cooldown': max(0, round(account.cooldown_until - now)),
+        } for account in self.accounts]
@@ -1,15 +1,68 @@
+import asyncio
 import datetime
+import json
 import sqlite3
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Tuple, Union
+
+from metrics import metrics
 
 
 class Database:
     db: sqlite3.Connection
+    # Read only name -> discord_id map of every uploaded emoji, replaced as a whole on every emoji write
+    emoji_ids: Mapping[str, str] = MappingProxyType({})
+    # Goes up whenever emoji_ids is replaced, part of the rendered embed cache key
+    emoji_version = 0
 
     def __init__(self, db_file):
         try:
-            self.db = sqlite3.connect(db_file)
+            # The connection is handed to AsyncDatabase's worker thread, which serializes access to it
+            self.db = sqlite3.connect(db_file, check_same_thread=False)
         except sqlite3.Error as e:
             print(e)
+            return
+        # WAL lets readers carry on during writes and only fsyncs on checkpoints
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.make_indexes()
+        self.make_user_link_table()
+        self.make_snapshot_table()
+        self.data_version = None
+        self.refresh_emoji_index()
+
+    def make_indexes(self):
+        try:
+            self.db.execute("CREATE INDEX IF NOT EXISTS emoji_category ON emoji(category)")
+        except sqlite3.OperationalError:
+            # The emoji table has not been made yet
+            return
+        self.db.commit()
+
+    def load_emoji_index(self):
+        cursor = self.db.cursor()
+        try:
+            cursor.execute("SELECT name, discord_id FROM emoji WHERE discord_id IS NOT NULL")
+        except sqlite3.OperationalError:
+            # The emoji table has not been made yet
+            return
+        emoji_ids = dict(cursor.fetchall())
+        # Other connections' writes to any table are seen as a new data_version, only emoji changes count
+        if emoji_ids != self.emoji_ids:
+            self.emoji_ids = MappingProxyType(emoji_ids)
+            self.emoji_version += 1
+
+    def refresh_emoji_index(self):
+        """
+        Reloads the emoji index if another connection, e.g. another shard's process, wrote to the database
+        """
+        data_version = self.db.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self.data_version:
+            self.data_version = data_version
+            self.load_emoji_index()
 
     def make_emoji_table(self):
         cursor = self.db.cursor()
@@ -23,23 +76,47 @@ class Database:
             last_update text NOT NULL
         ) 
         """)
+        self.make_indexes()
 
     def add_emoji(self, name: str, category: str, url: str, overwrite: bool = False) -> bool:
-        if self.get_emoji(name):
+        return len(self.add_emojis([(name, category, url)], overwrite)) == 1
+
+    def add_emojis(self, entries: List[Tuple[str, str, str]], overwrite: bool = False) -> List[str]:
+        """
+        entries: (name, category, url) tuples, all written in one transaction
+        overwrite: replace existing entries with the same name, clearing their discord_id
+        returns: names of the entries that were written
+        """
+        now = datetime.datetime.now()
+        rows = [(name, category, url, now) for name, category, url in entries]
+        with self.db:
+            cursor = self.db.cursor()
             if overwrite:
-                self.delete_emoji(name)
+                cursor.executemany("""
+                INSERT INTO emoji(name,category,url,last_update) VALUES(?,?,?,?)
+                ON CONFLICT(name) DO UPDATE SET
+                    category=excluded.category,
+                    url=excluded.url,
+                    discord_id=NULL,
+                    last_update=excluded.last_update
+                """, rows)
+                added = [name for name, _, _ in entries]
             else:
-                return False
-        cursor = self.db.cursor()
-        cursor.execute("INSERT INTO emoji(name,category,url,last_update) VALUES(?,?,?,?)",
-                       [name, category, url, datetime.datetime.now()])
-        self.db.commit()
-        return True
+                cursor.execute("SELECT name FROM emoji")
+                existing = {row[0] for row in cursor.fetchall()}
+                cursor.executemany("""
+                INSERT INTO emoji(name,category,url,last_update) VALUES(?,?,?,?)
+                ON CONFLICT(name) DO NOTHING
+                """, rows)
+                added = [name for name, _, _ in entries if name not in existing]
+        self.load_emoji_index()
+        return added
 
     def delete_emoji(self, name: str):
         cursor = self.db.cursor()
         cursor.execute("DELETE FROM emoji WHERE name=?", [name])
         self.db.commit()
+        self.load_emoji_index()
         return cursor.rowcount
 
     def get_emoji(self, name: str):
@@ -63,5 +140,244 @@ class Database:
         cursor = self.db.cursor()
         cursor.execute("UPDATE emoji SET discord_id=? WHERE name=?", [discord_id, name])
         self.db.commit()
+        self.load_emoji_index()
         if cursor.rowcount != 1:
             raise Exception(f"Error occured when trying to update {name}")
+
+    def clear_emoji_discord_id(self, discord_id: str):
+        cursor = self.db.cursor()
+        cursor.execute("UPDATE emoji SET discord_id=NULL WHERE discord_id=?", [discord_id])
+        self.db.commit()
+        self.load_emoji_index()
+        return cursor.rowcount
+
+    def get_pending_emoji(self, categories: List[str], names: List[str]):
+        """
+        returns: entries in any of categories or names that have not been uploaded yet
+        """
+        cursor = self.db.cursor()
+        cursor.execute(f"""
+        SELECT * FROM emoji WHERE discord_id IS NULL
+        AND (category IN ({','.join('?' * len(categories))}) OR name IN ({','.join('?' * len(names))}))
+        ORDER BY name
+        """, [*categories, *names])
+        r = [dict((cursor.description[i][0], value) for i, value in enumerate(row)) for row in cursor.fetchall()]
+        return r
+
+    def make_emoji_job_table(self):
+        cursor = self.db.cursor()
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS emoji_job(
+            id integer PRIMARY KEY,
+            action text NOT NULL,
+            guild_id integer NOT NULL,
+            channel_id integer NOT NULL,
+            message_id integer,
+            targets text NOT NULL,
+            reload integer NOT NULL,
+            created text NOT NULL
+        )
+        """)
+
+    def add_emoji_job(self, action: str, guild_id: int, channel_id: int, targets: str, reload: bool) -> int:
+        cursor = self.db.cursor()
+        cursor.execute("INSERT INTO emoji_job(action,guild_id,channel_id,targets,reload,created) VALUES(?,?,?,?,?,?)",
+                       [action, guild_id, channel_id, targets, reload, datetime.datetime.now()])
+        self.db.commit()
+        return cursor.lastrowid
+
+    def set_emoji_job_message(self, job_id: int, message_id: int):
+        cursor = self.db.cursor()
+        cursor.execute("UPDATE emoji_job SET message_id=? WHERE id=?", [message_id, job_id])
+        self.db.commit()
+
+    def delete_emoji_job(self, job_id: int):
+        cursor = self.db.cursor()
+        cursor.execute("DELETE FROM emoji_job WHERE id=?", [job_id])
+        self.db.commit()
+        return cursor.rowcount
+
+    def make_user_link_table(self):
+        cursor = self.db.cursor()
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_link(
+            discord_id integer PRIMARY KEY,
+            community_uid integer NOT NULL,
+            game_uid text NOT NULL,
+            nickname text NOT NULL,
+            region text NOT NULL,
+            adventure_rank integer NOT NULL,
+            last_update text NOT NULL
+        )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS user_link_community_uid ON user_link(community_uid)")
+        # Servers each linked user ran !link in, for leaderboards
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_link_guild(
+            guild_id integer NOT NULL,
+            discord_id integer NOT NULL,
+            PRIMARY KEY(guild_id, discord_id)
+        )
+        """)
+        self.db.commit()
+
+    def set_user_link(self, discord_id: int, community_uid: int, game_uid: str, nickname: str, region: str,
+                      adventure_rank: int):
+        cursor = self.db.cursor()
+        cursor.execute("""
+        INSERT INTO user_link(discord_id,community_uid,game_uid,nickname,region,adventure_rank,last_update)
+        VALUES(?,?,?,?,?,?,?)
+        ON CONFLICT(discord_id) DO UPDATE SET
+            community_uid=excluded.community_uid,
+            game_uid=excluded.game_uid,
+            nickname=excluded.nickname,
+            region=excluded.region,
+            adventure_rank=excluded.adventure_rank,
+            last_update=excluded.last_update
+        """, [discord_id, community_uid, game_uid, nickname, region, adventure_rank, datetime.datetime.now()])
+        self.db.commit()
+
+    def update_user_links(self, community_uid: int, game_uid: str, nickname: str, region: str,
+                          adventure_rank: int):
+        """
+        Updates every link to the player with community_uid, e.g. after their record card was fetched again
+        """
+        cursor = self.db.cursor()
+        cursor.execute("""
+        UPDATE user_link SET game_uid=?, nickname=?, region=?, adventure_rank=?, last_update=?
+        WHERE community_uid=?
+        """, [game_uid, nickname, region, adventure_rank, datetime.datetime.now(), community_uid])
+        self.db.commit()
+        return cursor.rowcount
+
+    def get_user_link(self, discord_id: int):
+        cursor = self.db.cursor()
+        cursor.execute("SELECT * FROM user_link WHERE discord_id=?", [discord_id])
+        res = cursor.fetchone()
+        if not res:
+            return None
+        return dict((cursor.description[i][0], value) for i, value in enumerate(res))
+
+    def delete_user_link(self, discord_id: int):
+        cursor = self.db.cursor()
+        cursor.execute("DELETE FROM user_link_guild WHERE discord_id=?", [discord_id])
+        cursor.execute("DELETE FROM user_link WHERE discord_id=?", [discord_id])
+        self.db.commit()
+        return cursor.rowcount
+
+    def add_guild_link(self, guild_id: int, discord_id: int):
+        cursor = self.db.cursor()
+        cursor.execute("INSERT OR IGNORE INTO user_link_guild(guild_id,discord_id) VALUES(?,?)", [guild_id, discord_id])
+        self.db.commit()
+
+    def get_guild_links(self, guild_id: int, member_ids: List[int] = ()) -> List[Dict[str, Any]]:
+        """
+        member_ids: discord ids of the guild's members known to the bot, linked ones are included
+        even if they never ran !link in the guild
+        returns: the links of every user who ran !link in the guild or is in member_ids
+        """
+        cursor = self.db.cursor()
+        cursor.execute("""
+        SELECT * FROM user_link WHERE discord_id IN (SELECT discord_id FROM user_link_guild WHERE guild_id=?)
+        """, [guild_id])
+        rows = cursor.fetchall()
+        member_ids = list(member_ids)
+        # SQLite limits the number of parameters in a query
+        for i in range(0, len(member_ids), 500):
+            chunk = member_ids[i:i + 500]
+            cursor.execute(f"SELECT * FROM user_link WHERE discord_id IN ({','.join('?' * len(chunk))})", chunk)
+            rows += cursor.fetchall()
+        links = {}
+        for row in rows:
+            link = dict((cursor.description[i][0], value) for i, value in enumerate(row))
+            links[link['discord_id']] = link
+        return list(links.values())
+
+    def make_snapshot_table(self):
+        cursor = self.db.cursor()
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS player_snapshot(
+            kind text NOT NULL,
+            key text NOT NULL,
+            payload blob NOT NULL,
+            fetched_at real NOT NULL,
+            PRIMARY KEY(kind, key)
+        )
+        """)
+        self.db.commit()
+
+    def get_snapshot(self, kind: str, key: str) -> Optional[Tuple[Any, float]]:
+        """
+        returns: (payload, unix time it was fetched), None if there is no snapshot
+        """
+        cursor = self.db.cursor()
+        cursor.execute("SELECT payload, fetched_at FROM player_snapshot WHERE kind=? AND key=?", [kind, key])
+        res = cursor.fetchone()
+        if not res:
+            return None
+        return json.loads(zlib.decompress(res[0])), res[1]
+
+    def set_snapshot(self, kind: str, key: str, payload: Any, fetched_at: float):
+        """
+        payload: a HoYoLAB response, stored as zlib compressed JSON
+        """
+        cursor = self.db.cursor()
+        cursor.execute("""
+        INSERT INTO player_snapshot(kind,key,payload,fetched_at) VALUES(?,?,?,?)
+        ON CONFLICT(kind, key) DO UPDATE SET payload=excluded.payload, fetched_at=excluded.fetched_at
+        """, [kind, key, zlib.compress(json.dumps(payload, default=str).encode()), fetched_at])
+        self.db.commit()
+
+    def get_emoji_jobs(self):
+        cursor = self.db.cursor()
+        cursor.execute("SELECT * FROM emoji_job ORDER BY id")
+        r = [dict((cursor.description[i][0], value) for i, value in enumerate(row)) for row in cursor.fetchall()]
+        return r
+
+
+class AsyncDatabase:
+    """
+    Awaitable view of a Database, every method call runs on one dedicated worker thread
+    so SQLite I/O never blocks the event loop.
+    """
+
+    def __init__(self, database: Union[Database, str]):
+        """
+        database: a Database, or the file of one to open on the worker thread
+        """
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='database')
+        if isinstance(database, Database):
+            self.opened = Future()
+            self.opened.set_result(database)
+        else:
+            # Queued ahead of every call, so calls run once it is open
+            self.opened = self.executor.submit(Database, database)
+        # Calls waiting for or running on the worker thread
+        self.pending = 0
+        metrics.gauge('database_pending', lambda: self.pending)
+
+    @property
+    def database(self) -> Database:
+        """
+        The Database itself, waiting for it to open if it is still opening
+        """
+        return self.opened.result()
+
+    def __getattr__(self, name: str):
+        # Looked up on the class so a database still opening is not waited for
+        if not callable(getattr(Database, name, None)):
+            return getattr(self.database, name)
+
+        def method(*args, **kwargs):
+            return getattr(self.database, name)(*args, **kwargs)
+
+        async def call(*args, **kwargs):
+            loop = asyncio.get_event_loop()
+            self.pending += 1
+            try:
+                with metrics.timer('database_seconds', method=name):
+                    return await loop.run_in_executor(self.executor, partial(method, *args, **kwargs))
+            finally:
+                self.pending -= 1
+
+        return call
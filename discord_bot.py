@@ -1,43 +1,150 @@
+import time
+
+# Taken before the other imports, which are most of the time to start up
+STARTED = time.perf_counter()
+
 import datetime
 from logging import ERROR
+import multiprocessing
 import os
+from typing import List
 
 import discord
+import requests
 from discord.ext import commands
 from dotenv import load_dotenv
 
-from admin_cog import AdminCog
-from genshin_cog import GenshinCog
+from metrics import metrics
 
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 ERROR_CHANNEL_ID = int(os.getenv('DISCORD_BASE_ERROR_CHANNEL'))
-bot = commands.Bot(command_prefix='!')
+# Serves Prometheus metrics at http://METRICS_HOST:METRICS_PORT/metrics when set,
+# shard processes each serve on the next port up
+METRICS_PORT = os.getenv('METRICS_PORT')
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+# Total number of shards across every host, Discord's recommended count if not set
+SHARD_COUNT = os.getenv('SHARD_COUNT')
+# Shards run on this host, e.g. "0-7" or "0,2,4", every shard if not set
+SHARD_IDS = os.getenv('SHARD_IDS')
+# Processes this host's shards are split over, each runs a contiguous range of them
+SHARD_PROCESSES = int(os.getenv('SHARD_PROCESSES', '1'))
+# Where shard processes share HoYoLAB responses when SHARED_CACHE_FILE is not set, see GenshinCog
+DEFAULT_SHARED_CACHE_FILE = 'genshin_cache.db'
 
 
-@bot.event
-async def on_ready():
-    await bot.change_presence(activity=discord.Game(name='Genshin Impact'))
-    print(f'{bot.user.name} has connected {datetime.datetime.now()}.')
+def parse_shard_ids(value: str) -> List[int]:
+    """
+    value: comma separated shard ids or inclusive ranges, e.g. "0-3,8"
+    """
+    shard_ids = []
+    for part in value.split(','):
+        start, _, end = part.strip().partition('-')
+        shard_ids += range(int(start), int(end or start) + 1)
+    return shard_ids
 
 
+def recommended_shard_count() -> int:
+    res = requests.get('https://discord.com/api/v9/gateway/bot', headers={'Authorization': f'Bot {TOKEN}'},
+                       timeout=20)
+    if res.status_code != 200:
+        raise Exception(f"Request for recommended shard count returned with response code:{res.status_code}\n{res.text}")
+    return res.json()['shards']
 
 
-@bot.event
-async def on_command_error(ctx, error):
-    error_channel = bot.get_channel(ERROR_CHANNEL_ID)
-    await error_channel.send(error)
+def split_shards(shard_ids: List[int], processes: int) -> List[List[int]]:
+    """
+    returns: shard_ids split into at most processes contiguous groups of nearly equal size
+    """
+    processes = max(1, min(processes, len(shard_ids)))
+    size, extra = divmod(len(shard_ids), processes)
+    groups = []
+    start = 0
+    for i in range(processes):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(shard_ids[start:end])
+        start = end
+    return groups
 
 
+def make_bot(shard_ids: List[int] = None, shard_count: int = None) -> commands.AutoShardedBot:
+    # Imported here so every shard process sets up its own cogs, and the launching process none
+    from admin_cog import AdminCog
+    from genshin_cog import GenshinCog
 
-@bot.after_invoke
-async def after_react(ctx: commands.Context):
-    if not ctx.command_failed:
-        await ctx.message.add_reaction('\N{WHITE HEAVY CHECK MARK}')
-    else:
-        await ctx.message.add_reaction('\N{CROSS MARK}')
+    bot = commands.AutoShardedBot(command_prefix='!', shard_ids=shard_ids, shard_count=shard_count)
+
+    startup = {}
+
+    @bot.event
+    async def on_ready():
+        await bot.change_presence(activity=discord.Game(name='Genshin Impact'))
+        print(f'{bot.user.name} has connected shards {shard_ids or "all"} {datetime.datetime.now()}.')
+        # on_ready fires again after reconnecting
+        if 'seconds' not in startup:
+            startup['seconds'] = time.perf_counter() - STARTED
+            metrics.gauge('startup_seconds', lambda: startup['seconds'])
+            print(f'Started in {startup["seconds"]:.2f}s, {startup["setup_seconds"]:.2f}s of it importing and '
+                  f'setting up the bot.')
+
+    @bot.event
+    async def on_command_error(ctx, error):
+        # Already answered by the cog, e.g. HoYoLAB being busy
+        if getattr(ctx, 'error_handled', False):
+            return
+        # The error channel's guild may be on another process's shard
+        error_channel = bot.get_channel(ERROR_CHANNEL_ID) or await bot.fetch_channel(ERROR_CHANNEL_ID)
+        await error_channel.send(error)
 
+    @bot.before_invoke
+    async def start_timer(ctx: commands.Context):
+        ctx.start_time = time.perf_counter()
 
-bot.add_cog(AdminCog(bot))
-bot.add_cog(GenshinCog(bot))
-bot.run(TOKEN)
+    @bot.after_invoke
+    async def after_react(ctx: commands.Context):
+        metrics.observe('command_seconds', time.perf_counter() - ctx.start_time, command=ctx.command.qualified_name)
+        if ctx.command_failed:
+            metrics.inc('command_errors_total', command=ctx.command.qualified_name)
+        if not ctx.command_failed:
+            await ctx.message.add_reaction('\N{WHITE HEAVY CHECK MARK}')
+        else:
+            await ctx.message.add_reaction('\N{CROSS MARK}')
+
+    bot.add_cog(AdminCog(bot))
+    bot.add_cog(GenshinCog(bot))
+    startup['setup_seconds'] = time.perf_counter() - STARTED
+    return bot
+
+
+def run(shard_ids: List[int] = None, shard_count: int = None, metrics_port: int = None, process_index: int = 0):
+    # Read by GenshinCog, which is imported by make_bot
+    os.environ['SHARD_PROCESS_INDEX'] = str(process_index)
+    bot = make_bot(shard_ids, shard_count)
+    if metrics_port:
+        bot.loop.create_task(metrics.serve(metrics_port, METRICS_HOST))
+    bot.run(TOKEN)
+
+
+if __name__ == '__main__':
+    metrics_port = int(METRICS_PORT) if METRICS_PORT else None
+    if SHARD_PROCESSES <= 1 and not SHARD_IDS:
+        run(shard_count=int(SHARD_COUNT) if SHARD_COUNT else None, metrics_port=metrics_port)
+    else:
+        shard_count = int(SHARD_COUNT) if SHARD_COUNT else recommended_shard_count()
+        shard_ids = parse_shard_ids(SHARD_IDS) if SHARD_IDS else list(range(shard_count))
+        groups = split_shards(shard_ids, SHARD_PROCESSES)
+        if len(groups) == 1:
+            run(groups[0], shard_count, metrics_port)
+        else:
+            # Without a shared cache every process would fetch the same players from HoYoLAB
+            os.environ.setdefault('SHARED_CACHE_FILE', DEFAULT_SHARED_CACHE_FILE)
+            # Rate limits are kept per process, so each is given its share of every HoYoLAB account's
+            os.environ['SHARD_PROCESS_COUNT'] = str(len(groups))
+            context = multiprocessing.get_context('spawn')
+            processes = [context.Process(target=run, name=f'shards-{group[0]}-{group[-1]}',
+                                         args=(group, shard_count, metrics_port + i if metrics_port else None, i))
+                         for i, group in enumerate(groups)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
@@ -0,0 +1,117 @@
+"""
+Helpers for sending embeds within Discord's message limits
+"""
+
+import asyncio
+from typing import Callable, List, Set
+
+import discord
+from discord.http import Route
+
+# Discord's limits on a single message
+MAX_EMBEDS = 10
+MAX_EMBED_CHARACTERS = 6000
+MAX_FIELDS = 25
+
+# Paginators listening for reactions, kept so they are not garbage collected while running
+listeners: Set[asyncio.Task] = set()
+
+
+def pack_embeds(embeds: List[discord.Embed]) -> List[List[discord.Embed]]:
+    """
+    returns: embeds split, in order, into groups that each fit in one message
+    """
+    groups = []
+    size = 0
+    for embed in embeds:
+        if not groups or len(groups[-1]) == MAX_EMBEDS or size + len(embed) > MAX_EMBED_CHARACTERS:
+            groups.append([])
+            size = 0
+        groups[-1].append(embed)
+        size += len(embed)
+    return groups
+
+
+async def send_embeds(ctx, embeds: List[discord.Embed]):
+    """
+    Sends embeds with as few messages as possible
+    """
+    for group in pack_embeds(embeds):
+        if len(group) == 1:
+            await ctx.send(embed=group[0])
+            continue
+        # Messageable.send only takes a single embed, the API itself takes up to 10
+        route = Route('POST', '/channels/{channel_id}/messages', channel_id=ctx.channel.id)
+        try:
+            await ctx.bot.http.request(route, json={'embeds': [embed.to_dict() for embed in group]})
+        except discord.HTTPException:
+            # discord.py 1.7 talks to API v7, which is not documented to take embeds.
+            # Were they ignored the message would be empty and rejected, so they are sent one at a time.
+            for embed in group:
+                await ctx.send(embed=embed)
+
+
+class Paginator:
+    """
+    A message showing one page at a time, flipped through with reactions.
+    Pages are only rendered the first time they are shown.
+    """
+
+    PREVIOUS = '\N{BLACK LEFT-POINTING TRIANGLE}'
+    NEXT = '\N{BLACK RIGHT-POINTING TRIANGLE}'
+    # Seconds without a reaction before the paginator stops listening
+    TIMEOUT = 120
+
+    def __init__(self, ctx, page_count: int, render: Callable[[int], discord.Embed]):
+        self.ctx = ctx
+        self.page_count = page_count
+        self.render = render
+        self.page = 0
+        self._pages = {}
+
+    def get_page(self, page: int) -> discord.Embed:
+        if page not in self._pages:
+            self._pages[page] = self.render(page)
+        return self._pages[page]
+
+    async def start(self):
+        """
+        Sends the first page, reactions are then handled in the background
+        """
+        message = await self.ctx.send(embed=self.get_page(0))
+        if self.page_count > 1:
+            task = asyncio.ensure_future(self._listen(message))
+            listeners.add(task)
+            task.add_done_callback(listeners.discard)
+        return message
+
+    async def _listen(self, message: discord.Message):
+        try:
+            await self._turn_pages(message)
+        except discord.HTTPException as e:
+            # E.g. the message was deleted or reactions are not allowed in the channel
+            print(f'Stopped paginating message {message.id}: {e}')
+
+    async def _turn_pages(self, message: discord.Message):
+        # Removing others' reactions needs Manage Messages, which the bot never has in DMs
+        can_manage = self.ctx.channel.permissions_for(self.ctx.me).manage_messages
+        await message.add_reaction(self.PREVIOUS)
+        await message.add_reaction(self.NEXT)
+
+        def check(reaction, user):
+            return reaction.message.id == message.id and not user.bot \
+                   and str(reaction.emoji) in (self.PREVIOUS, self.NEXT)
+
+        while True:
+            try:
+                reaction, user = await self.ctx.bot.wait_for('reaction_add', check=check, timeout=self.TIMEOUT)
+            except asyncio.TimeoutError:
+                break
+            step = 1 if str(reaction.emoji) == self.NEXT else -1
+            self.page = (self.page + step) % self.page_count
+            await message.edit(embed=self.get_page(self.page))
+            if can_manage:
+                await message.remove_reaction(reaction.emoji, user)
+
+        if can_manage:
+            await message.clear_reactions()
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import time
+from typing import Dict, List
+
+import discord
+
+import util
+
+
+class JobStatus:
+    """
+    A single status message that is edited as a job progresses
+    """
+
+    # Minimum seconds between edits, edits share the channel's rate limit with everything else
+    EDIT_INTERVAL = 5
+
+    def __init__(self, job_id: int, message: discord.Message):
+        self.job_id = job_id
+        self.message = message
+        self.last_edit = 0
+        self.text = ''
+
+    async def update(self, text: str, force: bool = False):
+        self.text = text
+        if not force and time.monotonic() - self.last_edit < self.EDIT_INTERVAL:
+            return
+        self.last_edit = time.monotonic()
+        try:
+            await self.message.edit(content=f'Emoji job {self.job_id}: {text}')
+        except discord.HTTPException as e:
+            print(f'Failed to update status of emoji job {self.job_id}: {e}')
+
+
+class EmojiScheduler:
+    """
+    Runs emoji create and delete jobs in the background, one job at a time per guild.
+    Jobs are stored in the emoji_job table and their progress in the emoji discord_id column,
+    so unfinished jobs pick up where they left off after a restart.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        # job id -> task running it
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self.statuses: Dict[int, JobStatus] = {}
+        # Jobs in the same guild share Discord's emoji rate limit so they run one after another
+        self._guild_locks: Dict[int, asyncio.Lock] = {}
+
+    async def submit(self, ctx, action: str, categories: List[str], names: List[str], reload: bool) -> int:
+        targets = json.dumps({'categories': categories, 'names': names})
+        await util.adb.make_emoji_job_table()
+        job_id = await util.adb.add_emoji_job(action, ctx.guild.id, ctx.channel.id, targets, reload)
+        message = await ctx.send(f'Emoji job {job_id}: queued')
+        await util.adb.set_emoji_job_message(job_id, message.id)
+        job = {'id': job_id, 'action': action, 'targets': targets, 'reload': reload}
+        self._start(job, ctx.guild, message)
+        return job_id
+
+    async def resume(self):
+        """
+        Restarts every job that was still stored, e.g. after the bot restarted mid job
+        """
+        await util.adb.make_emoji_job_table()
+        for job in await util.adb.get_emoji_jobs():
+            if job['id'] in self.tasks or not self._on_this_process(job['guild_id']):
+                continue
+            guild = self.bot.get_guild(job['guild_id'])
+            channel = self.bot.get_channel(job['channel_id'])
+            if not guild or not channel:
+                print(f'Dropping emoji job {job["id"]}, its guild or channel is gone')
+                await util.adb.delete_emoji_job(job['id'])
+                continue
+            try:
+                message = await channel.fetch_message(job['message_id'])
+            except discord.HTTPException:
+                message = await channel.send(f'Emoji job {job["id"]}: resuming')
+                await util.adb.set_emoji_job_message(job['id'], message.id)
+            self._start(job, guild, message)
+
+    def _on_this_process(self, guild_id: int) -> bool:
+        """
+        returns: whether the guild is on one of this process's shards, other processes resume its jobs
+        """
+        shard_ids = getattr(self.bot, 'shard_ids', None)
+        if shard_ids is None:
+            return True
+        return (guild_id >> 22) % self.bot.shard_count in shard_ids
+
+    def _start(self, job: Dict[str, any], guild: discord.Guild, message: discord.Message):
+        status = JobStatus(job['id'], message)
+        task = asyncio.ensure_future(self._run(job, guild, status))
+        self.tasks[job['id']] = task
+        self.statuses[job['id']] = status
+
+        def done(_):
+            self.tasks.pop(job['id'], None)
+            self.statuses.pop(job['id'], None)
+
+        task.add_done_callback(done)
+
+    async def _run(self, job: Dict[str, any], guild: discord.Guild, status: JobStatus):
+        lock = self._guild_locks.setdefault(guild.id, asyncio.Lock())
+        async with lock:
+            try:
+                if job['action'] == 'create':
+                    await self._create(job, guild, status)
+                else:
+                    await self._delete(guild, status)
+            except asyncio.CancelledError:
+                # Shutting down, the job stays stored so it is resumed
+                raise
+            except Exception as e:
+                await status.update(f'failed: {e}', force=True)
+            await util.adb.delete_emoji_job(job['id'])
+
+    async def _with_retry(self, status: JobStatus, func, *args, **kwargs):
+        """
+        discord.py already waits out rate limit buckets it knows about, this waits out the retry-after
+        of any 429 that still gets through instead of failing the job.
+        """
+        while True:
+            try:
+                return await func(*args, **kwargs)
+            except discord.HTTPException as e:
+                if e.status != 429:
+                    raise
+                retry_after = float(e.response.headers.get('Retry-After', 60))
+                await status.update(f'rate limited, retrying in {retry_after:.0f}s', force=True)
+                await asyncio.sleep(retry_after)
+
+    async def _create(self, job: Dict[str, any], guild: discord.Guild, status: JobStatus):
+        targets = json.loads(job['targets'])
+        entries = await util.adb.get_pending_emoji(targets['categories'], targets['names'])
+
+        if job['reload']:
+            loop = asyncio.get_event_loop()
+            for category in {entry['category'] for entry in entries}:
+                await status.update(f'downloading {category} images', force=True)
+                results = await loop.run_in_executor(None, util.download_images_batch,
+                                                     [(entry['name'], entry['url']) for entry in entries
+                                                      if entry['category'] == category], category)
+                failed = {result['name'] for result in results if result['error']}
+                entries = [entry for entry in entries if entry['name'] not in failed]
+
+        created = 0
+        for entry in entries:
+            await status.update(f'uploading {created}/{len(entries)}, next: {entry["name"]}')
+            with open(f'{entry["category"]}/{entry["name"]}.png', 'rb') as image:
+                image = image.read()
+            emoji = await self._with_retry(status, guild.create_custom_emoji, image=image,
+                                           name=entry['name'].replace(' ', '').replace('-', ''))
+            await util.adb.set_emoji_discord_id(entry['name'], f'<:{emoji.name}:{emoji.id}>')
+            created += 1
+        await status.update(f'done, created {created} emojis', force=True)
+
+    async def _delete(self, guild: discord.Guild, status: JobStatus):
+        emojis = await guild.fetch_emojis()
+        deleted = 0
+        for emoji in emojis:
+            await status.update(f'deleting {deleted}/{len(emojis)}, next: {emoji.name}')
+            await self._with_retry(status, emoji.delete)
+            await util.adb.clear_emoji_discord_id(f'<:{emoji.name}:{emoji.id}>')
+            deleted += 1
+        await status.update(f'done, deleted {deleted} emojis', force=True)
@@ -1,99 +1,453 @@
+import asyncio
+import datetime
+import hashlib
+import math
 import os
-from typing import List, Dict, Union
+import pickle
+import time
+from typing import Callable, List, Dict, Optional, Set, Tuple, Union
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord.ext.commands import command
 from dotenv import load_dotenv
 
 import util
+from cache import SharedCache, TTLCache
+from character_index import CharacterIndex, display_name
+from cookie_pool import parse_cookies
+from embeds import MAX_FIELDS, Paginator, send_embeds
 from genshin_data import GenshinData
 from genshin_dev_data import GenshinDevData, InvalidCharacterException
+from metrics import metrics, watch_cache
+from models import AbyssSeason, Artifact, Character, Profile, Weapon
+from prefetcher import Prefetcher
+from rate_limit import RateLimitTimeout
 from requests import RequestException
+from scheduler import FairScheduler, QueueFull
 
 load_dotenv()
-GENSHIN_UID = int(os.getenv('GENSHIN_UID'))
-GENSHIN_TOKEN = os.getenv('GENSHIN_TOKEN')
-
-genshin_data = GenshinData(GENSHIN_UID, GENSHIN_TOKEN)
+# Comma separated ltuid:ltoken pairs, GENSHIN_UID and GENSHIN_TOKEN are used if not set
+GENSHIN_COOKIES = os.getenv('GENSHIN_COOKIES')
+# SQLite file HoYoLAB responses are cached in for every process of the bot, see discord_bot.py
+SHARED_CACHE_FILE = os.getenv('SHARED_CACHE_FILE')
+# Set by discord_bot.py when this host's shards are split over processes, which share the HoYoLAB accounts
+SHARD_PROCESS_COUNT = int(os.getenv('SHARD_PROCESS_COUNT', '1'))
+SHARD_PROCESS_INDEX = int(os.getenv('SHARD_PROCESS_INDEX', '0'))
 
 separate_line = '----------------------------------------------'
+# Multiple of 3 so inline fields fill every row
+CHARACTERS_PER_PAGE = MAX_FIELDS - MAX_FIELDS % 3
+TALENT_MATERIAL_TYPES = ['talent-book', 'boss-material', 'common-ascension-material', 'crown']
+# Passing any of these to a command skips the response cache
+FRESH_FLAGS = ['-fresh', '-f']
+# Passing any of these instead of a UID or name uses the player linked with !link
+ME_FLAGS = ['-me', 'me']
+
+# HoYoLAB calls the prefetcher may make per minute to keep the PREFETCH_TOP_K most requested responses warm,
+# it only runs in the first shard process so the budget is not spent once per process
+PREFETCH_BUDGET = int(os.getenv('PREFETCH_BUDGET', '10'))
+PREFETCH_TOP_K = int(os.getenv('PREFETCH_TOP_K', '100'))
+
+# Made on first use, so importing the cog does no I/O, see get_genshin_data
+_genshin_data: GenshinData = None
+_prefetcher: Prefetcher = None
+_scheduler: FairScheduler = None
+
+# Commands are run through a fair queue per guild, see get_scheduler. COMMAND_CAPACITY is the total cost of
+# commands that may run at once, by default what HoYoLAB's rate limits get through before requests time out.
+# USER_CONCURRENCY is how many commands each user may run at once and USER_MAX_QUEUED how many more may wait.
+COMMAND_CAPACITY = os.getenv('COMMAND_CAPACITY')
+USER_CONCURRENCY = int(os.getenv('USER_CONCURRENCY', '1'))
+USER_MAX_QUEUED = int(os.getenv('USER_MAX_QUEUED', '3'))
+# Seconds a queued command waits before the user is told their place in the queue
+QUEUE_MESSAGE_DELAY = 1
+# HoYoLAB responses for the player's game uid each command needs besides their record card, see command_cost
+COMMAND_REQUESTS = {
+    'stats': ['user_stats'],
+    'characters': ['user_stats'],
+    'abyss': ['spiral_abyss'],
+    'link': [],
+}
+
+# Leaderboard -> (column title, value players are ranked by from their (profile, abyss season), None if unknown)
+LEADERBOARDS: Dict[str, Tuple[str, Callable[[Profile, AbyssSeason], any]]] = {
+    'abyss': ('Abyss stars', lambda profile, abyss: abyss.total_stars if abyss else None),
+    'achievements': ('Achievements', lambda profile, abyss: profile.achievements),
+    'days': ('Active days', lambda profile, abyss: profile.active_days),
+    'characters': ('Characters', lambda profile, abyss: len(profile.characters)),
+}
+LEADERBOARD_ROWS = 20
+COMPARE_MAX_PLAYERS = 10
+# Seconds between edits of a table while its players are fetched, Discord allows 5 edits per 5 seconds
+STREAM_EDIT_INTERVAL = 2
+
+# Seconds between checks for emojis changed by another process
+EMOJI_INDEX_REFRESH = 30
+
+# Seconds after which the record card stored with a link is fetched again in the background when it is used,
+# at most LINK_REFRESHES_PER_COMMAND of the oldest at a time
+LINK_MAX_AGE = 24 * 60 * 60
+LINK_REFRESHES_PER_COMMAND = 5
+# Background link refreshes, kept so they are not garbage collected while running
+link_refreshes: Set[asyncio.Task] = set()
+
+# Rendered embeds, without their footer, keyed by what was rendered and a fingerprint of the data
+RENDER_CACHE_TTL = 30 * 60
+render_cache = TTLCache(max_entries=1024, max_bytes=16 * 1024 * 1024)
+watch_cache('render', render_cache)
+
+
+def get_genshin_data() -> GenshinData:
+    global _genshin_data
+    if _genshin_data is None:
+        if GENSHIN_COOKIES:
+            accounts = parse_cookies(GENSHIN_COOKIES)
+        else:
+            accounts = [(int(os.getenv('GENSHIN_UID')), os.getenv('GENSHIN_TOKEN'))]
+        shared_cache = SharedCache(SHARED_CACHE_FILE) if SHARED_CACHE_FILE else None
+        _genshin_data = GenshinData(accounts, shared_cache=shared_cache, snapshots=util.adb,
+                                    processes=SHARD_PROCESS_COUNT)
+    return _genshin_data
+
+
+def get_prefetcher() -> Prefetcher:
+    global _prefetcher
+    if _prefetcher is None:
+        _prefetcher = Prefetcher(get_genshin_data(), PREFETCH_BUDGET, PREFETCH_TOP_K)
+    return _prefetcher
+
+
+def get_scheduler() -> FairScheduler:
+    global _scheduler
+    if _scheduler is None:
+        capacity = float(COMMAND_CAPACITY) if COMMAND_CAPACITY else get_genshin_data().request_capacity()
+        _scheduler = FairScheduler(capacity, USER_CONCURRENCY, USER_MAX_QUEUED)
+        metrics.gauge('scheduler_queued', lambda: len(_scheduler.queue))
+        metrics.gauge('scheduler_running_cost', lambda: _scheduler.running)
+    return _scheduler
 
 
 class GenshinCog(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        # Runs alongside connecting to Discord rather than before it
+        self.check_accounts.start()
+        self.sync_genshin_dev.start()
+        self.refresh_emoji_index.start()
+        if PREFETCH_BUDGET > 0 and SHARD_PROCESS_INDEX == 0:
+            self.prefetch.start()
+
+    def cog_unload(self):
+        self.check_accounts.cancel()
+        self.sync_genshin_dev.cancel()
+        self.refresh_emoji_index.cancel()
+        self.prefetch.cancel()
+
+    @tasks.loop(hours=6)
+    async def sync_genshin_dev(self):
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, GenshinDevData.sync_mirror)
+        except RequestException as e:
+            print(f'genshin.dev sync failed: {e}')
+
+    @tasks.loop(seconds=EMOJI_INDEX_REFRESH)
+    async def refresh_emoji_index(self):
+        await util.adb.refresh_emoji_index()
+
+    @tasks.loop(seconds=Prefetcher.INTERVAL)
+    async def prefetch(self):
+        await get_prefetcher().run_once()
+
+    @prefetch.before_loop
+    async def before_prefetch(self):
+        # Nothing is popular yet
+        await asyncio.sleep(Prefetcher.INTERVAL)
+
+    @tasks.loop(count=1)
+    async def check_accounts(self):
+        genshin_data = get_genshin_data()
+        healthy = await genshin_data.check_accounts()
+        print(f'{healthy}/{len(genshin_data.pool.accounts)} HoYoLAB accounts logged in.')
+
+    async def cog_before_invoke(self, ctx):
+        # DMs are queued as a guild of their own per user
+        guild = ctx.guild.id if ctx.guild else ('dm', ctx.author.id)
+        scheduler = get_scheduler()
+        try:
+            ticket = scheduler.enqueue(guild, ctx.author.id, command_cost(ctx))
+        except QueueFull as e:
+            # Commands only fail with a CommandError, see cog_command_error
+            raise commands.CommandError(str(e)) from e
+        ctx.ticket = ticket
+        try:
+            if not await scheduler.wait(ticket, QUEUE_MESSAGE_DELAY):
+                message = await ctx.send(f'Busy right now, your command is number {scheduler.position(ticket)} '
+                                         f'in the queue and will run shortly.')
+                await scheduler.wait(ticket)
+                await message.delete(delay=0)
+        except BaseException:
+            # cog_after_invoke only runs once the command has started
+            scheduler.release(ticket)
+            raise
+        metrics.observe('queue_seconds', ticket.granted.result(), command=ctx.command.qualified_name)
+
+    async def cog_after_invoke(self, ctx):
+        get_scheduler().release(ctx.ticket)
+
+    async def cog_command_error(self, ctx, error):
+        # Errors the user is told about here are not forwarded to the error channel, see discord_bot.py
+        if isinstance(error, commands.CommandInvokeError) and isinstance(error.original, RateLimitTimeout):
+            await ctx.send('HoYoLAB is busy right now, try again in a bit.')
+            ctx.error_handled = True
+        elif isinstance(error.__cause__, QueueFull):
+            await ctx.send(str(error))
+            ctx.error_handled = True
 
     @command(name='stats', aliases=['s'], help='Fetches general stats about a player')
     async def stats_command(self, ctx, *args:str):
-        uid, args = await _identify(ctx, args)
-        info = await get_info(ctx, uid)
+        fresh, args = _pop_flag(args, FRESH_FLAGS)
+        uid, args, record_card = await _identify(ctx, args, fresh)
+        info = await get_info(ctx, uid, fresh, record_card)
         if not info:
             return
-        await ctx.send(embed=create_stats_embed(ctx, info))
+        data = (info.nickname, info.adventure_rank, info.region, info.achievements, info.active_days)
+        await ctx.send(embed=cached_embed(ctx, ('stats', info.uid), data, lambda: create_stats_embed(ctx, info),
+                                          info.last_updated))
 
     @command(name='characters', aliases=['character', 'c'],
              help='Fetches all the players characters or specific information about certain characters')
     async def characters_command(self, ctx, *args:str):
-        uid, args = await _identify(ctx, args)
+        fresh, args = _pop_flag(args, FRESH_FLAGS)
+        uid, args, record_card = await _identify(ctx, args, fresh)
         if not uid:
             await ctx.send(f'No user found')
             return
         if len(args) == 0:
-            info = await get_info(ctx, uid)
+            info = await get_info(ctx, uid, fresh, record_card)
             if not info:
                 return
-            await ctx.send(embed=create_characters_embed(ctx, info))
+            await Paginator(ctx, characters_page_count(info),
+                            lambda page: cached_embed(ctx, ('characters', info.uid, page),
+                                                      characters_page_data(info, page),
+                                                      lambda: create_characters_embed(ctx, info, page),
+                                                      info.last_updated)).start()
         else:
-            record_card = await get_record_card(ctx, uid)
+            # Names are split up locally, the player's characters tell apart ones like "kamisato"
+            index = await get_character_index()
+            if index:
+                args = character_queries(index.resolve(list(args)))
+            record_card = await get_record_card(ctx, uid, fresh, record_card)
             if not record_card:
                 return
             nick = record_card['nickname']
             uid = record_card['game_role_id']
-            characters = genshin_data.get_player_character(uid, args)
-            for character in args:
-                if character.title() in characters:
-                    for embed in create_player_character_embeds(ctx, nick, characters[character]):
-                        await ctx.send(embed=embed)
+            characters = await get_genshin_data().get_player_character(uid, args, fresh, index)
+            embeds = []
+            for character in dict.fromkeys(filter(None, characters)):
+                embeds += create_player_character_embeds(ctx, nick, character)
+            missing = [name for name, character in zip(args, characters) if not character]
+            if missing:
+                await ctx.send(f'{nick} does not have {", ".join(missing)}')
+            if embeds:
+                await send_embeds(ctx, embeds)
+
+    @command(name='link', help='Links your Discord account to a player, after which commands given no UID or name '
+                               'or given -me use that player')
+    async def link_command(self, ctx, *args: str):
+        if not args or args[0] in ME_FLAGS:
+            await ctx.send('Usage: !link <community uid or name>')
+            return
+        uid, args, _ = await _identify(ctx, args, True)
+        record_card = await get_record_card(ctx, uid, True)
+        if not record_card:
+            return
+        await util.adb.set_user_link(ctx.author.id, uid, record_card['game_role_id'], record_card['nickname'],
+                                     record_card['region_name'], record_card['level'])
+        if ctx.guild:
+            await util.adb.add_guild_link(ctx.guild.id, ctx.author.id)
+        await ctx.send(f'Linked {ctx.author.display_name} to {record_card["nickname"]} '
+                       f'(UID {record_card["game_role_id"]}).')
+
+    @command(name='unlink', help='Removes the player linked to your Discord account')
+    async def unlink_command(self, ctx):
+        if await util.adb.delete_user_link(ctx.author.id):
+            await ctx.send(f'Unlinked {ctx.author.display_name}.')
+        else:
+            await ctx.send(f'{ctx.author.display_name} is not linked to a player.')
 
     @command(name='search', aliases=['uid'], help='Searches for a player based on their community UID')
-    async def search_command(self, ctx, name: str):
-        result = genshin_data.search(name)
+    async def search_command(self, ctx, *args: str):
+        fresh, args = _pop_flag(args, FRESH_FLAGS)
+        if not args:
+            await ctx.send('No name given')
+            return
+        result = await get_genshin_data().search(args[0], fresh)
         if result:
-            for user in result:
-                embed = create_profile_card(ctx,user)
-                await ctx.send(embed=embed)
-
-    @command(name='talents', aliases=['t'], help='Gets talent info associated with a character')
-    async def talents_command(self, ctx, character: str):
-        character = character.lower()
+            await send_embeds(ctx, [create_profile_card(ctx, user) for user in result])
 
-        talent_materials = None
+    @command(name='talents', aliases=['t'],
+             help='Gets talent materials for a character, or the total for several characters over a level range. '
+                  'Usage: !talents <characters> [[from] to] [-from <level>] [-to <level>] [-talents <count>]')
+    async def talents_command(self, ctx, *args: str):
         try:
-            talent_materials = GenshinDevData.get_character_talent_materials(character)
-        except InvalidCharacterException:
-            await ctx.send(content=f'Unable to get complete talent info for character {character.capitalize()}')
+            characters, start_level, end_level, talent_count = _parse_talent_args(args)
+        except ValueError as e:
+            await ctx.send(content=str(e))
             return
-        except RequestException as e:
-            await ctx.send(content=f'Error requesting talent data for character {character.capitalize()}: {str(e)}')
+        if not characters:
+            await ctx.send(content='No character given')
+            return
+        index = await get_character_index()
+        if not index:
+            await ctx.send(content='Error requesting the character list from genshin.dev')
             return
+        names = index.resolve(characters)
+        message = unresolved_message(names)
+        if message:
+            await ctx.send(content=message)
+            return
+        characters = list(dict.fromkeys(matches[0] for _, matches in names))
+
+        materials = {}
+        for character in characters:
+            talent_materials = None
+            try:
+                if GenshinDevData.ready():
+                    talent_materials = GenshinDevData.get_character_talent_materials(character)
+                else:
+                    # The mirror has not been loaded yet so this has to go to genshin.dev
+                    loop = asyncio.get_event_loop()
+                    talent_materials = await loop.run_in_executor(None, GenshinDevData.get_character_talent_materials,
+                                                                  character)
+            except InvalidCharacterException:
+                await ctx.send(content=f'Unable to get complete talent info for character {display_name(character)}')
+                return
+            except RequestException as e:
+                await ctx.send(
+                    content=f'Error requesting talent data for character {display_name(character)}: {str(e)}')
+                return
+            materials[character] = talent_materials
 
-        await ctx.send(embed = create_talents_embed(ctx, character, talent_materials))
+        if len(characters) == 1 and start_level is None and end_level is None:
+            await ctx.send(embed = create_talents_embed(ctx, characters[0], materials[characters[0]]))
+            return
+
+        start_level = start_level or 1
+        end_level = end_level or util.MAX_TALENT_LEVEL
+        await ctx.send(embed=create_talent_totals_embed(ctx, materials, start_level, end_level, talent_count))
+
+    @command(name='leaderboard', aliases=['lb'],
+             help='Ranks the players linked by members of this server. '
+                  f'Usage: !leaderboard [{"|".join(LEADERBOARDS)}]')
+    async def leaderboard_command(self, ctx, category: str = 'abyss'):
+        category = category.lower()
+        if category not in LEADERBOARDS:
+            await ctx.send(f'No leaderboard {category}, try one of {", ".join(LEADERBOARDS)}')
+            return
+        if not ctx.guild:
+            await ctx.send('Leaderboards are only for servers')
+            return
+        links = await util.adb.get_guild_links(ctx.guild.id, [member.id for member in ctx.guild.members])
+        if not links:
+            await ctx.send('Nobody in this server has linked a player yet, link one with `!link <uid or name>`')
+            return
+        refresh_stale_links(links)
+        players = [(link['community_uid'], link_record_card(link)) for link in links]
+        title = f'{ctx.guild.name} {LEADERBOARDS[category][0]} Leaderboard'
+        await send_player_table(ctx, players, category == 'abyss',
+                                lambda results: create_leaderboard_embed(ctx, title, category, results, len(players)))
+
+    @command(name='compare', help='Compares the stats of several players. '
+                                  'Usage: !compare <uid, name or -me> <uid, name or -me> ...')
+    async def compare_command(self, ctx, *args: str):
+        if not args:
+            await ctx.send('Usage: !compare <uid, name or -me> <uid, name or -me> ...')
+            return
+        identities = _split_identities(args)
+        if len(identities) > COMPARE_MAX_PLAYERS:
+            await ctx.send(f'At most {COMPARE_MAX_PLAYERS} players can be compared at once')
+            return
+        identified = await asyncio.gather(*[_identify(ctx, identity) for identity in identities])
+        players = [(uid, record_card) for uid, _, record_card in identified if uid]
+        if not players:
+            await ctx.send('No user found')
+            return
+        order = [uid for uid, _ in players]
+        await send_player_table(ctx, players, True,
+                                lambda results: create_compare_embed(ctx, order, results, len(players)))
 
     @command(name='abyss', aliases=['a'], help='Gets current spiral abyss information for a player')
     async def abyss_command(self, ctx, *args: str):
-        uid, args = await _identify(ctx, args)
+        fresh, args = _pop_flag(args, FRESH_FLAGS)
+        uid, args, record_card = await _identify(ctx, args, fresh)
 
         if not uid:
             await ctx.send(f'No user found')
             return
 
-        info = await get_info(ctx, uid)
-        if not info:
+        # The abyss only needs the game uid and nickname, so skip the user stats request
+        record_card = await get_record_card(ctx, uid, fresh, record_card)
+        if not record_card:
             return
 
-        await ctx.send(embed=create_spiral_abyss_embed(ctx, info['uid'], info['nickname']))
+        abyss = await get_genshin_data().get_spiral_abyss(record_card['game_role_id'], fresh)
+        nick = record_card['nickname']
+        await ctx.send(embed=cached_embed(ctx, ('abyss', record_card['game_role_id']), spiral_abyss_data(abyss, nick),
+                                          lambda: create_spiral_abyss_embed(ctx, abyss, nick),
+                                          abyss.last_updated))
+
+
+def command_cost(ctx) -> int:
+    """
+    returns: the cost of the command ctx invokes for the scheduler, the HoYoLAB requests it makes going by what is
+    cached, plus one for every character given to characters for the embeds they take.
+    Commands answered from the cache, the genshin.dev mirror or the database cost nothing.
+    """
+    genshin_data = get_genshin_data()
+    name = ctx.command.name
+    # ctx.args starts with the cog and the context
+    fresh, args = _pop_flag(ctx.args[2:], FRESH_FLAGS)
+    # link always asks HoYoLAB
+    fresh = fresh or name == 'link'
+    if name == 'search':
+        return 1 if args and (fresh or genshin_data.cached('search', args[0].lower()) is None) else 0
+    if name in ['leaderboard', 'compare']:
+        # get_many keeps this many players' requests going at once
+        return genshin_data.MANY_CONCURRENCY
+    if name not in COMMAND_REQUESTS:
+        return 0
+
+    kinds = list(COMMAND_REQUESTS[name])
+    cost = 0
+    uid = None
+    if not args or args[0] in ME_FLAGS:
+        # The record card comes from the link, the game uid is not known without asking the database
+        cost -= 1
+    elif args[0] == '-uid':
+        args = args[1:]
+        uid = int(args[0]) if args and args[0].isdigit() else None
+    elif args[0].isdigit():
+        uid = int(args[0])
+    else:
+        results = None if fresh else genshin_data.cached('search', args[0].lower())
+        if results:
+            uid = int(results[0]['uid'])
+        else:
+            cost += 1
+    characters = args[1:]
+    if name == 'characters' and characters:
+        kinds.append('characters')
+        # Names spanning several words like "hu tao" are one character
+        cost += len(GenshinDevData.character_index.resolve(list(characters))) if GenshinDevData.ready() \
+            else len(characters)
+
+    record_card = None if fresh or uid is None else genshin_data.cached('record_card', uid)
+    if not record_card or 'game_role_id' not in record_card:
+        return max(0, cost + 1 + len(kinds))
+    return cost + sum(1 for kind in kinds if genshin_data.cached(kind, record_card['game_role_id']) is None)
 
 
 def create_profile_card(ctx, info: Dict[str, any]):
@@ -106,17 +460,136 @@ def create_profile_card(ctx, info: Dict[str, any]):
     return embed
 
 
-async def _identify(ctx, args: list):
-    if args[0] in '-uid':
+def _pop_flag(args: tuple, flags: List[str]):
+    """
+    returns: whether any of flags was given and the remaining args
+    """
+    remaining = tuple(arg for arg in args if arg.lower() not in flags)
+    return len(remaining) != len(args), remaining
+
+
+def _parse_talent_args(args: tuple):
+    """
+    returns: (characters, start level, end level, number of talents per character), levels are None when not given
+    raises: ValueError with a message for the user when the arguments are invalid
+    """
+    characters = []
+    levels = []
+    flags = {'-from': None, '-to': None, '-talents': 3}
+    args = list(args)
+    while args:
+        arg = args.pop(0).lower()
+        if arg in flags:
+            if not args or not args[0].isdigit():
+                raise ValueError(f'Expected a number after {arg}')
+            flags[arg] = int(args.pop(0))
+        elif arg.isdigit():
+            levels.append(int(arg))
+        else:
+            characters.append(arg)
+
+    if len(levels) > 2:
+        raise ValueError('Expected at most two levels')
+    start_level, end_level = flags['-from'], flags['-to']
+    if len(levels) == 2:
+        start_level, end_level = levels
+    elif len(levels) == 1:
+        end_level = levels[0]
+
+    if not 1 <= (start_level or 1) < (end_level or util.MAX_TALENT_LEVEL) <= util.MAX_TALENT_LEVEL:
+        raise ValueError(f'Talent levels must satisfy 1 <= from < to <= {util.MAX_TALENT_LEVEL}')
+    if not 1 <= flags['-talents'] <= 3:
+        raise ValueError('A character only has 3 talents')
+    return characters, start_level, end_level, flags['-talents']
+
+
+async def get_character_index() -> Optional[CharacterIndex]:
+    """
+    returns: the index of character names, None if genshin.dev could not be reached to load it
+    """
+    if GenshinDevData.ready():
+        return GenshinDevData.character_index
+    # The mirror has not been loaded yet so this has to go to genshin.dev
+    loop = asyncio.get_event_loop()
+    try:
+        return await loop.run_in_executor(None, GenshinDevData.get_character_index)
+    except RequestException as e:
+        print(f'Failed to load the character list from genshin.dev: {e}')
+        return None
+
+
+def unresolved_message(names: List[Tuple[str, Tuple[str, ...]]]) -> Optional[str]:
+    """
+    names: as given by CharacterIndex.resolve
+    returns: what to tell the user about the names that are not exactly one character, None if there are none
+    """
+    lines = []
+    for name, characters in names:
+        if not characters:
+            lines.append(f'Unknown character {name}')
+        elif len(characters) > 1:
+            lines.append(f'{name} could be any of {", ".join(map(display_name, characters))}')
+    return '\n'.join(lines) or None
+
+
+def character_queries(names: List[Tuple[str, Tuple[str, ...]]]) -> List[str]:
+    """
+    names: as given by CharacterIndex.resolve
+    returns: the names to look for among a player's characters. Words genshin.dev does not know are joined,
+    so a character newer than its list is still found by its full name.
+    """
+    queries = []
+    unknown = False
+    for name, characters in names:
+        if not characters and unknown:
+            queries[-1] += ' ' + name
+        else:
+            queries.append(name)
+        unknown = not characters
+    return queries
+
+
+def _split_identities(args: tuple) -> List[List[str]]:
+    """
+    returns: args split into the args of _identify for each player, -uid is kept with the uid after it
+    """
+    identities = []
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg == '-uid' and args:
+            identities.append([arg, args.pop(0)])
+        else:
+            identities.append([arg])
+    return identities
+
+
+async def _identify(ctx, args: list, fresh: bool = False):
+    """
+    returns: (community uid, remaining args, record card if it is known without asking HoYoLAB)
+    """
+    if not args or args[0] in ME_FLAGS:
+        link = await util.adb.get_user_link(ctx.author.id)
+        if not link:
+            await ctx.send(f'No player linked to {ctx.author.display_name}, link one with `!link <uid or name>`')
+            return None, None, None
+        record_card = None if fresh else link_record_card(link)
+        if not fresh:
+            refresh_stale_links([link])
+        return link['community_uid'], args[1:], record_card
+    if args[0] == '-uid':
+        if len(args) < 2 or not args[1].isdigit():
+            await ctx.send('Expected a community uid after -uid')
+            return None, None, None
         uid = int(args[1])
         args = args[2:]
     elif args[0].isdigit():
         uid = int(args[0])
         args = args[1:]
     else:
-        res = genshin_data.search(args[0])
+        res = await get_genshin_data().search(args[0], fresh)
         if not res:
-            return None, None
+            return None, None, None
         if len(res) > 1:
             await ctx.send(
                 f'Found {len(res)} users matching name {args[0]}\n '
@@ -125,24 +598,91 @@ async def _identify(ctx, args: list):
         uid = int(res[0]['uid'])
         args = args[1:]
     # Maybe do something to verify uid :)
-    return uid, args
+    return uid, args, None
+
+
+def link_record_card(link: Dict[str, any]) -> Dict[str, any]:
+    """
+    returns: the parts of a record card that are stored with a user's link
+    """
+    return {
+        'game_role_id': link['game_uid'],
+        'nickname': link['nickname'],
+        'level': link['adventure_rank'],
+        'region_name': link['region'],
+    }
 
 
-async def get_info(ctx, uid: int):
+def refresh_stale_links(links: List[Dict[str, any]]):
+    """
+    Fetches the record cards of links older than LINK_MAX_AGE in the background and stores them with the links,
+    so their nickname and adventure rank do not stay as they were at !link
+    """
+    now = datetime.datetime.now()
+    stale = [link for link in links
+             if (now - datetime.datetime.fromisoformat(str(link['last_update']))).total_seconds() > LINK_MAX_AGE]
+    stale.sort(key=lambda link: str(link['last_update']))
+    for link in stale[:LINK_REFRESHES_PER_COMMAND]:
+        task = asyncio.ensure_future(refresh_link(link['community_uid']))
+        link_refreshes.add(task)
+        task.add_done_callback(link_refreshes.discard)
+
+
+async def refresh_link(uid: int):
+    try:
+        record_card = await get_genshin_data().get_record_card(uid)
+    except Exception as e:
+        print(f'Failed to refresh the link to {uid}: {e}')
+        return
+    if record_card:
+        await update_links(uid, record_card)
+
+
+async def update_links(uid: int, record_card: Dict[str, any]):
+    await util.adb.update_user_links(uid, record_card['game_role_id'], record_card['nickname'],
+                                     record_card['region_name'], record_card['level'])
+
+
+async def send_player_table(ctx, players: List[Tuple[int, Dict[str, any]]], abyss: bool,
+                            render: Callable[[List[Tuple[int, Profile, AbyssSeason]]], discord.Embed]):
+    """
+    Sends the embed render makes of no results, then edits it as GenshinData.get_many fetches the players
+    players: (community uid, record card if known) of every player
+    render: makes the embed of the results so far, see GenshinData.get_many
+    """
+    results = []
+    message = await ctx.send(embed=render(results))
+    last_edit = time.monotonic()
+    async for result in get_genshin_data().get_many(players, abyss):
+        results.append(result)
+        if len(results) < len(players) and time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL:
+            await message.edit(embed=render(results))
+            last_edit = time.monotonic()
+    await message.edit(embed=render(results))
+
+
+async def get_info(ctx, uid: int, fresh: bool = False, record_card: Dict[str, any] = None):
     if not uid:
         await ctx.send(f'No user found')
-    info = genshin_data.get_info(uid)
+        return None
+    info = await get_genshin_data().get_info(uid, fresh, record_card)
     if not info:
         await ctx.send(f'No user found with community uid {uid}.\nProfile could be private.')
     return info
 
 
-async def get_record_card(ctx, uid: int):
+async def get_record_card(ctx, uid: int, fresh: bool = False, record_card: Dict[str, any] = None):
+    if record_card:
+        return record_card
     if not uid:
         await ctx.send(f'No user Found')
-    record_card = genshin_data.get_record_card(uid)
+        return None
+    record_card = await get_genshin_data().get_record_card(uid, fresh)
     if not record_card:
         await ctx.send(f'No user found with community uid {uid}.\nProfile could be private.')
+    elif fresh:
+        # Keeps what linked players are shown with current, see refresh_stale_links
+        await update_links(uid, record_card)
     return record_card
 
 
@@ -153,51 +693,145 @@ def field_helper(names: Union[List[str], str], inline: bool, embed: discord.Embe
         embed.add_field(name=name, value=f'{source[name.lower().replace(" ", "_")]}', inline=inline)
 
 
-def field_footer(ctx, embed: discord.Embed):
-    embed.set_footer(text=f'Requested by {ctx.author.display_name}')
+def field_footer(ctx, embed: discord.Embed, last_updated: float = None):
+    """
+    last_updated: unix time the embed's data was fetched from HoYoLAB, shown in the footer in the reader's timezone
+    """
+    if last_updated is None:
+        embed.set_footer(text=f'Requested by {ctx.author.display_name}')
+        return
+    embed.set_footer(text=f'Requested by {ctx.author.display_name} | Last updated')
+    embed.timestamp = datetime.datetime.fromtimestamp(last_updated, datetime.timezone.utc)
+
+
+def fingerprint(data) -> bytes:
+    # Equal data can pickle differently when objects are shared differently, that only costs a cache miss
+    return hashlib.blake2b(pickle.dumps(data, pickle.HIGHEST_PROTOCOL), digest_size=16).digest()
+
+
+def cached_embed(ctx, key: tuple, data, render: Callable[[], discord.Embed],
+                 last_updated: float = None) -> discord.Embed:
+    """
+    key: identifies what is rendered, e.g. (command, uid)
+    data: everything the embed is rendered from, kept as small as possible since it is hashed on every call
+    returns: the embed render() would make, reused from render_cache while data is unchanged,
+    with the footer set for this requester and last_updated
+    """
+    # The emoji index is replaced whenever an emoji changes, which changes the rendered embeds too
+    cache_key = (*key, fingerprint(data), util.db.emoji_version)
+    embed_dict = render_cache.get(cache_key)
+    if embed_dict is None:
+        embed_dict = render().to_dict()
+        embed_dict.pop('footer', None)
+        embed_dict.pop('timestamp', None)
+        render_cache.set(cache_key, embed_dict, RENDER_CACHE_TTL)
+    embed = discord.Embed.from_dict(embed_dict)
+    field_footer(ctx, embed, last_updated)
+    return embed
 
 def get_emoji(character: str):
-    emoji = util.db.get_emoji(character)
-    if emoji:
-        emoji = emoji["discord_id"]
-    else:
-        emoji = ''
-
-    return emoji
-
-def create_stats_embed(ctx, info: Dict[str, any]):
-    stats_embed = discord.Embed(title=f'{info["nickname"]}\'s Stats')
-    field_helper(['Nickname', 'Adventure Rank'], True, stats_embed, info)
-    field_helper('Region', False, stats_embed, info)
-    field_helper(['Achievements', 'Active Days'], True, stats_embed, info['stats'])
+    return util.db.emoji_ids.get(character, '')
+
+def create_stats_embed(ctx, info: Profile):
+    stats_embed = discord.Embed(title=f'{info.nickname}\'s Stats')
+    stats_embed.add_field(name='Nickname', value=info.nickname, inline=True)
+    stats_embed.add_field(name='Adventure Rank', value=f'{info.adventure_rank}', inline=True)
+    stats_embed.add_field(name='Region', value=info.region, inline=False)
+    stats_embed.add_field(name='Achievements', value=f'{info.achievements}', inline=True)
+    stats_embed.add_field(name='Active Days', value=f'{info.active_days}', inline=True)
     field_footer(ctx, stats_embed)
     return stats_embed
 
 
-def create_characters_embed(ctx, info: Dict[str, any]):
-    # Pray this never goes over the character limit
-    character_embed = discord.Embed(title=f'{info["nickname"]}\'s Characters')
-    characters = info['characters']
+def characters_page_count(info: Profile):
+    return max(1, math.ceil(len(info.characters) / CHARACTERS_PER_PAGE))
+
+def characters_page_data(info: Profile, page: int):
+    characters = info.characters[page * CHARACTERS_PER_PAGE:(page + 1) * CHARACTERS_PER_PAGE]
+    return (info.nickname, len(info.characters), tuple((c.name, c.rarity, c.level, c.friendship) for c in characters))
+
+def create_characters_embed(ctx, info: Profile, page: int = 0):
+    page_count = characters_page_count(info)
+    title = f'{info.nickname}\'s Characters'
+    if page_count > 1:
+        title += f' ({page + 1}/{page_count})'
+    character_embed = discord.Embed(title=title)
+    characters = info.characters[page * CHARACTERS_PER_PAGE:(page + 1) * CHARACTERS_PER_PAGE]
     for character in characters:
-        emoji = get_emoji(character['name'].lower())
-        value = ':star:' * character['rarity'] \
-                + '\n' + f'**Level**: {character["level"]}'.ljust(15) \
-                + '\n' + f'**Friendship**: {character["friendship"]}'.rjust(16)
-        character_embed.add_field(name=f'__{emoji}{character["name"]}__', value=value, inline=True)
+        emoji = get_emoji(character.name.lower())
+        value = ':star:' * character.rarity \
+                + '\n' + f'**Level**: {character.level}'.ljust(15) \
+                + '\n' + f'**Friendship**: {character.friendship}'.rjust(16)
+        character_embed.add_field(name=f'__{emoji}{character.name}__', value=value, inline=True)
     field_footer(ctx, character_embed)
     return character_embed
 
-def create_weapon_embed(ctx, weapon: Dict[str, any]):
-    weapon_embed = discord.Embed(title=f'__Weapon:__ {weapon["name"]}',
-                                     description=f':star:' * weapon['rarity'] + '\n'
-                                           + f'**Level:** {weapon["level"]}\n'
-                                           + f'**Ascension:** {weapon["ascension"]}\n'
-                                           + f'**Refinement:** {weapon["refinement"]}')
-    weapon_embed.set_thumbnail(url=weapon['icon'])
+def table(header: List[str], rows: List[List[any]]) -> str:
+    """
+    returns: rows under header as a code block, the first column left aligned and the rest right aligned
+    """
+    rows = [header] + [[str(value) for value in row] for row in rows]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    lines = [' '.join(value.ljust(width) if i == 0 else value.rjust(width)
+                      for i, (value, width) in enumerate(zip(row, widths))) for row in rows]
+    return '```\n' + '\n'.join(lines) + '\n```'
+
+
+def table_progress(results: List[Tuple[int, Profile, AbyssSeason]], total: int) -> str:
+    """
+    returns: lines to put under a table saying how many players are still being fetched and how many could not be
+    """
+    unavailable = sum(1 for _, profile, _ in results if not profile)
+    progress = ''
+    if len(results) < total:
+        progress += f'\nFetching players... {len(results)}/{total}'
+    if unavailable:
+        progress += f'\n{unavailable} private or unavailable'
+    return progress
+
+
+def create_leaderboard_embed(ctx, title: str, category: str, results: List[Tuple[int, Profile, AbyssSeason]],
+                             total: int):
+    column, value = LEADERBOARDS[category]
+    ranked = sorted(((value(profile, abyss), profile.nickname) for _, profile, abyss in results
+                     if profile and value(profile, abyss) is not None), key=lambda row: (-row[0], row[1]))
+    rows = [[f'{rank}. {nickname[:20]}', amount]
+            for rank, (amount, nickname) in enumerate(ranked[:LEADERBOARD_ROWS], 1)]
+    embed = discord.Embed(title=title, description=table(['Player', column], rows) + table_progress(results, total))
+    field_footer(ctx, embed)
+    return embed
+
+
+def create_compare_embed(ctx, order: List[int], results: List[Tuple[int, Profile, AbyssSeason]], total: int):
+    """
+    order: community uids in the order the players were given
+    """
+    by_uid = {uid: (profile, abyss) for uid, profile, abyss in results if profile}
+    rows = []
+    for uid in order:
+        if uid not in by_uid:
+            continue
+        profile, abyss = by_uid[uid]
+        rows.append([profile.nickname[:20], profile.adventure_rank, profile.achievements, profile.active_days,
+                     abyss.total_stars if abyss else '-', len(profile.characters)])
+    header = ['Player', 'AR', 'Achievements', 'Days', 'Abyss stars', 'Characters']
+    embed = discord.Embed(title='Player Comparison', description=table(header, rows) + table_progress(results, total))
+    field_footer(ctx, embed)
+    return embed
+
+
+def create_weapon_embed(ctx, weapon: Weapon):
+    weapon_embed = discord.Embed(title=f'__Weapon:__ {weapon.name}',
+                                     description=f':star:' * weapon.rarity + '\n'
+                                           + f'**Level:** {weapon.level}\n'
+                                           + f'**Ascension:** {weapon.ascension}\n'
+                                           + f'**Refinement:** {weapon.refinement}')
+    weapon_embed.set_thumbnail(url=weapon.icon)
 
     return weapon_embed
 
-def create_artifacts_embeds(ctx, artifacts: List[Dict[str, any]], set_count: Dict[str, int], set_effect: Dict[str, str]):
+def create_artifacts_embeds(ctx, artifacts: Tuple[Artifact, ...], set_count: Dict[str, int],
+                            set_effect: Dict[str, Tuple[Tuple[int, str], ...]]):
 
     artifact_embeds = []
 
@@ -206,126 +840,139 @@ def create_artifacts_embeds(ctx, artifacts: List[Dict[str, any]], set_count: Dic
 
     # individual artifacts
     for artifact in artifacts:
-        set_name = artifact['set']['name']
+        set_name = artifact.set.name
         if set_name not in set_count:
             set_count[set_name] = 0
-            set_effect[set_name] = artifact['set']['effects']
+            set_effect[set_name] = artifact.set.effects
         set_count[set_name] += 1
-        current_artifact_embed = discord.Embed(title=f'__{artifact["pos_name"].title()}:__ {artifact["name"]}',
-                                         description=f':star:' * artifact['rarity'] + '\n'
+        current_artifact_embed = discord.Embed(title=f'__{artifact.pos_name.title()}:__ {artifact.name}',
+                                         description=f':star:' * artifact.rarity + '\n'
                                                + f'**Set:** {set_name}\n'
-                                               + f'**Level:** {artifact["level"]}')
-        current_artifact_embed.set_thumbnail(url=artifact['icon'])
+                                               + f'**Level:** {artifact.level}')
+        current_artifact_embed.set_thumbnail(url=artifact.icon)
         artifact_embeds.append(current_artifact_embed)
 
     # artifact sets
     artifact_set_embed = discord.Embed(title=f'Artifact Set Bonus',
                                      description=f'**{separate_line}**')
     for set_name in set_count:
-        for effect in set_effect[set_name]:
-            if set_count[set_name] >= effect['pieces']:
-                artifact_set_embed.add_field(name=f'__{effect["pieces"]}-Piece Set:__ {set_name}',
-                                                 value=effect['effect'], inline=True)
+        for pieces, effect in set_effect[set_name]:
+            if set_count[set_name] >= pieces:
+                artifact_set_embed.add_field(name=f'__{pieces}-Piece Set:__ {set_name}', value=effect, inline=True)
     artifact_embeds.append(artifact_set_embed)
 
     return artifact_embeds
     
 
-def create_character_embed(ctx, nick: str, character: Dict[str, any]):
-    player_character_embed = discord.Embed(title=f'{nick}\'s {character["name"]}',
-                                           description=':star:' * character['rarity'] + '\n'
-                                                       + f'**Level**: {character["level"]}\n'
-                                                       + f'**Friendship**: {character["friendship"]}\n'
-                                                       + f'**Constellation**: {character["constellation"]}')
-    player_character_embed.set_thumbnail(url=character['icon'])
+def create_character_embed(ctx, nick: str, character: Character):
+    player_character_embed = discord.Embed(title=f'{nick}\'s {character.name}',
+                                           description=':star:' * character.rarity + '\n'
+                                                       + f'**Level**: {character.level}\n'
+                                                       + f'**Friendship**: {character.friendship}\n'
+                                                       + f'**Constellation**: {character.constellation}')
+    player_character_embed.set_thumbnail(url=character.icon)
 
     return player_character_embed
 
-def create_player_character_embeds(ctx, nick: str, character: Dict[str, any]):
+def create_player_character_embeds(ctx, nick: str, character: Character):
     
     embeds = []
 
     embeds.append(create_character_embed(ctx, nick, character))
-    embeds.append(create_weapon_embed(ctx, character['weapon']))
+    if character.weapon:
+        embeds.append(create_weapon_embed(ctx, character.weapon))
 
     set_count = {}
     set_effect = {}
 
-    embeds += create_artifacts_embeds(ctx, character['artifacts'], set_count, set_effect)
+    embeds += create_artifacts_embeds(ctx, character.artifacts, set_count, set_effect)
 
     field_footer(ctx, embeds[-1])
 
     return embeds
 
-# Assumes that in consecutive level intervals, the rarities of the required materials are consecutive
 def create_talents_embed(ctx, character: str, talent_materials: Dict[str, any]):
-    level_amts = {
-        'talent-book': [(0, 0), (2, 3), (3, 2), (3, 4), (3, 6), (3, 9), (4, 4), (4, 6), (4, 12), (4, 16)],
-        'boss-material': [(0, 0)] * 6 + [(5, 1), (5, 1), (5, 2), (5, 2)],
-        'common-ascension-material': [(0, 0), (1, 6), (2, 3), (2, 4), (2, 6), (2, 9), (3, 4), (3, 6), (3, 9), (3, 12)],
-        'crown': [(0, 0)] * 9 + [(5, 1)],
-    }
-
     level_intervals = [(1, 2), (2, 6), (6, 10)]
 
-    talents_embed = discord.Embed(title=f'Required talent materials for {character.capitalize()}:')
+    talents_embed = discord.Embed(title=f'Required talent materials for {display_name(character)}:')
     
-    for material_type in ['talent-book', 'boss-material', 'common-ascension-material', 'crown']:
+    for material_type in TALENT_MATERIAL_TYPES:
         material_type_header = material_type.replace('-', ' ').capitalize()
         talents_embed.add_field(name=f'{separate_line}\n{material_type_header}',
             value=f'**{separate_line}**', inline = False)
 
         material_rarities = talent_materials[material_type]
 
-        rarity_idx = 0
-        for level_interval in level_intervals:
-            start_level = level_interval[0]
-            end_level = level_interval[1]
-            required_amts = util.calculate_required_materials(start_level - 1, end_level - 1, level_amts[material_type])
+        for start_level, end_level in level_intervals:
+            for rarity, amt in util.required_talent_materials(material_type, start_level, end_level):
+                material_rarity = material_rarities[util.talent_material_index(material_type, rarity)]
+                talents_embed.add_field(
+                    name=f'__{material_rarity["name"]}__:',
+                    value=f':star:' * rarity + '\n'
+                            + f'**Amount:** {amt}\n'
+                            + f'**Levels:** {start_level} - {end_level}\n',
+                    inline=True,
+                )
 
+    field_footer(ctx, talents_embed)
+
+    return talents_embed
+
+def create_talent_totals_embed(ctx, materials: Dict[str, Dict[str, any]], start_level: int, end_level: int,
+                               talent_count: int):
+    character_names = ', '.join(display_name(character) for character in materials)
+    talents_embed = discord.Embed(title=f'Total talent materials for {character_names}:',
+                                  description=f'**Levels:** {start_level} - {end_level} '
+                                              f'for {talent_count} talent{"s" if talent_count > 1 else ""} each')
+
+    for material_type in TALENT_MATERIAL_TYPES:
+        required_amts = util.required_talent_materials(material_type, start_level, end_level)
+        if not required_amts:
+            continue
+
+        # material name -> [rarity, total amount], kept in the order materials are first seen
+        totals = {}
+        for talent_materials in materials.values():
+            material_rarities = talent_materials[material_type]
             for rarity, amt in required_amts:
-                if amt != 0:
-                    material_rarity = material_rarities[rarity_idx]
-                    talents_embed.add_field(
-                        name=f'__{material_rarity["name"]}__:',
-                        value=f':star:' * rarity + '\n'
-                                + f'**Amount:** {amt}\n'
-                                + f'**Levels:** {start_level} - {end_level}\n',
-                        inline=True,
-                    )
-
-                    rarity_idx += 1
+                name = material_rarities[util.talent_material_index(material_type, rarity)]['name']
+                totals.setdefault(name, [rarity, 0])[1] += amt * talent_count
+
+        value = '\n'.join(f'{":star:" * rarity} **{name}:** {amt}'
+                          for name, (rarity, amt) in sorted(totals.items(), key=lambda item: item[1][0]))
+        material_type_header = material_type.replace('-', ' ').capitalize()
+        talents_embed.add_field(name=f'{separate_line}\n{material_type_header}', value=value, inline=False)
 
     field_footer(ctx, talents_embed)
 
     return talents_embed
 
-def create_spiral_abyss_embed(ctx, uid: int, player_name: str):
-    abyss_data = genshin_data.get_spiral_abyss(uid)
+def spiral_abyss_data(abyss: AbyssSeason, player_name: str):
+    floors = tuple((floor.floor, tuple((chamber.chamber, chamber.max_stars, chamber.first_half, chamber.second_half)
+                                       for chamber in floor.chambers)) for floor in abyss.floors)
+    return player_name, abyss.season, abyss.start_time, abyss.end_time, abyss.stats, abyss.ranks, floors
 
+def create_spiral_abyss_embed(ctx, abyss: AbyssSeason, player_name: str):
     abyss_embed = discord.Embed(
-        title=f'Spiral Abyss season {abyss_data["season"]} info for {player_name}' + 
+        title=f'Spiral Abyss season {abyss.season} info for {player_name}' + 
         f'\n{separate_line}',
-        description=f'**Start Time:** {abyss_data["season_start_time"]}\n' + 
-        f'**End Time:** {abyss_data["season_end_time"]}\n',
+        description=f'**Start Time:** {abyss.start_time}\n' + 
+        f'**End Time:** {abyss.end_time}\n',
     )
 
     stats_str = ''
-    for stat, value in abyss_data['stats'].items():
+    for stat, value in abyss.stats:
         stat_name = stat.replace('_', ' ').capitalize()
         stats_str += f'**{stat_name}:** {value}'
         if 'star' in stat:
             stats_str += ':star:'
         stats_str += '\n'
 
-    for rank, characters in abyss_data['character_ranks'].items():
-        if len(characters) == 0:
-            break
-
+    for rank, character, value in abyss.ranks:
         rank_name = rank.replace('_', ' ').capitalize()
-        emoji = get_emoji(characters[0]['name'].lower())
+        emoji = get_emoji(character.lower())
         
-        stats_str += f'{emoji} **{rank_name}:** {characters[0]["value"]}\n'
+        stats_str += f'{emoji} **{rank_name}:** {value}\n'
 
     abyss_embed.add_field(
         name=f'{separate_line}\nStats\n{separate_line}',
@@ -333,24 +980,23 @@ def create_spiral_abyss_embed(ctx, uid: int, player_name: str):
         inline=False,
     )
 
-    for floor in abyss_data['floors']:
+    for floor in abyss.floors:
         floor_str = ''
 
-        for chamber in floor['chambers']:
-            floor_str += f'**Chamber {chamber["chamber"]}**: '
+        for chamber in floor.chambers:
+            floor_str += f'**Chamber {chamber.chamber}**: '
 
-            first_half, second_half = chamber['battles']
-            first_half_emojis = [get_emoji(char['name'].lower()) for char in first_half['characters']]
-            second_half_emojis = [get_emoji(char['name'].lower()) for char in second_half['characters']]
+            first_half_emojis = [get_emoji(name.lower()) for name in chamber.first_half]
+            second_half_emojis = [get_emoji(name.lower()) for name in chamber.second_half]
 
             floor_str += ' '.join(first_half_emojis) + ' '
-            floor_str += ':star:' * chamber['max_stars'] + ' '
+            floor_str += ':star:' * chamber.max_stars + ' '
             floor_str += ' '.join(second_half_emojis)
 
             floor_str += '\n'
 
         abyss_embed.add_field(
-            name=f'{separate_line}\nFloor {floor["floor"]}\n{separate_line}',
+            name=f'{separate_line}\nFloor {floor.floor}\n{separate_line}',
             value=floor_str,
             inline=False,
         )
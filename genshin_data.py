@@ -1,76 +1,394 @@
-from functools import cmp_to_key
-from typing import List
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from functools import partial
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
 
 import genshinstats as gs
 
+import models
+from cache import PrefixIndex, SharedCache, TTLCache
+from character_index import CharacterIndex, normalize
+from cookie_pool import CookiePool
+from database import AsyncDatabase
+from metrics import metrics, watch_cache
+from models import AbyssSeason, Character, Profile
+from prefetcher import DecayingCounter, abyss_season_end
+from rate_limit import SingleFlight, TokenBucket
+
 class GenshinData:
-    # TODO: Cache data and implement rate limiting
     # TODO: Do something to get profile icon?
 
     DEFAULT_AVATAR = 'https://img-os-static.hoyolab.com/avatar/avatar1.png'
+    # genshinstats is blocking, so upstream calls run on this many worker threads per account
+    WORKERS_PER_ACCOUNT = 8
+    # Seconds each type of upstream response is kept for
+    CACHE_TTL = {
+        'search': 10 * 60,
+        'record_card': 10 * 60,
+        'user_stats': 5 * 60,
+        'characters': 5 * 60,
+        'spiral_abyss': 15 * 60,
+    }
+    # Seconds empty responses, e.g. a search with no results, are kept for
+    NEGATIVE_CACHE_TTL = {
+        'search': 2 * 60,
+    }
+    CACHE_MAX_ENTRIES = 2048
+    CACHE_MAX_BYTES = 64 * 1024 * 1024
+    # Number of player names remembered from searches for resolving partial names locally
+    SEARCH_INDEX_SIZE = 20000
+    SEARCH_SIZE = 20
+    # (requests per second, burst size) allowed against each HoYoLAB endpoint,
+    # per account for every endpoint except the cookieless ones
+    RATE_LIMITS = {
+        'search': (1, 5),
+        'record_card': (0.5, 5),
+        'user_stats': (0.5, 5),
+        'characters': (0.5, 5),
+        'spiral_abyss': (0.5, 5),
+    }
+    # Endpoints that do not take a login cookie, these share one rate limit
+    COOKIELESS = ['search']
+    # Seconds a request waits for the rate limiter before giving up
+    RATE_LIMIT_TIMEOUT = 30
+    # Responses kept as snapshots in the database, answered from even when stale or HoYoLAB is down
+    SNAPSHOT_KINDS = ['record_card', 'user_stats', 'characters', 'spiral_abyss']
+    # Seconds a snapshot past its CACHE_TTL is still answered from while it is refreshed in the background,
+    # older snapshots are only used when HoYoLAB fails
+    SNAPSHOT_MAX_AGE = 7 * 24 * 60 * 60
+    # Seconds a stale snapshot is cached in memory for while its refresh runs
+    STALE_TTL = 30
+    # Players get_many fetches at once
+    MANY_CONCURRENCY = 8
+    # Responses whose popularity is tracked for the Prefetcher, keyed like the cache
+    PREFETCH_KINDS = ['record_card', 'user_stats', 'spiral_abyss']
+    # Seconds for a response's request count to halve
+    POPULARITY_HALF_LIFE = 60 * 60
+    POPULARITY_MAX_KEYS = 10000
+
+    def __init__(self, accounts: List[Tuple[int, str]], max_workers: int = None,
+                 rate_limits: Dict[str, Tuple[float, int]] = None, shared_cache: SharedCache = None,
+                 snapshots: AsyncDatabase = None, processes: int = 1):
+        """
+        accounts: (ltuid, ltoken) pairs of every HoYoLAB account requests are spread over
+        shared_cache: second cache level checked before going upstream, shared with the bot's other processes
+        snapshots: database responses in SNAPSHOT_KINDS are stored in, so they outlive restarts and outages
+        processes: how many of the bot's processes use the same accounts, each is given that share of every
+        rate limit so together they stay within it
+        """
+        rate_limits = {kind: (rate / processes, max(1, burst // processes))
+                       for kind, (rate, burst) in {**self.RATE_LIMITS, **(rate_limits or {})}.items()}
+        self.pool = CookiePool(accounts, {kind: limit for kind, limit in rate_limits.items()
+                                          if kind not in self.COOKIELESS})
+        self.limiters = {kind: TokenBucket(*rate_limits[kind]) for kind in self.COOKIELESS}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or self.WORKERS_PER_ACCOUNT * len(accounts),
+                                           thread_name_prefix='genshinstats')
+        self.cache = TTLCache(self.CACHE_MAX_ENTRIES, self.CACHE_MAX_BYTES)
+        self.in_flight = SingleFlight()
+        self.names = PrefixIndex(self.SEARCH_INDEX_SIZE)
+        self.shared_cache = shared_cache
+        self.snapshots = snapshots
+        self.popularity = DecayingCounter(self.POPULARITY_HALF_LIFE, self.POPULARITY_MAX_KEYS)
+        # Background refreshes of stale snapshots, kept so they are not garbage collected while running
+        self.refreshes: Set[asyncio.Task] = set()
+        # Unix time the latest abyss season seen ends
+        self.abyss_season_end = 0
+        if shared_cache:
+            self.shared_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='shared_cache')
+
+        watch_cache('genshinstats', self.cache)
+        if shared_cache:
+            watch_cache('shared', shared_cache)
+        metrics.gauge('upstream_in_flight', lambda: len(self.in_flight))
+        metrics.gauge('accounts_healthy', lambda: sum(account.healthy for account in self.pool.accounts))
+        metrics.gauge('accounts_in_flight', lambda: sum(account.in_flight for account in self.pool.accounts))
+        for kind in rate_limits:
+            metrics.gauge('rate_limit_waiting', partial(self.waiting, kind), endpoint=kind)
+
+    async def check_accounts(self):
+        """
+        Checks that every account can log in, concurrently and without blocking the event loop
+        returns: the number of healthy accounts
+        """
+        results = await asyncio.gather(*[self._run(self.pool.check_health, account)
+                                         for account in self.pool.accounts])
+        if not any(results):
+            print('Login Failed: No HoYoLAB account has valid credentials')
+        return sum(results)
+
+    def waiting(self, kind: str) -> int:
+        """
+        returns: the number of requests queued on the rate limits of kind
+        """
+        if kind in self.COOKIELESS:
+            return self.limiters[kind].waiting
+        return sum(account.limiters[kind].waiting for account in self.pool.accounts)
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def _fetch(self, kind: str, key, fresh: bool, func, *args):
+        return (await self._fetch_entry(kind, key, fresh, func, *args))[0]
+
+    async def _fetch_entry(self, kind: str, key, fresh: bool, func, *args) -> Tuple[any, float]:
+        """
+        Returns the cached response for (kind, key) unless fresh is set, looking in this process's cache,
+        then the shared cache, then the stored snapshots. Otherwise calls func upstream.
+        Snapshots older than CACHE_TTL are still returned straight away and refreshed in the background,
+        and any snapshot is returned when HoYoLAB fails.
+        Concurrent requests for the same (kind, key) share one upstream call. Requests that are not fresh
+        also share a fresh one, but a fresh request never shares a call that may answer from a cache.
+        Empty responses are only cached for kinds in NEGATIVE_CACHE_TTL.
+        returns: (response, unix time it was fetched from HoYoLAB)
+        """
+        if kind in self.PREFETCH_KINDS:
+            self.popularity.add((kind, key))
+        if not fresh:
+            entry = self.cache.get((kind, key))
+            if entry is not None:
+                return entry
+
+        async def fetch():
+            loop = asyncio.get_event_loop()
+            if not fresh and self.shared_cache:
+                cached = await loop.run_in_executor(self.shared_executor, self.shared_cache.get, (kind, key))
+                if cached:
+                    entry, ttl = cached
+                    self.cache.set((kind, key), entry, ttl)
+                    return entry
+
+            snapshot = None
+            if self.snapshots and kind in self.SNAPSHOT_KINDS:
+                snapshot = await self.snapshots.get_snapshot(kind, str(key))
+                if snapshot:
+                    snapshot = (models.load(kind, snapshot[0]), snapshot[1])
+            if snapshot and not fresh:
+                age = time.time() - snapshot[1]
+                if age < self.CACHE_TTL[kind]:
+                    self.cache.set((kind, key), snapshot, self.CACHE_TTL[kind] - age)
+                    return snapshot
+                if age < self.SNAPSHOT_MAX_AGE:
+                    self.cache.set((kind, key), snapshot, self.STALE_TTL)
+                    self._refresh_in_background(kind, key, func, *args)
+                    return snapshot
+
+            try:
+                return await self._fetch_upstream(kind, key, func, *args)
+            except CookiePool.USER_ERRORS:
+                raise
+            except Exception as e:
+                if not snapshot:
+                    raise
+                print(f'Answering {kind} {key} from a snapshot, HoYoLAB failed: {e}')
+                return snapshot
+
+        if fresh or self.in_flight.running(('fresh', kind, key)):
+            return await self.in_flight.do(('fresh', kind, key), fetch)
+        return await self.in_flight.do((kind, key), fetch)
+
+    def _refresh_in_background(self, kind: str, key, func, *args):
+        task = asyncio.ensure_future(self.in_flight.do(('fresh', kind, key),
+                                                       partial(self._fetch_upstream, kind, key, func, *args)))
+        self.refreshes.add(task)
+
+        def done(_):
+            self.refreshes.discard(task)
+            if not task.cancelled() and task.exception():
+                print(f'Failed to refresh {kind} {key} in the background: {task.exception()}')
+                metrics.inc('refresh_errors_total', kind=kind)
+
+        task.add_done_callback(done)
 
-    def __init__(self, uid: int, token: str):
-        gs.set_cookie(ltuid=uid, ltoken=token)
+    async def _fetch_upstream(self, kind: str, key, func, *args) -> Tuple[any, float]:
+        """
+        Calls func upstream and stores the response, parsed into its model, in every cache level
+        """
+        if kind in self.COOKIELESS:
+            with metrics.timer('rate_limit_wait_seconds', endpoint=kind):
+                await self.limiters[kind].acquire(self.RATE_LIMIT_TIMEOUT)
+            with metrics.timer('upstream_seconds', endpoint=kind):
+                result = await self._run(func, *args)
+        else:
+            result = await self._run_with_account(kind, func, *args)
+        result = models.parse(kind, result)
+        entry = (result, time.time())
+        if result:
+            ttl = self.CACHE_TTL[kind]
+        elif kind in self.NEGATIVE_CACHE_TTL:
+            ttl = self.NEGATIVE_CACHE_TTL[kind]
+        else:
+            return entry
+        self.cache.set((kind, key), entry, ttl)
+        if self.shared_cache:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(self.shared_executor, self.shared_cache.set, (kind, key), entry, ttl)
+        if result and self.snapshots and kind in self.SNAPSHOT_KINDS:
+            await self.snapshots.set_snapshot(kind, str(key), models.to_json(result), entry[1])
+        return entry
+
+    def request_capacity(self) -> float:
+        """
+        returns: how many HoYoLAB requests the rate limits let through in half of RATE_LIMIT_TIMEOUT,
+        with more than that waiting some would time out
+        """
+        rate = sum(limiter.rate for limiter in self.limiters.values())
+        rate += sum(limiter.rate for account in self.pool.accounts for limiter in account.limiters.values())
+        return rate * self.RATE_LIMIT_TIMEOUT / 2
+
+    def cached(self, kind: str, key):
+        """
+        returns: the response cached in this process for (kind, key), None if not cached.
+        Unlike a request, looking does not count towards the cache's stats or the response's popularity.
+        """
+        entry = self.cache.peek((kind, key))
+        return entry[0] if entry else None
+
+    def fetched_at(self, kind: str, key) -> float:
+        """
+        returns: unix time the response cached in this process for (kind, key) was fetched, None if not cached
+        """
+        entry = self.cache.peek((kind, key))
+        return entry[1] if entry else None
+
+    async def refresh(self, kind: str, key):
+        """
+        Fetches a response in PREFETCH_KINDS from HoYoLAB again, sharing the call with any fresh request for it
+        """
+        funcs = {
+            'record_card': gs.get_record_card,
+            'user_stats': gs.get_user_stats,
+            'spiral_abyss': gs.get_spiral_abyss,
+        }
+        result, _ = await self.in_flight.do(('fresh', kind, key),
+                                            partial(self._fetch_upstream, kind, key, funcs[kind], key))
+        if kind == 'spiral_abyss' and result:
+            self.abyss_season_end = max(self.abyss_season_end, abyss_season_end(result))
+
+    async def _run_with_account(self, kind: str, func, *args):
+        account = self.pool.acquire()
+        try:
+            with metrics.timer('rate_limit_wait_seconds', endpoint=kind):
+                await account.limiters[kind].acquire(self.RATE_LIMIT_TIMEOUT)
+        except Exception:
+            # Waiting on the rate limit says nothing about the account's health
+            self.pool.cancel(account)
+            raise
         try:
-            gs.get_record_card(46178811)
-        except gs.errors.GenshinStatsException:
-            raise Exception("Login Failed: Bad credentials given")
+            with metrics.timer('upstream_seconds', endpoint=kind):
+                result = await self._run(func, *args, cookie=account.cookie)
+        except Exception as e:
+            self.pool.release(account, e)
+            raise
+        self.pool.release(account)
+        return result
 
-    def search(self, name: str):
-        results = gs.search(name)
+    async def search(self, name: str, fresh: bool = False):
+        """
+        Answers from the cache, then from names seen in earlier searches if one of them is name exactly,
+        and only then from HoYoLAB. Names that only start with name could hide a player called name.
+        """
+        key = name.lower()
+        if not fresh:
+            entry = self.cache.get(('search', key))
+            if entry is not None:
+                return entry[0]
+            if key in self.names:
+                return self.names.search(key, self.SEARCH_SIZE)
+        results = await self._fetch('search', key, fresh, gs.search, name, self.SEARCH_SIZE)
+        for user in results or []:
+            self.names.add(user['nickname'], user)
         return results
 
-    def get_record_card(self, uid: int):
-        record_card = gs.get_record_card(uid)
+    async def get_record_card(self, uid: int, fresh: bool = False):
+        record_card = await self._fetch('record_card', uid, fresh, gs.get_record_card, uid)
         # Make sure we actually get valid results
         if not record_card or 'game_role_id' not in record_card:
             return None
         return record_card
 
-    def get_info(self, uid: int):
-        record_card = self.get_record_card(uid)
+    async def get_info(self, uid: int, fresh: bool = False, record_card: Dict[str, any] = None) -> Profile:
+        """
+        record_card: skips fetching the record card when it is already known, e.g. from a linked account
+        """
+        if not record_card:
+            record_card = await self.get_record_card(uid, fresh)
         if not record_card:
             return None
         genshin_uid = record_card['game_role_id']
-        genshin_info = gs.get_user_stats(genshin_uid)
-        if not genshin_info:
+        profile, fetched_at = await self._fetch_entry('user_stats', genshin_uid, fresh, gs.get_user_stats,
+                                                      genshin_uid)
+        if not profile:
             return None
+        # The cached profile is shared, replace copies it without its characters
+        return replace(profile, uid=genshin_uid, nickname=record_card['nickname'],
+                       adventure_rank=record_card['level'], region=record_card['region_name'],
+                       last_updated=fetched_at)
 
-        full_data = {}
-        # Copy certain values from the record card
-        full_data['uid'] = genshin_uid
-        full_data['nickname'] = record_card['nickname']
-        full_data['adventure_rank'] = record_card['level']
-        full_data['region'] = record_card['region_name']
-
-        # Sort character data
-        def cmp(x, y):
-            if x['rarity'] != y['rarity']:
-                return x['rarity'] - y['rarity']
-            if x['level'] != y['level']:
-                return x['level'] - y['level']
-            if x['friendship'] != y['friendship']:
-                return x['friendship'] - y['friendship']
-            return 1 if x['name'] > y['name'] else (0 if x['name'] == y['name'] else -1)
-
-        genshin_info['characters'] = sorted(genshin_info['characters'], key=cmp_to_key(cmp), reverse=True)
-
-        # Copy values from genshin info
-        for value in ['stats', 'characters', 'explorations']:
-            full_data[value] = genshin_info[value]
-
-        return full_data
-
-    def get_player_character(self, uid: int, names: List[str]):
-        characters = gs.get_characters(uid)
-        res = {}
+    async def get_player_character(self, uid: int, names: List[str], fresh: bool = False,
+                                   index: CharacterIndex = None) -> List[Optional[Character]]:
+        """
+        index: resolves names and the player's character names to the same characters, names must be typed exactly
+        the same as a character's name or alt name, ignoring case and spaces, without it
+        returns: the player's character called each of names, None for those the player does not have
+        """
+        # genshinstats would look the character ids up itself without passing our cookie along
+        profile = await self._fetch('user_stats', uid, fresh, gs.get_user_stats, uid)
+        if not profile:
+            return [None] * len(names)
+        character_ids = [character.id for character in profile.characters]
+        characters = await self._fetch('characters', uid, fresh, gs.get_characters, uid, character_ids)
+
+        def keys(name: str, match) -> tuple:
+            return (normalize(name),) + (match(name) if index else ())
+
+        by_key = {}
         for character in characters:
-            if character['name'] in names or character['alt_name'] in names:
-                res[character['name']] = character
-                if character['alt_name']:
-                    res[character['alt_name']] = character
-        return res
-
-    def get_spiral_abyss(self, uid: int):
-        return gs.get_spiral_abyss(uid)
-        
+            for name in filter(None, (character.name, character.alt_name)):
+                # HoYoLAB's names are spelled right, guessing at them could only find the wrong character
+                for key in keys(name, index and index.exact):
+                    by_key.setdefault(key, character)
+        return [next((by_key[key] for key in keys(name, index and index.lookup) if key in by_key), None)
+                for name in names]
+
+    async def get_many(self, players: List[Tuple[int, Dict[str, any]]], abyss: bool = False,
+                       concurrency: int = None) -> AsyncIterator[Tuple[int, Profile, AbyssSeason]]:
+        """
+        Fetches many players' profiles, and with abyss their abyss seasons, at most concurrency players at a time.
+        Cached responses are used as for a single player.
+        players: (community uid, record card if it is already known) of every player
+        yields: (community uid, profile, abyss season) of each player as they finish, in no particular order.
+        The profile is None if it is private or could not be fetched, the same goes for the abyss season.
+        """
+        semaphore = asyncio.Semaphore(concurrency or self.MANY_CONCURRENCY)
+
+        async def fetch(uid: int, record_card: Dict[str, any]):
+            profile = season = None
+            async with semaphore:
+                try:
+                    profile = await self.get_info(uid, record_card=record_card)
+                    if abyss and profile:
+                        season = await self.get_spiral_abyss(profile.uid)
+                except CookiePool.USER_ERRORS:
+                    pass
+                except Exception as e:
+                    print(f'Failed to fetch player {uid}: {e}')
+            return uid, profile, season
+
+        tasks = [asyncio.ensure_future(fetch(uid, record_card)) for uid, record_card in players]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            # The caller stopped early
+            for task in tasks:
+                task.cancel()
+
+    async def get_spiral_abyss(self, uid: int, fresh: bool = False) -> AbyssSeason:
+        abyss, fetched_at = await self._fetch_entry('spiral_abyss', uid, fresh, gs.get_spiral_abyss, uid)
+        if not abyss:
+            return abyss
+        self.abyss_season_end = max(self.abyss_season_end, abyss_season_end(abyss))
+        return replace(abyss, last_updated=fetched_at)
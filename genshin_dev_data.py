@@ -2,15 +2,38 @@
 class used to get data from https://api.genshin.dev
 """
 
+import json
+import os
+import tempfile
+import threading
 from typing import Dict
 
 import requests
+from dotenv import load_dotenv
+
+from character_index import CharacterIndex
+from metrics import metrics
+
+load_dotenv()
 
 class InvalidCharacterException(Exception):
     pass
 
 class GenshinDevData:
     GENSHIN_DEV_URL = 'https://api.genshin.dev'
+    # genshin.dev data only changes with game patches, so it is mirrored on disk and refreshed in the background
+    MIRROR_FILE = os.getenv('GENSHIN_DEV_MIRROR', 'genshin_dev_mirror.json')
+    MIRRORED_ENDPOINTS = ['/characters', '/materials/talent-book', '/materials/talent-boss',
+                          '/materials/common-ascension']
+
+    # endpoint -> {'etag': ..., 'last_modified': ..., 'data': <response json>}
+    mirror = {}
+    # Held while syncing, so threads that find the mirror empty at once wait for one sync
+    sync_lock = threading.Lock()
+    # character -> talent materials, rebuilt from the mirror whenever it changes
+    talent_materials = {}
+    # Resolves typed names to the character ids used above, rebuilt with it
+    character_index = CharacterIndex([])
 
     def send_request(session: requests.Session, method: str, endpoint: str) -> Dict[str, any]:
         resp = session.request(method, GenshinDevData.GENSHIN_DEV_URL + endpoint, timeout=20)
@@ -20,6 +43,136 @@ class GenshinDevData:
 
         return resp.json()
 
+    def ready() -> bool:
+        return bool(GenshinDevData.talent_materials)
+
+    def load_mirror():
+        """
+        Loads the last good snapshot of the mirror from disk, if there is one
+        """
+        try:
+            with open(GenshinDevData.MIRROR_FILE, 'r') as f:
+                mirror = json.load(f)
+        except (OSError, ValueError):
+            return
+        GenshinDevData.mirror = mirror
+        GenshinDevData.build_indexes()
+
+    def sync_mirror() -> bool:
+        """
+        Refreshes every mirrored endpoint with conditional requests. Endpoints that fail keep their
+        last good data.
+        returns: whether any endpoint changed, False if another thread's sync was waited for instead
+        """
+        if not GenshinDevData.sync_lock.acquire(blocking=False):
+            # Another thread is syncing already, what it fetches is as new as what this one would
+            with GenshinDevData.sync_lock:
+                pass
+            if not GenshinDevData.ready():
+                raise requests.RequestException('No genshin.dev data available')
+            return False
+        try:
+            return GenshinDevData._sync_mirror()
+        finally:
+            GenshinDevData.sync_lock.release()
+
+    def _sync_mirror() -> bool:
+        if not GenshinDevData.mirror:
+            GenshinDevData.load_mirror()
+        mirror = dict(GenshinDevData.mirror)
+        changed = False
+        errors = []
+
+        with requests.session() as session:
+            for endpoint in GenshinDevData.MIRRORED_ENDPOINTS:
+                entry = mirror.get(endpoint)
+                headers = {}
+                if entry and entry.get('etag'):
+                    headers['If-None-Match'] = entry['etag']
+                if entry and entry.get('last_modified'):
+                    headers['If-Modified-Since'] = entry['last_modified']
+                try:
+                    with metrics.timer('genshin_dev_seconds', endpoint=endpoint):
+                        resp = session.get(GenshinDevData.GENSHIN_DEV_URL + endpoint, headers=headers, timeout=20)
+                    if resp.status_code == 304:
+                        continue
+                    if resp.status_code != 200:
+                        raise requests.RequestException(
+                            f'Bad response code {resp.status_code}. Response: {resp.text}')
+                    mirror[endpoint] = {
+                        'etag': resp.headers.get('ETag'),
+                        'last_modified': resp.headers.get('Last-Modified'),
+                        'data': resp.json(),
+                    }
+                    changed = True
+                except (requests.RequestException, ValueError) as e:
+                    errors.append(e)
+                    print(f'Failed to sync {endpoint} from genshin.dev: {e}')
+
+        if changed:
+            GenshinDevData.mirror = mirror
+            GenshinDevData.build_indexes()
+            GenshinDevData.save_mirror()
+        if errors and not GenshinDevData.ready():
+            raise requests.RequestException(f'No genshin.dev data available: {errors[0]}')
+        return changed
+
+    def save_mirror():
+        # Write to a temporary file of its own first, so a crash or another shard's process writing at the same
+        # time never leaves a half written snapshot
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(GenshinDevData.MIRROR_FILE)),
+                                        suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(GenshinDevData.mirror, f)
+            os.replace(tmp_file, GenshinDevData.MIRROR_FILE)
+        except BaseException:
+            os.remove(tmp_file)
+            raise
+
+    def build_indexes():
+        """
+        Builds the character -> talent materials index and the character name index from the mirror,
+        see get_character_talent_materials and get_character_index
+        """
+        index = {}
+
+        def data(endpoint):
+            return GenshinDevData.mirror.get(endpoint, {}).get('data', {})
+
+        for book, info in data('/materials/talent-book').items():
+            for character in info.get('characters', []):
+                index.setdefault(character, {}).setdefault('talent-book', info['items'])
+
+        for material, info in data('/materials/talent-boss').items():
+            for character in info.get('characters', []):
+                index.setdefault(character, {}).setdefault('boss-material', [{
+                    'name': info['name'],
+                    'rarity': 5,
+                }])
+
+        for material, info in data('/materials/common-ascension').items():
+            for character in info.get('characters', []):
+                index.setdefault(character, {}).setdefault('common-ascension-material', info['items'])
+
+        for materials in index.values():
+            materials['crown'] = [{
+                'name': 'Crown of Insight',
+                'rarity': 5,
+            }]
+
+        GenshinDevData.talent_materials = index
+        # Mirrors saved before /characters was mirrored still know the characters with talent materials
+        GenshinDevData.character_index = CharacterIndex(list(data('/characters')) + list(index))
+
+    def get_character_index() -> CharacterIndex:
+        """
+        Only syncs from genshin.dev (blocking) if the mirror has never been loaded.
+        """
+        if not GenshinDevData.ready():
+            GenshinDevData.sync_mirror()
+        return GenshinDevData.character_index
+
     """
     returns: dict with keys:
     [
@@ -33,43 +186,15 @@ class GenshinDevData:
         'name': <material-name>,
         'rarity': <material-rarity>,
     }
+    Only syncs from genshin.dev (blocking) if the mirror has never been loaded.
     """
     def get_character_talent_materials(character: str):
-        ret = dict()
-
-        session = requests.session()
+        if not GenshinDevData.ready():
+            GenshinDevData.sync_mirror()
 
-        # get book
-        books = GenshinDevData.send_request(session, 'get', '/materials/talent-book')
-
-        for book, info in books.items():
-            if 'characters' in info and character in info['characters']:
-                ret['talent-book'] = info['items']
-                break
-
-        # get boss material
-        boss_materials = GenshinDevData.send_request(session, 'get', '/materials/talent-boss')
-        for material, info in boss_materials.items():
-            if 'characters' in info and character in info['characters']:
-                ret['boss-material'] = [{
-                    'name': info['name'],
-                    'rarity': 5,
-                }]
-                break
-
-        # get common ascension material
-        common_materials = GenshinDevData.send_request(session, 'get', '/materials/common-ascension')
-        for material, info in common_materials.items():
-            if 'characters' in info and character in info['characters']:
-                ret['common-ascension-material'] = info['items']
-                break
+        ret = GenshinDevData.talent_materials.get(character, {})
 
         if not ('talent-book' in ret and 'boss-material' in ret and 'common-ascension-material' in ret):
             raise InvalidCharacterException
 
-        ret['crown'] = [{
-            'name': 'Crown of Insight',
-            'rarity': 5,
-        }]
-
-        return ret
\ No newline at end of file
+        return ret
@@ -0,0 +1,195 @@
+"""
+In-process metrics: counters, latency histograms and gauges, exported in the Prometheus text format
+"""
+
+import bisect
+import time
+from typing import Callable, Dict, List, Tuple
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+
+class Histogram:
+
+    def __init__(self, buckets: List[float] = None):
+        self.buckets = buckets or DEFAULT_BUCKETS
+        # The last count is for values over every bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        returns: an estimate of the q quantile, interpolated within the bucket it falls in
+        """
+        if self.count == 0:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0
+                if i == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Timer:
+    """
+    Context manager, sync or async, that observes how long its block took and counts exceptions
+    """
+
+    def __init__(self, metrics: 'Metrics', name: str, labels: Dict[str, str]):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        if exc_type is not None:
+            self.metrics.inc(error_name(self.name), **self.labels)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+def error_name(name: str) -> str:
+    """
+    returns: the counter that errors of the histogram name are counted in
+    """
+    return name[:-len('_seconds')] + '_errors_total' if name.endswith('_seconds') else name + '_errors_total'
+
+
+def _label_key(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key: Tuple[Tuple[str, str], ...], extra: str = '') -> str:
+    parts = [f'{name}="{value}"' for name, value in key]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Metrics:
+
+    def __init__(self):
+        # name -> label key -> value
+        self.counters: Dict[str, Dict[tuple, float]] = {}
+        self.histograms: Dict[str, Dict[tuple, Histogram]] = {}
+        self.gauges: Dict[str, Dict[tuple, Callable[[], float]]] = {}
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        series = self.counters.setdefault(name, {})
+        key = _label_key(labels)
+        series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        series = self.histograms.setdefault(name, {})
+        key = _label_key(labels)
+        if key not in series:
+            series[key] = Histogram()
+        series[key].observe(value)
+
+    def gauge(self, name: str, func: Callable[[], float], **labels):
+        """
+        Registers func to be called for the gauge's value whenever metrics are read
+        """
+        self.gauges.setdefault(name, {})[_label_key(labels)] = func
+
+    def timer(self, name: str, **labels) -> Timer:
+        return Timer(self, name, labels)
+
+    def prometheus(self) -> str:
+        lines = []
+        for name, series in sorted(self.counters.items()):
+            lines.append(f'# TYPE {name} counter')
+            for key, value in series.items():
+                lines.append(f'{name}{_format_labels(key)} {value}')
+        for name, series in sorted(self.gauges.items()):
+            lines.append(f'# TYPE {name} gauge')
+            for key, func in series.items():
+                lines.append(f'{name}{_format_labels(key)} {func()}')
+        for name, series in sorted(self.histograms.items()):
+            lines.append(f'# TYPE {name} histogram')
+            for key, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    labels = _format_labels(key, 'le="%s"' % bound)
+                    lines.append(f'{name}_bucket{labels} {cumulative}')
+                labels = _format_labels(key, 'le="+Inf"')
+                lines.append(f'{name}_bucket{labels} {histogram.count}')
+                lines.append(f'{name}_sum{_format_labels(key)} {histogram.sum}')
+                lines.append(f'{name}_count{_format_labels(key)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> List[str]:
+        """
+        returns: one human readable line per series
+        """
+        lines = []
+        for name, series in sorted(self.histograms.items()):
+            errors = self.counters.get(error_name(name), {})
+            for key, histogram in sorted(series.items()):
+                lines.append(f'{name}{_format_labels(key)} n={histogram.count} err={errors.get(key, 0):g} '
+                             f'p50={histogram.quantile(0.5) * 1000:.0f}ms '
+                             f'p95={histogram.quantile(0.95) * 1000:.0f}ms '
+                             f'p99={histogram.quantile(0.99) * 1000:.0f}ms')
+        for name, series in sorted(self.gauges.items()):
+            for key, func in sorted(series.items()):
+                lines.append(f'{name}{_format_labels(key)} {func():g}')
+        return lines
+
+    async def serve(self, port: int, host: str = '127.0.0.1'):
+        """
+        Serves the Prometheus text format at http://host:port/metrics
+        """
+        # Only imported when metrics are served, it adds noticeably to startup
+        from aiohttp import web
+
+        async def handle(request):
+            return web.Response(text=self.prometheus(), content_type='text/plain')
+
+        app = web.Application()
+        app.router.add_get('/metrics', handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+
+
+metrics = Metrics()
+
+
+def watch_cache(name: str, cache):
+    """
+    Registers gauges for the size and hit rate of a cache with a TTLCache style stats() method
+    """
+    def hit_ratio():
+        stats = cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        return stats['hits'] / lookups if lookups else 0
+
+    metrics.gauge('cache_entries', lambda: cache.stats()['entries'], cache=name)
+    metrics.gauge('cache_bytes', lambda: cache.stats()['bytes'], cache=name)
+    metrics.gauge('cache_hits', lambda: cache.stats()['hits'], cache=name)
+    metrics.gauge('cache_misses', lambda: cache.stats()['misses'], cache=name)
+    metrics.gauge('cache_evictions', lambda: cache.stats()['evictions'], cache=name)
+    metrics.gauge('cache_hit_ratio', hit_ratio, cache=name)
@@ -0,0 +1,304 @@
+"""
+Compact, typed forms of the HoYoLAB responses the bot keeps, parsed once when they arrive from genshinstats.
+Every model has __slots__ and is immutable, so cached responses can be shared, and is pickled and stored
+as a list of its field values rather than a dict.
+"""
+
+import sys
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class Model:
+    __slots__ = ()
+
+    def values(self) -> tuple:
+        # Fields are declared in the same order as __slots__
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __reduce__(self):
+        return self.__class__, self.values()
+
+    def to_json(self) -> list:
+        return [to_json(value) for value in self.values()]
+
+
+def to_json(value: Any) -> Any:
+    """
+    returns: value with every model in it replaced by the list of its field values
+    """
+    if isinstance(value, Model):
+        return value.to_json()
+    if isinstance(value, (tuple, list)):
+        return [to_json(item) for item in value]
+    return value
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    # Names and icon urls repeat across every cached player, interned they are stored once
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+@dataclass(frozen=True)
+class Weapon(Model):
+    __slots__ = ('name', 'rarity', 'level', 'ascension', 'refinement', 'icon')
+    name: str
+    rarity: int
+    level: int
+    ascension: int
+    refinement: int
+    icon: str
+
+    @classmethod
+    def parse(cls, data: Dict[str, Any]) -> 'Weapon':
+        return cls(_intern(data['name']), data['rarity'], data['level'], data['ascension'], data['refinement'],
+                   _intern(data['icon']))
+
+    @classmethod
+    def from_json(cls, values: list) -> 'Weapon':
+        name, rarity, level, ascension, refinement, icon = values
+        return cls(_intern(name), rarity, level, ascension, refinement, _intern(icon))
+
+
+@dataclass(frozen=True)
+class ArtifactSet(Model):
+    __slots__ = ('name', 'effects')
+    name: str
+    # (pieces, effect) of every set bonus
+    effects: Tuple[Tuple[int, str], ...]
+
+    @classmethod
+    def parse(cls, data: Dict[str, Any]) -> 'ArtifactSet':
+        return cls(_intern(data['name']),
+                   tuple((effect['pieces'], _intern(effect['effect'])) for effect in data['effects']))
+
+    @classmethod
+    def from_json(cls, values: list) -> 'ArtifactSet':
+        name, effects = values
+        return cls(_intern(name), tuple((pieces, _intern(effect)) for pieces, effect in effects))
+
+
+@dataclass(frozen=True)
+class Artifact(Model):
+    __slots__ = ('name', 'pos_name', 'rarity', 'level', 'icon', 'set')
+    name: str
+    pos_name: str
+    rarity: int
+    level: int
+    icon: str
+    set: ArtifactSet
+
+    @classmethod
+    def parse(cls, data: Dict[str, Any], sets: Dict[str, ArtifactSet]) -> 'Artifact':
+        """
+        sets: set name -> ArtifactSet already parsed, artifacts of the same set share it
+        """
+        artifact_set = sets.get(data['set']['name'])
+        if artifact_set is None:
+            artifact_set = sets[data['set']['name']] = ArtifactSet.parse(data['set'])
+        return cls(_intern(data['name']), _intern(data['pos_name']), data['rarity'], data['level'],
+                   _intern(data['icon']), artifact_set)
+
+    @classmethod
+    def from_json(cls, values: list, sets: Dict[str, ArtifactSet]) -> 'Artifact':
+        name, pos_name, rarity, level, icon, set_values = values
+        artifact_set = sets.get(set_values[0])
+        if artifact_set is None:
+            artifact_set = sets[set_values[0]] = ArtifactSet.from_json(set_values)
+        return cls(_intern(name), _intern(pos_name), rarity, level, _intern(icon), artifact_set)
+
+
+@dataclass(frozen=True)
+class Character(Model):
+    __slots__ = ('id', 'name', 'alt_name', 'rarity', 'element', 'level', 'friendship', 'constellation', 'icon',
+                 'weapon', 'artifacts')
+    id: int
+    name: str
+    alt_name: Optional[str]
+    rarity: int
+    element: str
+    level: int
+    friendship: int
+    constellation: int
+    icon: str
+    # Only known from gs.get_characters, None and empty in user stats
+    weapon: Optional[Weapon]
+    artifacts: Tuple[Artifact, ...]
+
+    def sort_key(self) -> tuple:
+        return self.rarity, self.level, self.friendship, self.name
+
+    @classmethod
+    def parse(cls, data: Dict[str, Any], sets: Dict[str, ArtifactSet]) -> 'Character':
+        weapon = Weapon.parse(data['weapon']) if data.get('weapon') else None
+        artifacts = tuple(Artifact.parse(artifact, sets) for artifact in data.get('artifacts') or [])
+        return cls(data['id'], _intern(data['name']), _intern(data.get('alt_name')), data['rarity'],
+                   _intern(data['element']), data['level'], data['friendship'], data.get('constellation', 0),
+                   _intern(data['icon']), weapon, artifacts)
+
+    @classmethod
+    def from_json(cls, values: list, sets: Dict[str, ArtifactSet]) -> 'Character':
+        id, name, alt_name, rarity, element, level, friendship, constellation, icon, weapon, artifacts = values
+        return cls(id, _intern(name), _intern(alt_name), rarity, _intern(element), level, friendship, constellation,
+                   _intern(icon), Weapon.from_json(weapon) if weapon else None,
+                   tuple(Artifact.from_json(artifact, sets) for artifact in artifacts))
+
+
+def parse_characters(data: List[Dict[str, Any]]) -> Tuple[Character, ...]:
+    sets = {}
+    return tuple(Character.parse(character, sets) for character in data)
+
+
+def load_characters(values: list) -> Tuple[Character, ...]:
+    sets = {}
+    return tuple(Character.from_json(character, sets) for character in values)
+
+
+@dataclass(frozen=True)
+class Profile(Model):
+    """
+    A player's stats and characters, best first.
+    Cached as parsed from user stats, where the fields from the record card are None, see GenshinData.get_info.
+    """
+    __slots__ = ('uid', 'nickname', 'adventure_rank', 'region', 'achievements', 'active_days', 'abyss_progress',
+                 'characters', 'last_updated')
+    uid: Optional[str]
+    nickname: Optional[str]
+    adventure_rank: Optional[int]
+    region: Optional[str]
+    achievements: int
+    active_days: int
+    # Deepest floor and chamber cleared, e.g. "12-3"
+    abyss_progress: str
+    characters: Tuple[Character, ...]
+    # Unix time the stats were fetched from HoYoLAB
+    last_updated: Optional[float]
+
+    @classmethod
+    def parse(cls, data: Dict[str, Any]) -> 'Profile':
+        """
+        data: a gs.get_user_stats response
+        """
+        characters = sorted(parse_characters(data['characters']), key=Character.sort_key, reverse=True)
+        stats = data['stats']
+        return cls(None, None, None, None, stats['achievements'], stats['active_days'],
+                   str(stats.get('spiral_abyss', '')), tuple(characters), None)
+
+    @classmethod
+    def from_json(cls, values: list) -> 'Profile':
+        *values, characters, last_updated = values
+        return cls(*values, load_characters(characters), last_updated)
+
+
+@dataclass(frozen=True)
+class AbyssChamber(Model):
+    __slots__ = ('chamber', 'stars', 'max_stars', 'first_half', 'second_half')
+    chamber: int
+    stars: int
+    max_stars: int
+    # Names of the characters used in each half
+    first_half: Tuple[str, ...]
+    second_half: Tuple[str, ...]
+
+    @classmethod
+    def parse(cls, data: Dict[str, Any]) -> 'AbyssChamber':
+        # Chambers without halves have a single battle
+        halves = [tuple(_intern(character['name']) for character in battle['characters'])
+                  for battle in data['battles']] + [(), ()]
+        return cls(data['chamber'], data['stars'], data['max_stars'], halves[0], halves[1])
+
+    @classmethod
+    def from_json(cls, values: list) -> 'AbyssChamber':
+        chamber, stars, max_stars, first_half, second_half = values
+        return cls(chamber, stars, max_stars, tuple(map(_intern, first_half)), tuple(map(_intern, second_half)))
+
+
+@dataclass(frozen=True)
+class AbyssFloor(Model):
+    __slots__ = ('floor', 'stars', 'max_stars', 'chambers')
+    floor: int
+    stars: int
+    max_stars: int
+    chambers: Tuple[AbyssChamber, ...]
+
+    @classmethod
+    def parse(cls, data: Dict[str, Any]) -> 'AbyssFloor':
+        return cls(data['floor'], data['stars'], data['max_stars'],
+                   tuple(AbyssChamber.parse(chamber) for chamber in data['chambers']))
+
+    @classmethod
+    def from_json(cls, values: list) -> 'AbyssFloor':
+        floor, stars, max_stars, chambers = values
+        return cls(floor, stars, max_stars, tuple(AbyssChamber.from_json(chamber) for chamber in chambers))
+
+
+@dataclass(frozen=True)
+class AbyssSeason(Model):
+    __slots__ = ('season', 'start_time', 'end_time', 'stats', 'ranks', 'floors', 'last_updated')
+    season: int
+    start_time: str
+    end_time: str
+    # (stat, value) in the order HoYoLAB gives them, e.g. ('total_stars', 36)
+    stats: Tuple[Tuple[str, Any], ...]
+    # (rank, character name, value) of the top character of each rank, up to the first rank nobody has
+    ranks: Tuple[Tuple[str, str, int], ...]
+    floors: Tuple[AbyssFloor, ...]
+    # Unix time the season was fetched from HoYoLAB
+    last_updated: Optional[float]
+
+    @property
+    def total_stars(self) -> int:
+        return dict(self.stats).get('total_stars', 0)
+
+    @property
+    def max_floor(self) -> str:
+        return str(dict(self.stats).get('max_floor', ''))
+
+    @classmethod
+    def parse(cls, data: Dict[str, Any]) -> 'AbyssSeason':
+        """
+        data: a gs.get_spiral_abyss response
+        """
+        ranks = []
+        for rank, characters in data['character_ranks'].items():
+            if not characters:
+                break
+            ranks.append((_intern(rank), _intern(characters[0]['name']), characters[0]['value']))
+        return cls(data['season'], str(data['season_start_time']), str(data['season_end_time']),
+                   tuple((_intern(stat), value) for stat, value in data['stats'].items()), tuple(ranks),
+                   tuple(AbyssFloor.parse(floor) for floor in data['floors']), None)
+
+    @classmethod
+    def from_json(cls, values: list) -> 'AbyssSeason':
+        season, start_time, end_time, stats, ranks, floors, last_updated = values
+        return cls(season, start_time, end_time, tuple((_intern(stat), value) for stat, value in stats),
+                   tuple((_intern(rank), _intern(name), value) for rank, name, value in ranks),
+                   tuple(AbyssFloor.from_json(floor) for floor in floors), last_updated)
+
+
+# Response kind -> (parse a genshinstats response, load what to_json stored), kinds not here are kept as they come
+KINDS: Dict[str, Tuple[Callable[[Any], Any], Callable[[Any], Any]]] = {
+    'user_stats': (Profile.parse, Profile.from_json),
+    'characters': (parse_characters, load_characters),
+    'spiral_abyss': (AbyssSeason.parse, AbyssSeason.from_json),
+}
+
+
+def parse(kind: str, data: Any) -> Any:
+    """
+    returns: the model of a genshinstats response of kind, data itself if kind has none or data is empty
+    """
+    if kind not in KINDS or not data:
+        return data
+    return KINDS[kind][0](data)
+
+
+def load(kind: str, data: Any) -> Any:
+    """
+    returns: the model to_json stored as data. Snapshots stored before responses were parsed are parsed instead.
+    """
+    if kind not in KINDS or not data:
+        return data
+    if isinstance(data, dict) or isinstance(data[0], dict):
+        return parse(kind, data)
+    return KINDS[kind][1](data)
@@ -0,0 +1,124 @@
+"""
+Keeps the most requested players' responses warm by refreshing them before they expire
+"""
+
+import datetime
+import heapq
+import math
+import time
+from typing import Dict, Hashable, List, Tuple
+
+from metrics import metrics
+from models import AbyssSeason
+
+
+def abyss_season_end(abyss: AbyssSeason) -> float:
+    """
+    returns: unix time the abyss season ends, 0 if unknown.
+    genshinstats only gives the date the season ends, the abyss resets at 04:00 server time on that date.
+    """
+    try:
+        end = datetime.datetime.strptime(abyss.end_time[:10], '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return 0
+    return (end + datetime.timedelta(hours=4)).timestamp()
+
+
+class DecayingCounter:
+    """
+    Request counts per key that halve every half_life seconds, so recent popularity outweighs old.
+    Once more than max_keys are counted the least popular half is forgotten.
+    """
+
+    def __init__(self, half_life: float, max_keys: int):
+        self.half_life = half_life
+        self.max_keys = max_keys
+        # key -> (count, time the count was last decayed)
+        self.counts: Dict[Hashable, Tuple[float, float]] = {}
+
+    def __len__(self):
+        return len(self.counts)
+
+    def _decayed(self, key: Hashable, now: float) -> float:
+        count, updated = self.counts[key]
+        return count * math.pow(0.5, (now - updated) / self.half_life)
+
+    def add(self, key: Hashable, amount: float = 1):
+        now = time.monotonic()
+        count = self._decayed(key, now) if key in self.counts else 0
+        self.counts[key] = (count + amount, now)
+        if len(self.counts) > self.max_keys:
+            for dropped, _ in self.top(len(self.counts))[self.max_keys // 2:]:
+                del self.counts[dropped]
+
+    def top(self, k: int) -> List[Tuple[Hashable, float]]:
+        """
+        returns: the k most popular (key, decayed count) pairs, most popular first
+        """
+        now = time.monotonic()
+        return heapq.nlargest(k, ((key, self._decayed(key, now)) for key in self.counts), key=lambda item: item[1])
+
+
+class Prefetcher:
+    """
+    Every INTERVAL seconds, refreshes the cached responses of the top_k most requested players that would
+    expire before the next run, spending at most budget upstream calls. Right after an abyss season ends,
+    abyss responses from the old season are refreshed first since everyone checks the new season then.
+    """
+
+    INTERVAL = 60
+    # Decayed request count below which a response is not worth refreshing, roughly two recent requests
+    MIN_POPULARITY = 1.5
+    # Seconds after the abyss reset before refreshing, so HoYoLAB has the new season
+    SEASON_DELAY = 5 * 60
+
+    def __init__(self, genshin_data, budget: int, top_k: int):
+        """
+        genshin_data: the GenshinData whose popular responses are refreshed
+        budget: upstream calls each run may make
+        """
+        self.genshin_data = genshin_data
+        self.budget = budget
+        self.top_k = top_k
+
+    def due(self) -> List[Tuple[str, Hashable]]:
+        """
+        returns: (kind, key) of the popular responses to refresh, most urgent first
+        """
+        season_end = self.genshin_data.abyss_season_end
+        new_season = season_end and time.time() >= season_end + self.SEASON_DELAY
+        urgent = []
+        due = []
+        for (kind, key), popularity in self.genshin_data.popularity.top(self.top_k):
+            if popularity < self.MIN_POPULARITY:
+                break
+            fetched_at = self.genshin_data.fetched_at(kind, key)
+            if fetched_at is None:
+                # Not cached anymore, someone popular will ask again soon
+                due.append((kind, key))
+            elif kind == 'spiral_abyss' and new_season and fetched_at < season_end:
+                urgent.append((kind, key))
+            elif time.time() - fetched_at > self.genshin_data.CACHE_TTL[kind] - 2 * self.INTERVAL:
+                due.append((kind, key))
+        return urgent + due
+
+    async def run_once(self) -> int:
+        """
+        returns: the number of responses refreshed
+        """
+        refreshed = 0
+        for kind, key in self.due():
+            if refreshed >= self.budget:
+                break
+            # Users waiting on the rate limit come first
+            if self.genshin_data.waiting(kind):
+                continue
+            try:
+                await self.genshin_data.refresh(kind, key)
+            except Exception as e:
+                print(f'Failed to prefetch {kind} {key}: {e}')
+                metrics.inc('prefetch_errors_total', kind=kind)
+            else:
+                metrics.inc('prefetch_total', kind=kind)
+            refreshed += 1
+        return refreshed
@@ -0,0 +1,76 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Hashable
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+class TokenBucket:
+    """
+    Allows rate requests per second on average with bursts of up to capacity requests.
+    Callers over the budget wait in order until a token is available or their timeout runs out.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.waiting = 0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._lock.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise RateLimitTimeout(f'Timed out after {timeout}s waiting for a request slot')
+        finally:
+            self.waiting -= 1
+        try:
+            self._refill()
+            if self.tokens < 1:
+                wait = (1 - self.tokens) / self.rate
+                if time.monotonic() + wait > deadline:
+                    raise RateLimitTimeout(f'Timed out after {timeout}s waiting for a request slot')
+                await asyncio.sleep(wait)
+                self._refill()
+            self.tokens -= 1
+        finally:
+            self._lock.release()
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls, every caller for a key shares the result of the first call.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    def running(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable]):
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._calls[key] = future
+            future.add_done_callback(lambda _: self._forget(key, future))
+        # One caller giving up should not cancel the call for everyone else
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
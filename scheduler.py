@@ -0,0 +1,139 @@
+"""
+Fair scheduling of commands between guilds, so one busy guild cannot starve the others
+"""
+
+import asyncio
+import itertools
+import time
+from typing import Dict, Hashable, List
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Ticket:
+    """
+    A command's place in the FairScheduler, granted once it may run
+    """
+
+    _seq = itertools.count()
+
+    def __init__(self, guild: Hashable, user: Hashable, cost: float, start: float):
+        self.guild = guild
+        self.user = user
+        self.cost = cost
+        # Virtual time the command starts at, the queue runs in order of it
+        self.start = start
+        self.seq = next(self._seq)
+        self.queued_at = time.monotonic()
+        self.granted = asyncio.get_event_loop().create_future()
+        self.released = False
+
+    def order(self):
+        return self.start, self.seq
+
+
+class FairScheduler:
+    """
+    Start-time fair queue of commands. Each guild gets an equal share of capacity, measured in the cost of the
+    commands running, no matter how many commands it sends: a guild's commands are ordered after the total cost
+    of its earlier ones, so a guild sending few cheap commands overtakes one sending many expensive ones.
+    A user runs at most user_concurrency commands at once and may have at most max_queued more waiting.
+    """
+
+    # Guilds remembered before those that have caught up with the virtual clock are forgotten
+    MAX_GUILDS = 1024
+
+    def __init__(self, capacity: float, user_concurrency: int, max_queued: int):
+        self.capacity = capacity
+        self.user_concurrency = user_concurrency
+        self.max_queued = max_queued
+        self.running = 0
+        self.virtual_time = 0
+        # guild -> virtual time its last queued command finishes at
+        self.finish: Dict[Hashable, float] = {}
+        self.queue: List[Ticket] = []
+        # user -> number of their commands running or waiting, users with none are left out
+        self.user_running: Dict[Hashable, int] = {}
+        self.user_queued: Dict[Hashable, int] = {}
+
+    def enqueue(self, guild: Hashable, user: Hashable, cost: float) -> Ticket:
+        """
+        Queues a command, it may run once ticket.granted is done, see wait
+        raises: QueueFull when the user already has max_queued commands waiting
+        """
+        if self.user_queued.get(user, 0) >= self.max_queued:
+            raise QueueFull(f'You already have {self.max_queued} commands waiting, try again once they are done.')
+        start = max(self.virtual_time, self.finish.get(guild, 0))
+        ticket = Ticket(guild, user, cost, start)
+        self.finish[guild] = start + cost
+        self.queue.append(ticket)
+        self.user_queued[user] = self.user_queued.get(user, 0) + 1
+        self._dispatch()
+        return ticket
+
+    async def wait(self, ticket: Ticket, timeout: float = None) -> bool:
+        """
+        returns: whether ticket was granted within timeout, it stays queued if not
+        """
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.granted), timeout)
+        except asyncio.TimeoutError:
+            return False
+        except asyncio.CancelledError:
+            self.release(ticket)
+            raise
+        return True
+
+    def release(self, ticket: Ticket):
+        """
+        Frees the capacity of a finished command, or takes a waiting one out of the queue
+        """
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.granted.done():
+            self.running -= ticket.cost
+            self._decrement(self.user_running, ticket.user)
+        else:
+            self.queue.remove(ticket)
+            self._decrement(self.user_queued, ticket.user)
+            ticket.granted.cancel()
+        if len(self.finish) > self.MAX_GUILDS:
+            # Guilds that have caught up are ordered the same as ones never seen
+            self.finish = {guild: finish for guild, finish in self.finish.items() if finish > self.virtual_time}
+        self._dispatch()
+
+    def position(self, ticket: Ticket) -> int:
+        """
+        returns: ticket's place in the queue, 1 being next, or 0 if it is not waiting
+        """
+        if ticket.granted.done():
+            return 0
+        order = ticket.order()
+        return 1 + sum(1 for other in self.queue if other.order() < order)
+
+    def _dispatch(self):
+        # Cheaper commands do not skip ahead of one waiting for room, or expensive ones would never run.
+        # Commands costing nothing never wait for room, and one costing more than the whole capacity runs alone.
+        blocked = False
+        for ticket in sorted(self.queue, key=Ticket.order):
+            if self.user_running.get(ticket.user, 0) >= self.user_concurrency:
+                continue
+            if ticket.cost and (blocked or self.running and self.running + ticket.cost > self.capacity):
+                blocked = True
+                continue
+            self.queue.remove(ticket)
+            self._decrement(self.user_queued, ticket.user)
+            self.user_running[ticket.user] = self.user_running.get(ticket.user, 0) + 1
+            self.running += ticket.cost
+            self.virtual_time = max(self.virtual_time, ticket.start)
+            ticket.granted.set_result(time.monotonic() - ticket.queued_at)
+
+    @staticmethod
+    def _decrement(counts: Dict[Hashable, int], key: Hashable):
+        if counts[key] == 1:
+            del counts[key]
+        else:
+            counts[key] -= 1
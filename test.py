@@ -1,3 +1,4 @@
+import asyncio
 import os
 
 from dotenv import load_dotenv
@@ -7,5 +8,6 @@ from genshin_data import GenshinData
 load_dotenv()
 uid = int(os.getenv('GENSHIN_UID'))
 token = os.getenv('GENSHIN_TOKEN')
-data = GenshinData(uid, token)
-print(data.get_info(46178811))
+data = GenshinData([(uid, token)])
+print(asyncio.run(data.check_accounts()))
+print(asyncio.run(data.get_info(46178811)))
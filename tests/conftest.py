@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The bot's modules live at the top of the repository and util reads its configuration at import
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('GENSHIN_DEV_ENDPOINT', 'https://api.genshin.dev')
@@ -0,0 +1,61 @@
+from cache import PrefixIndex, TTLCache, approximate_size
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(max_entries=2, max_bytes=10 ** 6)
+    cache.set('a', 1, 60)
+    cache.set('b', 2, 60)
+    assert cache.get('a') == 1
+    cache.set('c', 3, 60)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.evictions == 1
+
+
+def test_entries_are_evicted_by_size():
+    value = 'x' * 100
+    size = approximate_size(value)
+    cache = TTLCache(max_entries=100, max_bytes=2 * size)
+    for key in range(3):
+        cache.set(key, value, 60)
+    assert len(cache) == 2 and cache.size == 2 * size
+    assert cache.get(0) is None
+    # A value bigger than the whole cache is not stored
+    cache.set('big', 'x' * 1000, 60)
+    assert cache.get('big') is None and len(cache) == 2
+
+
+def test_expired_entries_are_misses():
+    cache = TTLCache(max_entries=10, max_bytes=10 ** 6)
+    cache.set('a', 1, 0)
+    assert cache.peek('a') is None
+    assert cache.get('a', 'default') == 'default'
+    assert len(cache) == 0 and cache.size == 0
+    assert cache.stats()['misses'] == 1
+
+
+def test_peek_does_not_change_recency_or_stats():
+    cache = TTLCache(max_entries=2, max_bytes=10 ** 6)
+    cache.set('a', 1, 60)
+    cache.set('b', 2, 60)
+    assert cache.peek('a') == 1
+    cache.set('c', 3, 60)
+    assert cache.peek('a') is None
+    assert cache.stats()['hits'] == 0
+
+
+def test_prefix_index_puts_exact_match_first():
+    index = PrefixIndex(max_entries=10)
+    for name in ('alice_fan', 'Alice', 'alicia', 'bob'):
+        index.add(name, name)
+    assert 'ALICE' in index and 'ali' not in index
+    assert index.search('alice', 10) == ['Alice', 'alice_fan']
+    assert index.search('ali', 2) == ['Alice', 'alice_fan']
+
+
+def test_prefix_index_drops_oldest_names():
+    index = PrefixIndex(max_entries=2)
+    for name in ('alice_fan', 'Alice', 'alicia'):
+        index.add(name, name)
+    assert 'alice_fan' not in index
+    assert index.search('ali', 10) == ['Alice', 'alicia']
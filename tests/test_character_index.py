@@ -0,0 +1,54 @@
+from character_index import CharacterIndex, display_name, edit_distance
+
+# Ids as genshin.dev gives them, it shortens some of HoYoLAB's names
+CHARACTERS = ['albedo', 'arataki-itto', 'ayaka', 'ayato', 'diluc', 'hu-tao', 'kazuha', 'kokomi', 'raiden', 'sara',
+              'tartaglia', 'traveler-anemo', 'traveler-geo', 'xiangling', 'xiao', 'xingqiu', 'yae-miko']
+
+
+def test_edit_distance():
+    assert edit_distance('kitten', 'sitting', 5) == 3
+    # Swapped neighbours are one typo
+    assert edit_distance('xaio', 'xiao', 3) == 1
+    assert edit_distance('abcdef', 'zzzzzz', 2) == 3
+
+
+def test_hoyolab_names_resolve_to_shortened_ids():
+    index = CharacterIndex(CHARACTERS)
+    assert index.exact('Kamisato Ayaka') == ('ayaka',)
+    assert index.exact('Kaedehara Kazuha') == ('kazuha',)
+    assert index.exact('Sangonomiya Kokomi') == ('kokomi',)
+    assert index.exact('Kujou Sara') == ('sara',)
+    assert index.exact('Raiden Shogun') == ('raiden',)
+    assert index.exact('Traveler') == ('traveler-anemo', 'traveler-geo')
+
+
+def test_exact_aliases():
+    index = CharacterIndex(CHARACTERS)
+    assert index.lookup('Hu Tao') == ('hu-tao',)
+    assert index.lookup('ayaka') == ('ayaka',)
+    assert index.lookup('itto') == ('arataki-itto',)
+    assert index.lookup('childe') == ('tartaglia',)
+    assert index.lookup('shogun') == ('raiden',)
+    assert index.lookup('kamisato') == ('ayaka', 'ayato')
+
+
+def test_fuzzy_matches_typos_only():
+    index = CharacterIndex(CHARACTERS)
+    assert index.lookup('xingqui') == ('xingqiu',)
+    assert index.lookup('dilux') == ('diluc',)
+    assert index.lookup('zzz') == ()
+    assert index.lookup('') == ()
+
+
+def test_resolve_names_spanning_words():
+    index = CharacterIndex(CHARACTERS)
+    assert index.resolve(['hu', 'tao', 'Xiao']) == [('hu tao', ('hu-tao',)), ('Xiao', ('xiao',))]
+    assert index.resolve(['kamisato', 'ayaka']) == [('kamisato ayaka', ('ayaka',))]
+    assert index.resolve(['kamisato', 'ayka']) == [('kamisato ayka', ('ayaka',))]
+    assert index.resolve(['kazuha', 'ei']) == [('kazuha', ('kazuha',)), ('ei', ('raiden',))]
+    assert index.resolve(['traveler']) == [('traveler', ('traveler-anemo', 'traveler-geo'))]
+
+
+def test_display_name():
+    assert display_name('hu-tao') == 'Hu Tao'
+    assert display_name('ayaka') == 'Ayaka'
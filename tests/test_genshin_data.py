@@ -0,0 +1,106 @@
+import asyncio
+import threading
+import time
+
+import genshinstats as gs
+import pytest
+
+from database import AsyncDatabase
+from genshin_data import GenshinData
+
+UID = 1
+CARD = {'game_role_id': '600000001', 'nickname': 'Lumine', 'level': 55, 'region_name': 'America'}
+STORED = {**CARD, 'level': 50}
+
+
+class FakeUpstream:
+    """
+    Stands in for a genshinstats function, counting its calls
+    """
+
+    def __init__(self, result=None, error: Exception = None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+
+    def __call__(self, uid, cookie=None):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return self.result
+
+
+@pytest.fixture
+def data(tmp_path):
+    snapshots = AsyncDatabase(str(tmp_path / 'bot.db'))
+    return GenshinData([(1, 'token')], snapshots=snapshots)
+
+
+def store(data: GenshinData, age: float):
+    data.snapshots.database.set_snapshot('record_card', str(UID), STORED, time.time() - age)
+
+
+def test_fresh_snapshot_answered_without_upstream(data):
+    store(data, age=10)
+    upstream = FakeUpstream(error=AssertionError('called HoYoLAB'))
+    result, _ = asyncio.run(data._fetch_entry('record_card', UID, False, upstream, UID))
+    assert result == STORED
+    assert upstream.calls == 0
+    assert not data.refreshes
+
+
+def test_stale_snapshot_answered_and_refreshed_once(data):
+    store(data, age=GenshinData.CACHE_TTL['record_card'] + 10)
+    upstream = FakeUpstream(CARD)
+
+    async def main():
+        first = await data._fetch_entry('record_card', UID, False, upstream, UID)
+        # Answered from the stale snapshot now in memory, without a second refresh
+        second = await data._fetch_entry('record_card', UID, False, upstream, UID)
+        assert len(data.refreshes) == 1
+        await asyncio.gather(*data.refreshes)
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first[0] == second[0] == STORED
+    assert upstream.calls == 1
+    assert data.cached('record_card', UID) == CARD
+    assert data.snapshots.database.get_snapshot('record_card', str(UID))[0] == CARD
+
+
+def test_failure_falls_back_to_old_snapshot(data):
+    store(data, age=GenshinData.SNAPSHOT_MAX_AGE + 10)
+    upstream = FakeUpstream(error=ConnectionError('HoYoLAB is down'))
+    result, _ = asyncio.run(data._fetch_entry('record_card', UID, False, upstream, UID))
+    assert result == STORED
+    assert upstream.calls == 1
+
+
+def test_user_errors_not_answered_from_snapshot(data):
+    store(data, age=GenshinData.SNAPSHOT_MAX_AGE + 10)
+    upstream = FakeUpstream(error=gs.errors.DataNotPublic('private'))
+    with pytest.raises(gs.errors.DataNotPublic):
+        asyncio.run(data._fetch_entry('record_card', UID, False, upstream, UID))
+
+
+def test_fresh_request_does_not_join_cached_flight(data):
+    release = threading.Event()
+
+    def slow(uid, cookie=None):
+        release.wait(5)
+        return STORED
+
+    fresh = FakeUpstream(CARD)
+
+    async def main():
+        cached = asyncio.ensure_future(data._fetch_entry('record_card', UID, False, slow, UID))
+        await asyncio.sleep(0.05)
+        result, _ = await data._fetch_entry('record_card', UID, True, fresh, UID)
+        # The fresh request finished while the cached path's call is still waiting
+        assert not cached.done()
+        release.set()
+        await cached
+        return result
+
+    assert asyncio.run(main()) == CARD
+    assert fresh.calls == 1
@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+import models
+from benchmarks import fixtures
+
+RESPONSES = {
+    'user_stats': fixtures.user_stats,
+    'characters': fixtures.characters,
+    'spiral_abyss': fixtures.spiral_abyss,
+}
+
+
+@pytest.mark.parametrize('kind', sorted(RESPONSES))
+def test_round_trip_through_snapshot_json(kind):
+    parsed = models.parse(kind, RESPONSES[kind]())
+    # Stored the way Database.set_snapshot stores it
+    stored = json.loads(json.dumps(models.to_json(parsed), default=str))
+    assert models.load(kind, stored) == parsed
+
+
+def test_artifact_sets_shared_after_load():
+    characters = models.load('characters', models.to_json(models.parse('characters', fixtures.characters())))
+    sets = {}
+    for character in characters:
+        for artifact in character.artifacts:
+            assert sets.setdefault(artifact.set.name, artifact.set) is artifact.set
+
+
+@pytest.mark.parametrize('kind', sorted(RESPONSES))
+def test_snapshots_stored_unparsed_are_parsed(kind):
+    raw = RESPONSES[kind]()
+    assert models.load(kind, json.loads(json.dumps(raw))) == models.parse(kind, raw)
+
+
+def test_kinds_without_model_kept_as_they_come():
+    card = fixtures.record_card()
+    assert models.parse('record_card', card) is card
+    assert models.load('record_card', models.to_json(card)) == card
@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+import pytest
+
+from rate_limit import RateLimitTimeout, SingleFlight, TokenBucket
+
+
+def test_burst_then_refill():
+    async def main():
+        bucket = TokenBucket(rate=50, capacity=2)
+        start = time.monotonic()
+        await bucket.acquire(1)
+        await bucket.acquire(1)
+        assert bucket.tokens < 1
+        # The third request waits for a token to be refilled at 50 a second
+        await bucket.acquire(1)
+        assert time.monotonic() - start >= 0.015
+    asyncio.run(main())
+
+
+def test_tokens_never_exceed_capacity():
+    async def main():
+        bucket = TokenBucket(rate=1000, capacity=2)
+        await asyncio.sleep(0.01)
+        bucket._refill()
+        assert bucket.tokens == 2
+    asyncio.run(main())
+
+
+def test_timeout_when_no_token_in_time():
+    async def main():
+        bucket = TokenBucket(rate=0.1, capacity=1)
+        await bucket.acquire(1)
+        with pytest.raises(RateLimitTimeout):
+            await bucket.acquire(0.05)
+        assert bucket.waiting == 0
+    asyncio.run(main())
+
+
+def test_single_flight_shares_one_call():
+    async def main():
+        flight = SingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        results = await asyncio.gather(*[flight.do('key', fetch) for _ in range(5)])
+        assert results == [1] * 5 and len(calls) == 1
+        assert not flight.running('key')
+        # Once done the next call goes through again
+        assert await flight.do('key', fetch) == 2
+    asyncio.run(main())
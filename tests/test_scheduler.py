@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from scheduler import FairScheduler, QueueFull
+
+
+def run(coroutine_function):
+    # Tickets make their futures on the running event loop
+    return asyncio.run(coroutine_function())
+
+
+def test_guilds_share_capacity_fairly():
+    async def main():
+        scheduler = FairScheduler(capacity=1, user_concurrency=1, max_queued=3)
+        busy = [scheduler.enqueue('busy', user, 1) for user in ('a', 'b', 'c')]
+        quiet = scheduler.enqueue('quiet', 'd', 1)
+        assert busy[0].granted.done() and not quiet.granted.done()
+        assert scheduler.position(quiet) == 1
+        scheduler.release(busy[0])
+        # The quiet guild's only command goes before the busy guild's second one
+        assert quiet.granted.done() and not busy[1].granted.done()
+        scheduler.release(quiet)
+        assert busy[1].granted.done()
+    run(main)
+
+
+def test_user_concurrency_limit():
+    async def main():
+        scheduler = FairScheduler(capacity=10, user_concurrency=1, max_queued=3)
+        first = scheduler.enqueue('guild', 'user', 1)
+        second = scheduler.enqueue('guild', 'user', 1)
+        other = scheduler.enqueue('guild', 'other', 1)
+        assert first.granted.done() and not second.granted.done() and other.granted.done()
+        scheduler.release(first)
+        assert second.granted.done()
+        assert scheduler.user_running == {'user': 1, 'other': 1}
+    run(main)
+
+
+def test_costly_command_is_not_starved():
+    async def main():
+        scheduler = FairScheduler(capacity=4, user_concurrency=1, max_queued=3)
+        cheap = scheduler.enqueue('a', 'a', 1)
+        costly = scheduler.enqueue('b', 'b', 4)
+        later = scheduler.enqueue('c', 'c', 1)
+        # The later cheap command would fit but waits behind the costly one
+        assert cheap.granted.done() and not costly.granted.done() and not later.granted.done()
+        scheduler.release(cheap)
+        assert costly.granted.done() and not later.granted.done()
+        scheduler.release(costly)
+        assert later.granted.done()
+    run(main)
+
+
+def test_free_commands_never_wait_for_room():
+    async def main():
+        scheduler = FairScheduler(capacity=1, user_concurrency=1, max_queued=3)
+        scheduler.enqueue('a', 'a', 1)
+        blocked = scheduler.enqueue('b', 'b', 1)
+        free = scheduler.enqueue('c', 'c', 0)
+        assert not blocked.granted.done() and free.granted.done()
+    run(main)
+
+
+def test_queue_full():
+    async def main():
+        scheduler = FairScheduler(capacity=10, user_concurrency=1, max_queued=1)
+        scheduler.enqueue('guild', 'user', 1)
+        waiting = scheduler.enqueue('guild', 'user', 1)
+        with pytest.raises(QueueFull):
+            scheduler.enqueue('guild', 'user', 1)
+        # Giving up on a waiting command makes room for another
+        scheduler.release(waiting)
+        assert waiting.granted.cancelled()
+        scheduler.enqueue('guild', 'user', 1)
+    run(main)
+
+
+def test_wait_times_out_and_keeps_the_ticket_queued():
+    async def main():
+        scheduler = FairScheduler(capacity=1, user_concurrency=1, max_queued=3)
+        running = scheduler.enqueue('a', 'a', 1)
+        waiting = scheduler.enqueue('b', 'b', 1)
+        assert not await scheduler.wait(waiting, 0.01)
+        assert scheduler.position(waiting) == 1
+        scheduler.release(running)
+        assert await scheduler.wait(waiting, 0.01)
+        scheduler.release(waiting)
+        # Releasing twice does not free capacity twice
+        scheduler.release(waiting)
+        assert scheduler.running == 0
+    run(main)
@@ -0,0 +1,27 @@
+import util
+
+
+def brute_force(material_type: str, start_level: int, end_level: int):
+    totals = {}
+    for rarity, amount in util.TALENT_LEVEL_AMOUNTS[material_type][start_level:end_level]:
+        if amount:
+            totals[rarity] = totals.get(rarity, 0) + amount
+    return sorted(totals.items())
+
+
+def test_required_talent_materials_matches_every_range():
+    for material_type in util.TALENT_LEVEL_AMOUNTS:
+        for start_level in range(1, util.MAX_TALENT_LEVEL):
+            for end_level in range(start_level + 1, util.MAX_TALENT_LEVEL + 1):
+                assert util.required_talent_materials(material_type, start_level, end_level) == \
+                       brute_force(material_type, start_level, end_level)
+
+
+def test_full_talent_book_cost():
+    assert util.required_talent_materials('talent-book', 1, 10) == [(2, 3), (3, 21), (4, 38)]
+
+
+def test_talent_material_index():
+    assert util.talent_material_index('talent-book', 2) == 0
+    assert util.talent_material_index('talent-book', 4) == 2
+    assert util.talent_material_index('crown', 5) == 0
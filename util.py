@@ -1,23 +1,68 @@
+import hashlib
+import json
+import multiprocessing
 import os
-from typing import List, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Dict, List, Tuple
 
 import requests
-from PIL import Image
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 
-from database import Database
+from database import AsyncDatabase, Database
 
 load_dotenv()
 ENDPOINT = os.getenv('GENSHIN_DEV_ENDPOINT')
 ELEMENT_ENDPOINT = os.getenv('GENSHIN_DEV_ELEMENTS')
 db_file = os.getenv('DATABASE_FILE')
+# Number of images downloaded at once by download_images_batch
+IMAGE_WORKERS = 8
 
 if not ENDPOINT:
     raise Exception("Expected endpoint variable to be not None")
-if not db_file:
-    raise Exception("Expected db_file variable to be not None")
 
-db = Database(db_file)
+
+def get_db() -> Database:
+    """
+    returns: the bot's database, waiting for get_adb() to open it if it is still opening
+    """
+    global db
+    if 'db' not in globals():
+        db = get_adb().database
+    return db
+
+
+def get_adb() -> AsyncDatabase:
+    """
+    returns: the awaitable view of the bot's database, cogs go through it so database work happens off the
+    event loop. The database is opened on its worker thread on first use rather than at import.
+    """
+    global adb
+    if 'adb' not in globals():
+        if not db_file:
+            raise Exception("Expected db_file variable to be not None")
+        adb = AsyncDatabase(db_file)
+    return adb
+
+
+def __getattr__(name: str):
+    # util.db and util.adb are made on first access, after which they are plain module attributes
+    if name == 'db':
+        return get_db()
+    if name == 'adb':
+        return get_adb()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_converters() -> ProcessPoolExecutor:
+    """
+    returns: the process pool images are converted in, started on the first conversion and kept for later ones.
+    Its workers are spawned, forking would copy the bot's threads' locks in whatever state they are in.
+    """
+    global _converters
+    if '_converters' not in globals():
+        _converters = ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+    return _converters
 
 
 def get_character_list():
@@ -34,42 +79,209 @@ def get_element_icon(element: str):
     return ENDPOINT + ELEMENT_ENDPOINT + element + '/icon'
 
 
-def get_character_emojis(overwrite: bool = False) -> List[str]:
+def get_character_emoji_entries() -> List[Tuple[str, str, str]]:
+    """
+    returns: (name, category, url) emoji entries for every character, ready for Database.add_emojis
+    """
     character_list = get_character_list()
-    added = []
-    if character_list:
-        for character in character_list:
-            url = f'{ENDPOINT}/characters/{character}/icon'
-            if db.add_emoji(character, 'character', url, overwrite):
-                added.append(character)
-    return added
+    if not character_list:
+        return []
+    return [(character, 'character', f'{ENDPOINT}/characters/{character}/icon') for character in character_list]
+
+
+def get_character_emojis(overwrite: bool = False) -> List[str]:
+    return get_db().add_emojis(get_character_emoji_entries(), overwrite)
+
 
+def get_image_session() -> requests.Session:
+    """
+    returns: a session whose connection pool fits IMAGE_WORKERS concurrent downloads
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=IMAGE_WORKERS, pool_maxsize=IMAGE_WORKERS)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
-def get_image(url: str, name: str):
-    request = requests.get(url)
-    open(name, 'wb').write(request.content)
+
+def get_image(url: str, name: str, session: requests.Session = None, headers: Dict[str, str] = None):
+    """
+    Streams url to the file name, the file is only replaced once the download finished.
+    returns: the response and sha256 hex digest of its content, the digest is None if the server answered 304
+    """
+    request = (session or requests).get(url, headers=headers, stream=True, timeout=30)
+    with request:
+        if request.status_code == 304:
+            return request, None
+        request.raise_for_status()
+        digest = hashlib.sha256()
+        with open(f'{name}.tmp', 'wb') as f:
+            for chunk in request.iter_content(chunk_size=64 * 1024):
+                digest.update(chunk)
+                f.write(chunk)
+    os.replace(f'{name}.tmp', name)
+    return request, digest.hexdigest()
 
 
 def convert_img(path: str, name: str):
+    # Pillow is slow to import and only needed when emojis are uploaded
+    from PIL import Image
     im = Image.open(path).convert('RGBA')
     im.save(f'{name}.png', 'png')
     return f'{name}.png'
 
 
-def download_images(url: str, name: str, category: str):
+def _image_paths(name: str, category: str):
+    """
+    returns: (raw download path, converted path without extension, folder of the raw downloads)
+    """
     if category:
-        dest_name = f'{category}/raw/{name}'
-        dest_final = f'{category}/{name}'
-        dest_folder = f'{category}/raw'
-    else:
-        dest_name = f'raw/{name}'
-        dest_final = {name}
-        dest_folder = f'raw'
+        return f'{category}/raw/{name}', f'{category}/{name}', f'{category}/raw'
+    return f'raw/{name}', f'{name}', 'raw'
+
+
+def download_images(url: str, name: str, category: str):
+    dest_name, dest_final, dest_folder = _image_paths(name, category)
     if not os.path.exists(dest_folder):
         os.makedirs(dest_folder)
     get_image(url, dest_name)
     return convert_img(dest_name, dest_final)
 
+
+def _download_image(session: requests.Session, url: str, name: str, category: str, cached: Dict[str, str]):
+    """
+    Downloads one image for download_images_batch, skipping it when it matches the manifest entry in cached
+    returns: (new manifest entry, whether the image needs converting)
+    """
+    dest_name, dest_final, _ = _image_paths(name, category)
+    have_files = os.path.exists(dest_name) and os.path.exists(f'{dest_final}.png')
+    headers = {}
+    if have_files and cached.get('url') == url:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    request, digest = get_image(url, dest_name, session, headers)
+    if digest is None:
+        return cached, False
+    entry = {
+        'url': url,
+        'etag': request.headers.get('ETag'),
+        'last_modified': request.headers.get('Last-Modified'),
+        'sha256': digest,
+    }
+    return entry, not (have_files and digest == cached.get('sha256'))
+
+
+def download_images_batch(images: List[Tuple[str, str]], category: str) -> List[Dict[str, any]]:
+    """
+    Downloads (name, url) images concurrently over one pooled session and converts the ones that changed
+    to png in a process pool. Images are skipped when their ETag, Last-Modified or content hash matches the
+    last download, recorded in the raw folder's manifest.json.
+    returns: a dict per image, in the order given, with keys:
+    {
+        'name': <image-name>,
+        'file': <converted png path, None on error>,
+        'changed': <whether the png was rewritten>,
+        'error': <exception, None on success>,
+    }
+    """
+    _, _, dest_folder = _image_paths('', category)
+    if not os.path.exists(dest_folder):
+        os.makedirs(dest_folder)
+    manifest_file = f'{dest_folder}/manifest.json'
+    try:
+        with open(manifest_file, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    results = {name: {'name': name, 'file': None, 'changed': False, 'error': None} for name, _ in images}
+    conversions = {}
+    with get_image_session() as session, \
+            ThreadPoolExecutor(max_workers=IMAGE_WORKERS) as downloads:
+        futures = {downloads.submit(_download_image, session, url, name, category, manifest.get(name, {})): name
+                   for name, url in images}
+        # Convert each image as soon as its download finishes
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                manifest[name], changed = future.result()
+            except (requests.RequestException, OSError) as e:
+                results[name]['error'] = e
+                continue
+            dest_name, dest_final, _ = _image_paths(name, category)
+            if changed:
+                conversions[name] = get_converters().submit(convert_img, dest_name, dest_final)
+            else:
+                results[name]['file'] = f'{dest_final}.png'
+
+        for name, future in conversions.items():
+            try:
+                results[name]['file'] = future.result()
+                results[name]['changed'] = True
+            except (OSError, ValueError) as e:
+                results[name]['error'] = e
+                manifest.pop(name, None)
+
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f)
+    return list(results.values())
+
+
+# Materials needed to raise one talent from level i to level i + 1, each in form (rarity, amount)
+TALENT_LEVEL_AMOUNTS = {
+    'talent-book': [(0, 0), (2, 3), (3, 2), (3, 4), (3, 6), (3, 9), (4, 4), (4, 6), (4, 12), (4, 16)],
+    'boss-material': [(0, 0)] * 6 + [(5, 1), (5, 1), (5, 2), (5, 2)],
+    'common-ascension-material': [(0, 0), (1, 6), (2, 3), (2, 4), (2, 6), (2, 9), (3, 4), (3, 6), (3, 9), (3, 12)],
+    'crown': [(0, 0)] * 9 + [(5, 1)],
+}
+MAX_TALENT_LEVEL = len(TALENT_LEVEL_AMOUNTS['talent-book'])
+
+
+"""
+amts_per_level: a list containing tuples, each in form (rarity, amount)
+returns: a dict mapping each rarity, in increasing order, to a list whose entry i is the total amount of
+that rarity in amts_per_level[0..i]
+"""
+def build_material_prefix_sums(amts_per_level: List[Tuple[int, int]]) -> Dict[int, List[int]]:
+    rarities = sorted({rarity for rarity, amt in amts_per_level if amt != 0})
+    sums = {}
+    for rarity in rarities:
+        total = 0
+        sums[rarity] = []
+        for level_rarity, level_amt in amts_per_level:
+            if level_rarity == rarity:
+                total += level_amt
+            sums[rarity].append(total)
+    return sums
+
+
+TALENT_MATERIAL_SUMS = {material_type: build_material_prefix_sums(amts)
+                        for material_type, amts in TALENT_LEVEL_AMOUNTS.items()}
+
+
+"""
+returns: a list containing tuples, each in form (rarity, amount), of the material_type needed to raise one
+talent from start_level to end_level. Rarities are in increasing order and rarities not needed are left out.
+"""
+def required_talent_materials(material_type: str, start_level: int, end_level: int) -> List[Tuple[int, int]]:
+    ret = []
+    for rarity, sums in TALENT_MATERIAL_SUMS[material_type].items():
+        amt = sums[end_level - 1] - sums[start_level - 1]
+        if amt != 0:
+            ret.append((rarity, amt))
+    return ret
+
+
+"""
+returns: the position of the material with the given rarity in a genshin.dev list of material_type items
+"""
+def talent_material_index(material_type: str, rarity: int) -> int:
+    return list(TALENT_MATERIAL_SUMS[material_type]).index(rarity)
+
+
 """
 amts_per_level: a list containing tuples, each in form (rarity, amount)
 requires: rarities in amts_per_level are in non-decreasing order